@@ -0,0 +1,94 @@
+"""Shows the adaptive limiter converging on a mock upstream's real capacity.
+
+The mock upstream serves `capacity` requests at `base_latency`; beyond that
+it behaves like a processor-sharing queue (latency grows with load), and
+past `reject_factor * capacity` concurrent requests it answers with a rate
+limit error. A closed loop of clients, many more than the capacity, drives
+it through the limiter.
+
+Usage:
+    python benchmarks/adaptive_limiter_bench.py --capacity 20 --clients 100
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.adaptive_limiter import AdaptiveLimiter  # noqa: E402
+
+
+class MockRateLimited(Exception):
+    pass
+
+
+class MockUpstream:
+    def __init__(self, capacity: int, base_latency: float, reject_factor: float):
+        self.capacity = capacity
+        self.base_latency = base_latency
+        self.reject_at = int(capacity * reject_factor)
+        self.in_flight = 0
+        self.completed = 0
+        self.rejected = 0
+
+    async def call(self) -> None:
+        if self.in_flight >= self.reject_at:
+            self.rejected += 1
+            raise MockRateLimited()
+        self.in_flight += 1
+        try:
+            load = max(1.0, self.in_flight / self.capacity)
+            await asyncio.sleep(self.base_latency * load)
+            self.completed += 1
+        finally:
+            self.in_flight -= 1
+
+
+async def run(args) -> None:
+    upstream = MockUpstream(args.capacity, args.base_latency, args.reject_factor)
+    limiter = AdaptiveLimiter(
+        "bench", initial_limit=args.initial_limit, max_limit=1000, rate_limit_errors=(MockRateLimited,)
+    )
+    deadline = time.monotonic() + args.duration
+
+    async def client() -> None:
+        while time.monotonic() < deadline:
+            try:
+                async with limiter.slot():
+                    await upstream.call()
+            except MockRateLimited:
+                await asyncio.sleep(args.base_latency)
+
+    async def report() -> None:
+        started = time.monotonic()
+        while time.monotonic() < deadline:
+            await asyncio.sleep(args.duration / 10)
+            print(
+                f"t={time.monotonic() - started:5.1f}s limit={limiter.limit:6.1f} "
+                f"upstream_in_flight={upstream.in_flight:4d} reason={limiter.last_reason}"
+            )
+
+    await asyncio.gather(report(), *(client() for _ in range(args.clients)))
+    throughput = upstream.completed / args.duration
+    ideal = args.capacity / args.base_latency
+    print(
+        f"\ncapacity={args.capacity} final_limit={limiter.limit:.1f} "
+        f"throughput={throughput:.0f}/s (ideal {ideal:.0f}/s) rejected={upstream.rejected}"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--capacity", type=int, default=20)
+    parser.add_argument("--clients", type=int, default=100)
+    parser.add_argument("--initial-limit", type=float, default=5)
+    parser.add_argument("--base-latency", type=float, default=0.02)
+    parser.add_argument("--reject-factor", type=float, default=3.0)
+    parser.add_argument("--duration", type=float, default=10.0)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""Times request canonicalization against prompt size.
+
+For each size, builds /generate bodies whose prompt is ASCII prose, once
+already clean and once with CRLF line endings and trailing spaces on every
+line (the worst case: every normalization step rewrites the text), and a
+/question body with the noisy text. Reports the mean time of `canonicalize`
+for each and, separately, of the 128-bit BLAKE2b digest next to SHA-256 on
+the same payload. Clean prompts take the fast paths; everything grows
+linearly with size.
+
+Usage:
+    python benchmarks/canonical_bench.py --sizes 100 1000 10000 100000 1000000
+"""
+import argparse
+import hashlib
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.canonical import canonicalize  # noqa: E402
+
+
+def prompt(size: int, noisy: bool = True) -> str:
+    line = "Summarize the request latency of each upstream call and explain the result."
+    line += "  \r\n" if noisy else "\n"
+    return (line * (size // len(line) + 1))[:size].strip()
+
+
+def mean_us(func, number: int) -> float:
+    return min(timeit.repeat(func, number=number, repeat=3)) / number * 1e6
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 10000, 100000, 1000000])
+    args = parser.parse_args()
+
+    print(
+        f"{'prompt bytes':>12}{'generate clean us':>19}{'generate noisy us':>19}{'question noisy us':>19}"
+        f"{'blake2b-128 us':>16}{'sha256 us':>11}"
+    )
+    for size in args.sizes:
+        text = prompt(size)
+        clean = {"prompt": prompt(size, noisy=False), "model": "auto", "temperature": 0.0, "max_tokens": 100}
+        generate = {"prompt": text, "model": "auto", "temperature": 0.0, "max_tokens": 100}
+        question = {"question": text, "model": "auto"}
+        payload = text.encode("utf-8")
+        number = max(3, 200000 // max(size, 1))
+        print(
+            f"{size:>12}"
+            f"{mean_us(lambda: canonicalize('generate', clean), number):>19.1f}"
+            f"{mean_us(lambda: canonicalize('generate', generate), number):>19.1f}"
+            f"{mean_us(lambda: canonicalize('question', question), number):>19.1f}"
+            f"{mean_us(lambda: hashlib.blake2b(payload, digest_size=16).digest(), number):>16.1f}"
+            f"{mean_us(lambda: hashlib.sha256(payload).digest(), number):>11.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""Measures how much code formatting stalls the event loop, inline and in the pool.
+
+Formats `--jobs` generated Python snippets of `--lines` lines each, with
+`--concurrency` in flight. While they run, a ticker coroutine records how
+late each of its 1 ms sleeps wakes up. Formatting inline with black holds
+the loop for the whole format; CodePipeline runs it in worker processes, so
+the loop stays responsive. Reports throughput and the ticker's worst and
+p99 lag for both.
+
+Usage:
+    python benchmarks/code_pipeline_bench.py --jobs 40 --lines 200 --workers 4
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.code_pipeline import CodePipeline  # noqa: E402
+from utils.code_processing import process_code  # noqa: E402
+
+
+def snippet(index: int, lines: int) -> str:
+    body = "\n".join(f"  value_{i} = compute( {index}, {i} )+ {{ 'k':{i} }}['k']" for i in range(lines))
+    return f"```python\ndef job_{index}( ):\n{body}\n  return value_0\n```"
+
+
+async def ticker(lags: list[float], stop: asyncio.Event) -> None:
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(0.001)
+        lags.append(time.perf_counter() - started - 0.001)
+
+
+async def measure(name: str, texts: list[str], concurrency: int, process) -> None:
+    lags: list[float] = []
+    stop = asyncio.Event()
+    ticking = asyncio.create_task(ticker(lags, stop))
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(text: str) -> None:
+        async with semaphore:
+            await process(text)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(text) for text in texts))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await ticking
+    lags.sort()
+    print(
+        f"{name:<8} {len(texts) / elapsed:8.1f} jobs/s  loop lag p99={lags[int(len(lags) * 0.99) - 1] * 1000:7.1f}ms"
+        f"  max={lags[-1] * 1000:7.1f}ms"
+    )
+
+
+async def run(args) -> None:
+    texts = [snippet(i, args.lines) for i in range(args.jobs)]
+
+    async def inline(text: str) -> None:
+        process_code(text, "python")
+
+    pipeline = CodePipeline(workers=args.workers, cache_size=0, timeout=60)
+    # Start the workers (and their black import) before timing
+    await asyncio.gather(*(pipeline.process(snippet(-i, 1), "python") for i in range(args.workers)))
+    try:
+        await measure("inline", texts, args.concurrency, inline)
+        await measure("pool", texts, args.concurrency, lambda text: pipeline.process(text, "python"))
+    finally:
+        pipeline.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--jobs", type=int, default=40)
+    parser.add_argument("--lines", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--workers", type=int, default=4)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
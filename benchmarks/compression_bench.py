@@ -0,0 +1,64 @@
+"""Times JSON rendering and response compression for /code-sized bodies.
+
+For each body size, renders a CodeResponse with the stdlib JSONResponse,
+ORJSONResponse (the app default) and PydanticJSONResponse (what the routes
+return), then compresses the JSON with every coding installed at its
+configured level. It reports the time and the compressed size of each. The
+compression times show where COMPRESSION_OFFLOAD_BYTES should sit: the body
+size at which compressing on the event loop would delay other requests by
+more than the cost of a thread hop (~50us).
+
+Usage:
+    python benchmarks/compression_bench.py --sizes 1000 10000 100000 1000000
+"""
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi.responses import JSONResponse, ORJSONResponse  # noqa: E402
+
+from models.response import CodeResponse  # noqa: E402
+from utils.compression import available_encoders  # noqa: E402
+from utils.config import settings  # noqa: E402
+from utils.responses import PydanticJSONResponse  # noqa: E402
+
+
+def mean_us(func, number: int) -> float:
+    return min(timeit.repeat(func, number=number, repeat=3)) / number * 1e6
+
+
+def code(size: int) -> str:
+    block = 'def handler(event):\n    """Handle one event."""\n    return {"status": 200, "body": event}\n\n'
+    return (block * (size // len(block) + 1))[:size]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000, 1000000])
+    args = parser.parse_args()
+    encoders = available_encoders(settings.COMPRESSION_LEVELS)
+
+    header = f"{'bytes':>8}{'json us':>10}{'orjson us':>11}{'pydantic us':>13}"
+    for name in encoders:
+        header += f"{name + ' us':>11}{name + ' bytes':>13}"
+    print(header)
+    for size in args.sizes:
+        text = code(size)
+        body = PydanticJSONResponse(CodeResponse(code=text)).body
+        number = max(5, 2000000 // max(size, 1) // 10)
+        row = (
+            f"{size:>8}"
+            f"{mean_us(lambda: JSONResponse({'code': text}).body, number):>10.1f}"
+            f"{mean_us(lambda: ORJSONResponse({'code': text}).body, number):>11.1f}"
+            f"{mean_us(lambda: PydanticJSONResponse(CodeResponse(code=text)).body, number):>13.1f}"
+        )
+        for encoder in encoders.values():
+            row += f"{mean_us(lambda: encoder.compress(body), number):>11.1f}{len(encoder.compress(body)):>13}"
+        print(row)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+"""Replays captured traffic against the service with a mock upstream.
+
+Reads capture files (CAPTURE_ENABLED=true; give files or a CAPTURE_DIR) and
+runs the app in-process under uvicorn with every upstream client replaced by
+a mock that answers each upstream call with the response recorded for it,
+after the recorded latency. Requests are sent at their captured arrival
+offsets, so concurrency, bursts and cache hit patterns follow production.
+`--speed 2` replays twice as fast: arrival gaps and upstream latencies are
+both halved.
+
+Upstream calls are matched to recordings by operation and parameters (the
+resolved model aside, so a changed model registry still replays); a call
+with no match gets another recorded response for the same operation and is
+reported as unmatched. Captures masked with CAPTURE_REDACT=mask replay the
+same way, since masked prompts canonicalize to the masked upstream prompts.
+
+The app runs with its own settings, except that the disk response cache,
+cache warm-up and capture are turned off so every run starts cold.
+
+Usage:
+    python benchmarks/replay.py captures/ --speed 1
+    python benchmarks/replay.py captures/capture-*.jsonl.gz --speed 4 --limit 5000
+"""
+import argparse
+import asyncio
+import collections
+import json
+import os
+import statistics
+import sys
+import time
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ["CAPTURE_ENABLED"] = "false"
+os.environ["CACHE_WARMUP_ENABLED"] = "false"
+os.environ["RESPONSE_CACHE_PATH"] = ""
+
+import httpx  # noqa: E402
+import uvicorn  # noqa: E402
+
+from main import app  # noqa: E402
+from utils.capture import read_capture  # noqa: E402
+
+
+def namespace(value):
+    """Rebuilds a recorded SDK response as attribute access, as the service reads it."""
+    if isinstance(value, dict):
+        return SimpleNamespace(**{name: namespace(item) for name, item in value.items()})
+    if isinstance(value, list):
+        return [namespace(item) for item in value]
+    return value
+
+
+def match_key(operation: str, params: dict) -> str:
+    return operation + json.dumps({k: v for k, v in params.items() if k != "model"}, sort_keys=True)
+
+
+class MockUpstream:
+    """Serves recorded upstream responses, after the recorded latency divided by `speed`."""
+
+    def __init__(self, records: list[dict], speed: float):
+        self.speed = speed
+        self.recorded = collections.defaultdict(collections.deque)
+        self.by_operation = collections.defaultdict(list)
+        for record in records:
+            for call in record.get("upstream") or ():
+                self.recorded[match_key(call["operation"], call["params"])].append(call)
+                self.by_operation[call["operation"]].append(call)
+        self.matched = 0
+        self.unmatched = 0
+        self._fallback = collections.Counter()
+
+    async def serve(self, operation: str, params: dict):
+        params = {name: value for name, value in params.items() if name != "timeout"}
+        calls = self.recorded.get(match_key(operation, params))
+        if calls:
+            call = calls.popleft()
+            calls.append(call)
+            self.matched += 1
+        else:
+            candidates = self.by_operation.get(operation)
+            if not candidates:
+                raise RuntimeError(f"No recorded upstream call for {operation}")
+            call = candidates[self._fallback[operation] % len(candidates)]
+            self._fallback[operation] += 1
+            self.unmatched += 1
+        await asyncio.sleep(call["latency"] / self.speed)
+        return namespace(call["response"])
+
+    def __getattr__(self, resource: str):
+        return SimpleNamespace(
+            create=lambda **params: self.serve(f"{resource}.create", params),
+            list=lambda **params: self.serve(f"{resource}.list", params),
+        )
+
+    async def close(self) -> None:
+        pass
+
+
+def percentile(samples: list[float], q: float) -> float:
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * q))]
+
+
+def report(results: list[tuple[dict, int, float]], upstream: MockUpstream, wall: float) -> None:
+    print(f"{len(results)} requests in {wall:.1f}s ({len(results) / max(wall, 1e-9):.1f} req/s)")
+    print(f"upstream calls: {upstream.matched} matched, {upstream.unmatched} unmatched")
+    by_route = collections.defaultdict(list)
+    for record, status, latency in results:
+        by_route[record["route"]].append((record, status, latency))
+    print(f"{'route':<10}{'n':>7}{'statuses':>22}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'captured p50':>14}{'captured p95':>14}")
+    for route, rows in sorted(by_route.items()):
+        statuses = collections.Counter(status for _, status, _ in rows)
+        latencies = [latency for _, _, latency in rows]
+        captured = [record["duration"] for record, _, _ in rows]
+        print(
+            f"{route:<10}{len(rows):>7}{' '.join(f'{s}:{n}' for s, n in sorted(statuses.items())):>22}"
+            f"{percentile(latencies, 0.5) * 1000:>9.1f}{percentile(latencies, 0.95) * 1000:>9.1f}"
+            f"{percentile(latencies, 0.99) * 1000:>9.1f}{statistics.median(captured) * 1000:>14.1f}"
+            f"{percentile(captured, 0.95) * 1000:>14.1f}"
+        )
+
+
+async def send(client: httpx.AsyncClient, record: dict) -> tuple[dict, int, float]:
+    body = record.get("body")
+    content = None if body is None else (body if isinstance(body, str) else json.dumps(body)).encode("utf-8")
+    url = record["path"] + (f"?{record['query']}" if record.get("query") else "")
+    started = time.perf_counter()
+    try:
+        response = await client.request(record["method"], url, content=content, headers=record.get("headers") or {})
+        status = response.status_code
+    except httpx.HTTPError:
+        status = 0
+    return record, status, time.perf_counter() - started
+
+
+async def run(args) -> None:
+    records = sorted(read_capture(args.paths), key=lambda record: record["ts"])[: args.limit or None]
+    if not records:
+        sys.exit("No capture records found")
+    upstream = MockUpstream(records, args.speed)
+
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=args.port, log_level="warning"))
+    serving = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.05)
+    service = app.state.openai_service
+    for backend in service.backends.backends:
+        for key in backend.key_pool.keys:
+            key.client = upstream
+
+    limits = httpx.Limits(max_connections=args.connections, max_keepalive_connections=args.connections)
+    try:
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{args.port}", limits=limits, timeout=None) as client:
+            first = records[0]["ts"]
+            started = time.perf_counter()
+            tasks = []
+            for record in records:
+                delay = (record["ts"] - first) / args.speed - (time.perf_counter() - started)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                tasks.append(asyncio.create_task(send(client, record)))
+            results = await asyncio.gather(*tasks)
+            wall = time.perf_counter() - started
+    finally:
+        server.should_exit = True
+        await serving
+    report(results, upstream, wall)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("paths", nargs="+", help="capture files or directories")
+    parser.add_argument("--speed", type=float, default=1.0, help="replay speed, as a multiple of the original")
+    parser.add_argument("--limit", type=int, default=0, help="replay only the first N requests")
+    parser.add_argument("--connections", type=int, default=256)
+    parser.add_argument("--port", type=int, default=8766)
+    args = parser.parse_args()
+    if args.speed <= 0:
+        parser.error("--speed must be positive")
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""Measures how many cached completions fit in memory, and what reading them costs.
+
+Fills the in-process response cache with synthetic completions (a mix of
+generated code and long prose answers, `--size` characters on average) and
+compares it to the previous layout, an OrderedDict of hex keys to
+(expiry, pydantic response) tuples. Memory is measured with tracemalloc for
+both; the compact layer's own `memory_bytes` figure is printed alongside.
+Read cost is the mean time of `get_memory` over every entry.
+
+Usage:
+    python benchmarks/response_cache_bench.py --entries 20000 --size 1500
+"""
+import argparse
+import os
+import random
+import sys
+import time
+import tracemalloc
+from collections import OrderedDict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models.response import QuestionResponse  # noqa: E402
+from services.response_cache import PayloadCodec, ResponseCache, zstandard  # noqa: E402
+from utils.canonical import canonicalize  # noqa: E402
+
+WORDS = (
+    "the request model cache token latency upstream returns value list function error retry "
+    "client server response python answer because which when data user query result each"
+).split()
+
+
+def code_sample(rng: random.Random, size: int) -> str:
+    lines = []
+    while sum(map(len, lines)) < size:
+        name = rng.choice(WORDS) + "_" + rng.choice(WORDS)
+        lines.append(
+            f"def {name}(items, limit={rng.randint(1, 100)}):\n"
+            f"    \"\"\"Return the {rng.choice(WORDS)} of each {rng.choice(WORDS)}.\"\"\"\n"
+            f"    result = []\n    for item in items[:limit]:\n"
+            f"        if item.{rng.choice(WORDS)} is not None:\n            result.append(item)\n"
+            f"    return result\n\n"
+        )
+    return "".join(lines)[:size]
+
+
+def prose_sample(rng: random.Random, size: int) -> str:
+    words = []
+    while sum(map(len, words)) + len(words) < size:
+        words.append(rng.choice(WORDS))
+    return " ".join(words).capitalize() + "."
+
+
+def payloads(count: int, size: int, seed: int = 7) -> list[tuple[str, str]]:
+    rng = random.Random(seed)
+    out = []
+    for i in range(count):
+        length = max(50, int(rng.expovariate(1 / size)))
+        text = code_sample(rng, length) if i % 2 else prose_sample(rng, length)
+        out.append((canonicalize("question", {"question": f"question {i}"}).digest, text))
+    return out
+
+
+def measure(build) -> tuple[object, int]:
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    store = build()
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return store, used
+
+
+def read_cost(get, keys: list[str]) -> float:
+    started = time.perf_counter()
+    for key in keys:
+        get(key)
+    return (time.perf_counter() - started) / len(keys) * 1e6
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--entries", type=int, default=20000)
+    parser.add_argument("--size", type=int, default=1500)
+    parser.add_argument("--threshold", type=int, default=512)
+    args = parser.parse_args()
+
+    # Copies of the text, so neither layout is charged for the shared source strings
+    data = payloads(args.entries, args.size)
+    keys = [key for key, _ in data]
+
+    def legacy():
+        store = OrderedDict()
+        for key, text in data:
+            store["".join(key)] = (time.monotonic() + 3600, QuestionResponse(answer="".join(text)))
+        return store
+
+    def compact(codec):
+        def build():
+            cache = ResponseCache(None, memory_size=len(data) + 1, memory_bytes=1 << 40, codec=codec)
+            for key, text in data:
+                cache.put_memory(key, "".join(text))
+            return cache
+        return build
+
+    legacy_store, legacy_bytes = measure(legacy)
+    legacy_read = read_cost(lambda key: legacy_store[key][1].answer, keys)
+    legacy_store.clear()
+    print(f"{'layout':<22}{'bytes/entry':>12}{'vs legacy':>11}{'read us':>9}")
+    print(f"{'dict of pydantic':<22}{legacy_bytes / len(data):>12.0f}{1.0:>10.1f}x{legacy_read:>9.2f}")
+
+    variants = [("zlib" if zstandard is None else "zstd", PayloadCodec(threshold=args.threshold))]
+    if zstandard is not None:
+        trained = PayloadCodec(threshold=args.threshold)
+        trained.train([text.encode("utf-8") for _, text in data[:1000]])
+        variants.append(("zstd + dictionary", trained))
+    for name, codec in variants:
+        cache, used = measure(compact(codec))
+        read = read_cost(cache.get_memory, keys)
+        print(
+            f"{name:<22}{used / len(data):>12.0f}{legacy_bytes / used:>10.1f}x{read:>9.2f}"
+            f"   (memory_bytes reports {cache.memory_bytes / len(data):.0f}/entry)"
+        )
+
+
+if __name__ == "__main__":
+    main()
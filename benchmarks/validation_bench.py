@@ -0,0 +1,72 @@
+"""Times per-request body validation and response serialization.
+
+Request side: the JSON body of a /code request decoded with `json.loads`
+and validated with `CodeRequest.model_validate` (what FastAPI does), next
+to `model_validate_json`, which parses and validates in one pass.
+
+Response side: a CodeResponse of each size rendered the way FastAPI does
+for a route with `response_model` (the returned model is dumped, validated
+again against the response field, serialized to Python objects and then
+encoded by `json.dumps` in JSONResponse), next to `PydanticJSONResponse`,
+which serializes the model straight to JSON bytes.
+
+Usage:
+    python benchmarks/validation_bench.py --sizes 100 10000 100000
+"""
+import argparse
+import json
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi.responses import JSONResponse  # noqa: E402
+from fastapi.routing import serialize_response  # noqa: E402
+from fastapi.utils import create_model_field  # noqa: E402
+
+from models.request import CodeRequest  # noqa: E402
+from models.response import CodeResponse  # noqa: E402
+from utils.responses import PydanticJSONResponse  # noqa: E402
+
+
+def mean_us(func, number: int) -> float:
+    return min(timeit.repeat(func, number=number, repeat=3)) / number * 1e6
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 10000, 100000])
+    args = parser.parse_args()
+
+    field = create_model_field(name="Response_generate_code", type_=CodeResponse, mode="serialization")
+
+    def response_model_path(body: CodeResponse) -> bytes:
+        # serialize_response never suspends for an async route; drive it without an event loop
+        try:
+            serialize_response(field=field, response_content=body).send(None)
+        except StopIteration as done:
+            return JSONResponse(done.value).body
+
+    print(
+        f"{'bytes':>8}{'loads+validate us':>19}{'validate_json us':>18}"
+        f"{'response_model us':>19}{'PydanticJSON us':>17}{'speedup':>9}"
+    )
+    for size in args.sizes:
+        text = ("def f(x):\n    return x * 2  # ünïcode\n" * (size // 38 + 1))[:size]
+        raw = json.dumps({"language": "python", "prompt": text, "temperature": 0.2}).encode("utf-8")
+        body = CodeResponse(code=text)
+        assert json.loads(response_model_path(body)) == json.loads(PydanticJSONResponse(body).body)
+        number = max(20, 200000 // max(size, 1))
+        before = mean_us(lambda: response_model_path(body), number)
+        after = mean_us(lambda: PydanticJSONResponse(body).body, number)
+        print(
+            f"{size:>8}"
+            f"{mean_us(lambda: CodeRequest.model_validate(json.loads(raw)), number):>19.1f}"
+            f"{mean_us(lambda: CodeRequest.model_validate_json(raw), number):>18.1f}"
+            f"{before:>19.1f}{after:>17.1f}{before / after:>8.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""Compares per-turn latency of a multi-turn conversation over HTTP and over /ws.
+
+The app runs in-process under uvicorn with the upstream replaced by a mock
+that waits `first_token` seconds, then emits `tokens` tokens `token_interval`
+apart. Each turn is sent in three ways:
+
+  http-new   a fresh connection per turn (TCP setup + request + full body)
+  http-keep  one keep-alive connection, still one full response per turn
+  ws         one WebSocket session; time to first token and to `done`
+
+The gap between the first two is per-request connection overhead; the gap
+between http and ws time-to-first-token is what streaming saves a chat UI.
+
+Usage:
+    python benchmarks/ws_vs_http_bench.py --turns 50 --first-token 0.05
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx  # noqa: E402
+import uvicorn  # noqa: E402
+import websockets  # noqa: E402
+
+from main import app  # noqa: E402
+from services.openai_service import get_openai_service  # noqa: E402
+
+
+class MockService:
+    def __init__(self, first_token: float, tokens: int, token_interval: float):
+        self.first_token = first_token
+        self.tokens = tokens
+        self.token_interval = token_interval
+
+    async def stream_completion(self, route, user=None, **params):
+        await asyncio.sleep(self.first_token)
+        for i in range(self.tokens):
+            if i:
+                await asyncio.sleep(self.token_interval)
+            yield f" tok{i}"
+
+    async def generate_text(self, **params) -> str:
+        return "".join([text async for text in self.stream_completion("generate", **params)])
+
+
+def summary(name: str, samples: list[float]) -> str:
+    samples = sorted(samples)
+    p95 = samples[int(len(samples) * 0.95) - 1] if len(samples) >= 20 else samples[-1]
+    return f"{name:<18} mean={statistics.mean(samples) * 1000:7.1f}ms p95={p95 * 1000:7.1f}ms"
+
+
+async def http_turns(base_url: str, turns: int, keep_alive: bool) -> list[float]:
+    samples = []
+    client = httpx.AsyncClient(base_url=base_url) if keep_alive else None
+    try:
+        for turn in range(turns):
+            started = time.perf_counter()
+            if keep_alive:
+                response = await client.post("/generate/generate/", json={"prompt": f"turn {turn}"})
+            else:
+                async with httpx.AsyncClient(base_url=base_url) as fresh:
+                    response = await fresh.post("/generate/generate/", json={"prompt": f"turn {turn}"})
+            response.raise_for_status()
+            samples.append(time.perf_counter() - started)
+    finally:
+        if client is not None:
+            await client.aclose()
+    return samples
+
+
+async def ws_turns(url: str, turns: int) -> tuple[list[float], list[float]]:
+    first_token, complete = [], []
+    async with websockets.connect(url) as ws:
+        for turn in range(turns):
+            started = time.perf_counter()
+            await ws.send(json.dumps({"type": "generate", "id": str(turn), "prompt": f"turn {turn}", "context": True}))
+            first = None
+            while True:
+                frame = json.loads(await ws.recv())
+                if frame["type"] == "token" and first is None:
+                    first = time.perf_counter() - started
+                elif frame["type"] in ("done", "error"):
+                    break
+            first_token.append(first)
+            complete.append(time.perf_counter() - started)
+    return first_token, complete
+
+
+async def run(args) -> None:
+    service = MockService(args.first_token, args.tokens, args.token_interval)
+    app.dependency_overrides[get_openai_service] = lambda: service
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=args.port, log_level="warning"))
+    serving = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.05)
+    try:
+        base_url = f"http://127.0.0.1:{args.port}"
+        new = await http_turns(base_url, args.turns, keep_alive=False)
+        keep = await http_turns(base_url, args.turns, keep_alive=True)
+        first, complete = await ws_turns(f"ws://127.0.0.1:{args.port}/ws", args.turns)
+    finally:
+        server.should_exit = True
+        await serving
+    print(summary("http-new total", new))
+    print(summary("http-keep total", keep))
+    print(summary("ws first token", first))
+    print(summary("ws total", complete))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--turns", type=int, default=50)
+    parser.add_argument("--first-token", type=float, default=0.05)
+    parser.add_argument("--tokens", type=int, default=20)
+    parser.add_argument("--token-interval", type=float, default=0.005)
+    parser.add_argument("--port", type=int, default=8765)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,20 +1,37 @@
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, ORJSONResponse, Response
 from fastapi.exceptions import RequestValidationError
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
 
-from routers import models, generate, translate, question, code
-from services.openai_service import OpenAIService
-from services.auth_service import AuthService
+from routers import models, generate, translate, question, code, jobs, sessions
+from services.openai_service import get_openai_service
+from services.model_registry import get_model_registry
+from services.cache_warmup import READY, create_cache_warmer
+from services.usage_service import get_usage_tracker
+from services.auth_service import get_auth_service
+from services.shared_store import get_shared_store
+from services.job_service import get_job_runner
+from services.idempotency import get_idempotency_store
+from services.health import get_health_monitor
+from utils.admission import AdmissionMiddleware
+from utils.capture import CaptureMiddleware, stop_capture
+from utils.compression import CompressionMiddleware
 from utils.config import settings
-from utils.logger import logger
+from utils.exceptions import APIError
+from utils.logger import logger, stop_logging
 
 app = FastAPI(
     title="AI Wrapper MVP",
     description="Simplified Python backend for seamless OpenAI API interactions",
     version="1.0.0",
+    # Endpoints that return plain data are serialized with orjson
+    default_response_class=ORJSONResponse,
 )
 
+# Shed load per route class before requests reach the handlers
+app.add_middleware(AdmissionMiddleware)
+
 # Add CORS middleware to allow requests from different origins
 app.add_middleware(
     CORSMiddleware,
@@ -24,32 +41,102 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Record a sample of traffic for replay benchmarks; it sits inside compression so it stores
+# plain bodies
+if settings.CAPTURE_ENABLED:
+    app.add_middleware(CaptureMiddleware)
+
+# Compress large responses with the best coding the client accepts
+if settings.COMPRESSION_ENABLED:
+    app.add_middleware(CompressionMiddleware)
+
 # Dependency injection for OpenAI service
 @app.on_event("startup")
 async def startup_event():
-    app.state.openai_service = OpenAIService(settings.OPENAI_API_KEY)
-    app.state.auth_service = AuthService(settings.JWT_SECRET)
+    # Load and validate model profiles before the first request needs them
+    app.state.model_registry = get_model_registry()
+    app.state.openai_service = await get_openai_service()
+    app.state.auth_service = get_auth_service()
+    app.state.usage_tracker = get_usage_tracker()
+    await app.state.usage_tracker.start()
+    app.state.job_runner = get_job_runner()
+    app.state.job_runner.start()
+    # Warm the response cache in the background; /readyz reports "warming" until it is done
+    app.state.cache_warmer = create_cache_warmer(app.state.openai_service.cache, app.state.openai_service)
+    if settings.CACHE_WARMUP_ENABLED:
+        app.state.cache_warmer.start()
+    else:
+        app.state.cache_warmer.status = READY
+    # Sample event-loop lag and probe the upstream in the background for /readyz
+    app.state.health_monitor = get_health_monitor()
+    app.state.health_monitor.start()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await app.state.health_monitor.stop()
+    await app.state.cache_warmer.stop()
+    await app.state.job_runner.stop()
+    # Persist buffered token usage before the process exits
+    await app.state.usage_tracker.stop()
+    await app.state.auth_service.close()
+    await app.state.openai_service.close()
+    await get_idempotency_store().close()
+    shared_store = get_shared_store()
+    if shared_store is not None:
+        await shared_store.close()
+    stop_capture()
+    # Drain queued log records before the process exits
+    stop_logging()
 
 # Custom exception handler for validation errors
 @app.exception_handler(RequestValidationError)
 async def validation_exception_handler(request, exc):
-    logger.error(f"Validation error: {exc}")
+    logger.error("Validation error: %s", exc)
     return JSONResponse(
         status_code=400,
         content={"message": "Invalid request data.", "details": exc.errors()},
     )
 
+@app.exception_handler(APIError)
+async def api_error_handler(request, exc):
+    return JSONResponse(
+        status_code=exc.status_code,
+        content={"message": str(exc), "details": getattr(exc, "details", None)},
+    )
+
 # Include routers for different API endpoints
 app.include_router(models.router, prefix="/models")
 app.include_router(generate.router, prefix="/generate")
 app.include_router(translate.router, prefix="/translate")
 app.include_router(question.router, prefix="/question")
 app.include_router(code.router, prefix="/code")
+app.include_router(jobs.router)
+app.include_router(sessions.router)
 
 @app.get("/")
 async def root():
     return {"message": "Welcome to the AI Wrapper MVP!"}
 
+@app.get("/healthz")
+async def healthz():
+    # Liveness: answering at all means the event loop runs; dependencies are /readyz's concern
+    return {"status": "ok", "event_loop_lag": round(get_health_monitor().loop_lag, 4)}
+
+@app.get("/readyz")
+async def readyz():
+    warmup = app.state.cache_warmer.status
+    ready, checks = get_health_monitor().readiness()
+    checks["cache_warmup"] = {"ok": warmup == READY, "status": warmup}
+    if warmup != READY:
+        status = warmup
+    else:
+        status = READY if ready else "unavailable"
+    return JSONResponse(status_code=200 if status == READY else 503, content={"status": status, "checks": checks})
+
+@app.get("/metrics")
+async def metrics():
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
 if __name__ == "__main__":
     import uvicorn
 
@@ -6,14 +6,14 @@ class GenerateRequest(BaseModel):
     Defines the request model for text generation requests.
 
     Attributes:
-        model (str): The name of the OpenAI model to use for text generation. Defaults to "text-davinci-003".
+        model (str): The name of the OpenAI model to use for text generation. Defaults to "auto", which picks the cheapest suitable model.
         prompt (str): The text prompt to use for generating text.
         temperature (float): Controls the randomness of the generated text. Higher values (up to 1) result in more creative and unpredictable text. Defaults to 0.5.
         max_tokens (int): The maximum number of tokens to generate. Defaults to 100.
         top_p (float): Controls the diversity of the generated text. Defaults to 1.0.
         stop (Optional[List[str]]): A list of strings to stop the generation at. Defaults to None.
     """
-    model: str = Field("text-davinci-003", description="The name of the OpenAI model to use for text generation.")
+    model: str = Field("auto", description="The name of the OpenAI model to use for text generation, or \"auto\".")
     prompt: str = Field(..., description="The text prompt to use for generating text.")
     temperature: float = Field(0.5, description="Controls the randomness of the generated text.")
     max_tokens: int = Field(100, description="The maximum number of tokens to generate.")
@@ -39,10 +39,10 @@ class QuestionRequest(BaseModel):
 
     Attributes:
         question (str): The question to answer.
-        model (str): The name of the OpenAI model to use for question answering. Defaults to "text-davinci-003".
+        model (str): The name of the OpenAI model to use for question answering. Defaults to "auto", which picks the cheapest suitable model.
     """
     question: str = Field(..., description="The question to answer.")
-    model: str = Field("text-davinci-003", description="The name of the OpenAI model to use for question answering.")
+    model: str = Field("auto", description="The name of the OpenAI model to use for question answering, or \"auto\".")
 
 class CodeRequest(BaseModel):
     """
@@ -50,6 +50,7 @@ class CodeRequest(BaseModel):
 
     Attributes:
         language (str): The programming language to generate code in.
+        model (str): The name of the OpenAI model to use for code generation. Defaults to "auto", which picks the cheapest suitable model.
         prompt (str): The text prompt to use for generating code.
         temperature (float): Controls the randomness of the generated code. Defaults to 0.5.
         max_tokens (int): The maximum number of tokens to generate. Defaults to 100.
@@ -57,6 +58,7 @@ class CodeRequest(BaseModel):
         stop (Optional[List[str]]): A list of strings to stop the generation at. Defaults to None.
     """
     language: str = Field(..., description="The programming language to generate code in.")
+    model: str = Field("auto", description="The name of the OpenAI model to use for code generation, or \"auto\".")
     prompt: str = Field(..., description="The text prompt to use for generating code.")
     temperature: float = Field(0.5, description="Controls the randomness of the generated code.")
     max_tokens: int = Field(100, description="The maximum number of tokens to generate.")
@@ -1,6 +1,7 @@
 from pydantic import BaseModel, Field
 from typing import List, Optional
 
+
 class ModelResponse(BaseModel):
     """
     Defines the response model for retrieving a list of available OpenAI models.
@@ -10,6 +11,7 @@ class ModelResponse(BaseModel):
     """
     models: List[str] = Field(..., description="A list of available OpenAI models.")
 
+
 class GenerateResponse(BaseModel):
     """
     Defines the response model for text generation requests.
@@ -19,6 +21,7 @@ class GenerateResponse(BaseModel):
     """
     text: str = Field(..., description="The generated text.")
 
+
 class TranslateResponse(BaseModel):
     """
     Defines the response model for translation requests.
@@ -28,6 +31,7 @@ class TranslateResponse(BaseModel):
     """
     translated_text: str = Field(..., description="The translated text.")
 
+
 class QuestionResponse(BaseModel):
     """
     Defines the response model for question answering requests.
@@ -37,6 +41,7 @@ class QuestionResponse(BaseModel):
     """
     answer: str = Field(..., description="The answer to the question.")
 
+
 class CodeResponse(BaseModel):
     """
     Defines the response model for code generation requests.
@@ -44,4 +49,20 @@ class CodeResponse(BaseModel):
     Attributes:
         code (str): The generated code.
     """
-    code: str = Field(..., description="The generated code.")
\ No newline at end of file
+    code: str = Field(..., description="The generated code.")
+
+
+class JobResponse(BaseModel):
+    """
+    Defines the response model for asynchronous job lookups.
+
+    Attributes:
+        job_id (str): The job id.
+        status (str): pending, running, succeeded or failed.
+        result (Optional[dict]): The endpoint's normal response body once the job succeeded.
+        error (Optional[str]): Why the job failed.
+    """
+    job_id: str = Field(..., description="The job id.")
+    status: str = Field(..., description="pending, running, succeeded or failed.")
+    result: Optional[dict] = Field(None, description="The endpoint's normal response body once the job succeeded.")
+    error: Optional[str] = Field(None, description="Why the job failed.")
@@ -1,37 +1,38 @@
-from fastapi import APIRouter, HTTPException
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Request
 from fastapi.responses import JSONResponse
-from pydantic import BaseModel
 
-from services.openai_service import OpenAIService
+from services.openai_service import OpenAIService, get_openai_service
+from services.auth_service import get_optional_user
+from services.user_repository import UserRecord
+from utils.canonical import canonicalize_request
+from utils.deadline import Deadline, get_deadline, run_cancellable
+from utils.exceptions import APIError
 from utils.logger import logger
+from utils.responses import PydanticJSONResponse
 
 from models.request import CodeRequest
 from models.response import CodeResponse
 
 router = APIRouter(prefix="/code", tags=["Code Generation"])
 
-# Initialize the OpenAI service from `utils.config`
-openai_service = OpenAIService()
-
-# Define the request model for code generation requests. 
-# Refer to `models/request.py` for more details.
-class CodeRequest(BaseModel):
-    language: str
-    prompt: str
-    temperature: float = 0.5
-    max_tokens: int = 100
-
-# Define the response model for code generation responses.
-# Refer to `models/response.py` for more details.
-class CodeResponse(BaseModel):
-    code: str
-
 @router.post("/", response_model=CodeResponse)
-async def generate_code(request: CodeRequest):
+async def generate_code(
+    request: CodeRequest,
+    http_request: Request,
+    openai_service: OpenAIService = Depends(get_openai_service),
+    current_user: Optional[UserRecord] = Depends(get_optional_user),
+    deadline: Deadline = Depends(get_deadline),
+):
     """Generates code in a specific programming language using OpenAI's API.
 
     Args:
         request (CodeRequest): The request body containing the language, prompt, and optional parameters.
+        http_request (Request): The raw request, watched for client disconnects.
+        openai_service (OpenAIService): The OpenAI service instance.
+        current_user (Optional[UserRecord]): The authenticated caller, if a bearer token was sent.
+        deadline (Deadline): When the caller stops waiting; bounds the upstream call.
 
     Returns:
         CodeResponse: The generated code in a CodeResponse object.
@@ -42,23 +43,40 @@ async def generate_code(request: CodeRequest):
     try:
         # Validate the request data using the CodeRequest model.
         # Refer to `models/request.py` for validation rules. 
-        logger.info(f"Received code generation request: {request}")
+        logger.info(
+            "Received code generation request",
+            extra={"route": "code", "language": request.language, "prompt": request.prompt},
+        )
+
+        # Normalize the body once; every cache and deduplication layer keys on the digest
+        canonical = canonicalize_request(http_request, "code", request)
         
         # Generate code using the OpenAI service. 
         # Refer to `services/openai_service.py` for the implementation.
-        response = await openai_service.generate_code(
-            model="code-davinci-002",  # Choose a suitable OpenAI code model. 
-            prompt=request.prompt, 
-            language=request.language,
-            temperature=request.temperature, 
-            max_tokens=request.max_tokens
+        response = await run_cancellable(
+            http_request,
+            "code",
+            request.max_tokens,
+            openai_service.generate_code(
+                model=request.model,
+                prompt=request.prompt, 
+                language=request.language,
+                temperature=request.temperature, 
+                max_tokens=request.max_tokens,
+                top_p=request.top_p,
+                user=current_user.username if current_user else None,
+                timeout=deadline.remaining(),
+                key=canonical.digest,
+            ),
         )
 
         # Format the response data into the CodeResponse model. 
         # Refer to `models/response.py` for model details.
-        return CodeResponse(code=response)
+        return PydanticJSONResponse(CodeResponse(code=response))
 
+    except APIError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
     except Exception as e:
         # Log the error and return an error response.
-        logger.error(f"Error generating code: {e}")
+        logger.error("Error generating code: %s", e)
         raise HTTPException(status_code=500, detail="Error generating code.")
\ No newline at end of file
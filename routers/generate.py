@@ -1,37 +1,46 @@
-from fastapi import APIRouter, HTTPException
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
 from fastapi.responses import JSONResponse
-from pydantic import BaseModel
 
-from services.openai_service import OpenAIService
+from services.openai_service import OpenAIService, get_openai_service
+from services.auth_service import get_optional_user
+from services.idempotency import IdempotencyStore, get_idempotency_store, idempotent
+from services.user_repository import UserRecord
+from utils.canonical import canonicalize_request
+from utils.deadline import Deadline, get_deadline, run_cancellable
+from utils.exceptions import APIError
 from utils.logger import logger
+from utils.responses import PydanticJSONResponse
 
 from models.request import GenerateRequest
 from models.response import GenerateResponse
 
 router = APIRouter(prefix="/generate", tags=["Text Generation"])
 
-# Initialize the OpenAI service (already initialized in `utils.config`)
-openai_service = OpenAIService()
-
-# Define the request model for text generation requests.
-# Refer to `models/request.py` for more details.
-class GenerateRequest(BaseModel):
-    model: str = "text-davinci-003"  # Default model, can be overridden by user
-    prompt: str
-    temperature: float = 0.5
-    max_tokens: int = 100
-
-# Define the response model for text generation responses.
-# Refer to `models/response.py` for more details.
-class GenerateResponse(BaseModel):
-    text: str
-
 @router.post("/", response_model=GenerateResponse)
-async def generate_text(request: GenerateRequest):
+async def generate_text(
+    request: GenerateRequest,
+    http_request: Request,
+    http_response: Response,
+    openai_service: OpenAIService = Depends(get_openai_service),
+    current_user: Optional[UserRecord] = Depends(get_optional_user),
+    deadline: Deadline = Depends(get_deadline),
+    idempotency: IdempotencyStore = Depends(get_idempotency_store),
+):
     """Generates text using OpenAI's API.
 
+    A retry sent with the same `Idempotency-Key` header gets the first
+    attempt's text instead of a new (billed) generation.
+
     Args:
         request (GenerateRequest): The request body containing the prompt, model, and optional parameters.
+        http_request (Request): The raw request, watched for client disconnects.
+        http_response (Response): Carries the `Idempotent-Replayed` header on replays.
+        openai_service (OpenAIService): The OpenAI service instance.
+        current_user (Optional[UserRecord]): The authenticated caller, if a bearer token was sent.
+        deadline (Deadline): When the caller stops waiting; bounds the upstream call.
+        idempotency (IdempotencyStore): Remembers results by Idempotency-Key.
 
     Returns:
         GenerateResponse: The generated text in a GenerateResponse object.
@@ -42,22 +51,49 @@ async def generate_text(request: GenerateRequest):
     try:
         # Validate the request data using the GenerateRequest model.
         # Refer to `models/request.py` for validation rules. 
-        logger.info(f"Received text generation request: {request}")
+        logger.info(
+            "Received text generation request",
+            extra={"route": "generate", "model": request.model, "prompt": request.prompt},
+        )
+
+        # Normalize the body once; every cache and deduplication layer keys on the digest
+        canonical = canonicalize_request(http_request, "generate", request)
 
         # Generate text using the OpenAI service.
         # Refer to `services/openai_service.py` for the implementation.
-        response = await openai_service.generate_text(
-            model=request.model,
-            prompt=request.prompt,
-            temperature=request.temperature,
-            max_tokens=request.max_tokens
+        username = current_user.username if current_user else None
+        response = await run_cancellable(
+            http_request,
+            "generate",
+            request.max_tokens,
+            idempotent(
+                http_request,
+                http_response,
+                idempotency,
+                "generate",
+                username,
+                canonical.digest,
+                lambda: openai_service.generate_text(
+                    model=request.model,
+                    prompt=request.prompt,
+                    temperature=request.temperature,
+                    max_tokens=request.max_tokens,
+                    top_p=request.top_p,
+                    user=username,
+                    timeout=deadline.remaining(),
+                    key=canonical.digest,
+                ),
+                timeout=deadline.remaining(),
+            ),
         )
 
         # Format the response data into the GenerateResponse model.
         # Refer to `models/response.py` for model details.
-        return GenerateResponse(text=response)
+        return PydanticJSONResponse(GenerateResponse(text=response), headers=http_response.headers)
 
+    except APIError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
     except Exception as e:
         # Log the error and return an error response.
-        logger.error(f"Error generating text: {e}")
+        logger.error("Error generating text: %s", e)
         raise HTTPException(status_code=500, detail="Error generating text.")
\ No newline at end of file
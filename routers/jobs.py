@@ -0,0 +1,41 @@
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+
+from services.auth_service import get_optional_user
+from services.job_service import JobRunner, get_job_runner
+from services.user_repository import UserRecord
+from utils.config import settings
+from utils.responses import PydanticJSONResponse
+
+from models.response import JobResponse
+
+router = APIRouter(prefix="/jobs", tags=["Jobs"])
+
+
+@router.get("/{job_id}", response_model=JobResponse)
+async def get_job(
+    job_id: str,
+    wait: float = Query(0.0, ge=0, description="Seconds to wait for the job to finish (long-poll)."),
+    job_runner: JobRunner = Depends(get_job_runner),
+    current_user: Optional[UserRecord] = Depends(get_optional_user),
+):
+    """Returns an asynchronous job, optionally waiting for it to finish.
+
+    Args:
+        job_id (str): The id from the 202 response.
+        wait (float): How long to hold the request open for the result; capped at JOBS_MAX_WAIT.
+        job_runner (JobRunner): The job runner holding the job store.
+        current_user (Optional[UserRecord]): The authenticated caller; jobs are only visible to their owner.
+
+    Returns:
+        JobResponse: The job's status and, once finished, its result or error.
+
+    Raises:
+        HTTPException: 404 if the job is unknown, expired or owned by someone else.
+    """
+    job = await job_runner.store.lookup(job_id)
+    if job is None or job.owner != (current_user.username if current_user else None):
+        raise HTTPException(status_code=404, detail="Job not found.")
+    job = await job_runner.store.wait(job_id, min(wait, settings.JOBS_MAX_WAIT)) or job
+    return PydanticJSONResponse(JobResponse(job_id=job.id, status=job.status, result=job.result, error=job.error))
@@ -1,38 +1,48 @@
-from fastapi import APIRouter, HTTPException
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Request
 from fastapi.responses import JSONResponse
-from pydantic import BaseModel
 
-from services.openai_service import OpenAIService
+from services.openai_service import OpenAIService, get_openai_service
+from services.auth_service import get_optional_user
+from services.job_service import JobRunner, accepted_response, callback_url, get_job_runner, wants_async
+from services.user_repository import UserRecord
+from utils.canonical import canonicalize_request
+from utils.deadline import Deadline, get_deadline, run_cancellable
+from utils.exceptions import APIError
 from utils.logger import logger
+from utils.responses import PydanticJSONResponse
 
 from models.request import QuestionRequest
 from models.response import QuestionResponse
 
 router = APIRouter(prefix="/question", tags=["Question Answering"])
 
-# Initialize the OpenAI service (already initialized in `utils.config`)
-openai_service = OpenAIService()
-
-# Define the request model for question answering requests. 
-# Refer to `models/request.py` for more details.
-class QuestionRequest(BaseModel):
-    question: str
-    model: str = "text-davinci-003"  # Default model, can be overridden by user
-
-# Define the response model for question answering responses.
-# Refer to `models/response.py` for more details.
-class QuestionResponse(BaseModel):
-    answer: str
-
 @router.post("/", response_model=QuestionResponse)
-async def answer_question(request: QuestionRequest):
+async def answer_question(
+    request: QuestionRequest,
+    http_request: Request,
+    openai_service: OpenAIService = Depends(get_openai_service),
+    current_user: Optional[UserRecord] = Depends(get_optional_user),
+    deadline: Deadline = Depends(get_deadline),
+    job_runner: JobRunner = Depends(get_job_runner),
+):
     """Answers a question using OpenAI's API.
 
+    With `Prefer: respond-async` the question is answered as a background
+    job: the response is 202 with the job id, and the answer is fetched from
+    `GET /jobs/{id}` or POSTed to the `X-Callback-URL` webhook.
+
     Args:
         request (QuestionRequest): The request body containing the question and optional model.
+        http_request (Request): The raw request, watched for client disconnects.
+        openai_service (OpenAIService): The OpenAI service instance.
+        current_user (Optional[UserRecord]): The authenticated caller, if a bearer token was sent.
+        deadline (Deadline): When the caller stops waiting; bounds the upstream call.
+        job_runner (JobRunner): Runs the question in the background in async mode.
 
     Returns:
-        QuestionResponse: The answer to the question in a QuestionResponse object.
+        QuestionResponse: The answer to the question in a QuestionResponse object, or a 202 response in async mode.
 
     Raises:
         HTTPException: If an error occurs during question answering.
@@ -40,20 +50,47 @@ async def answer_question(request: QuestionRequest):
     try:
         # Validate the request data using the QuestionRequest model.
         # Refer to `models/request.py` for validation rules. 
-        logger.info(f"Received question answering request: {request}")
+        logger.info(
+            "Received question answering request",
+            extra={"route": "question", "model": request.model, "question": request.question},
+        )
+
+        # Normalize the body once; every cache and deduplication layer keys on the digest
+        canonical = canonicalize_request(http_request, "question", request)
+
+        username = current_user.username if current_user else None
+        if wants_async(http_request):
+            async def answer(timeout: float) -> dict:
+                text = await openai_service.answer_question(
+                    model=request.model, question=request.question, user=username, timeout=timeout, key=canonical.digest
+                )
+                return QuestionResponse(answer=text).model_dump()
+
+            job = await job_runner.submit("question", answer, owner=username, webhook_url=callback_url(http_request))
+            return accepted_response(job)
 
         # Answer the question using the OpenAI service.
         # Refer to `services/openai_service.py` for the implementation.
-        response = await openai_service.answer_question(
-            model=request.model,  # Use the user-specified model or the default
-            question=request.question
+        response = await run_cancellable(
+            http_request,
+            "question",
+            1000,
+            openai_service.answer_question(
+                model=request.model,  # Use the user-specified model or the default
+                question=request.question,
+                user=username,
+                timeout=deadline.remaining(),
+                key=canonical.digest,
+            ),
         )
 
         # Format the response data into the QuestionResponse model.
         # Refer to `models/response.py` for model details.
-        return QuestionResponse(answer=response)
+        return PydanticJSONResponse(QuestionResponse(answer=response))
 
+    except APIError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
     except Exception as e:
         # Log the error and return an error response.
-        logger.error(f"Error answering question: {e}")
+        logger.error("Error answering question: %s", e)
         raise HTTPException(status_code=500, detail="Error answering question.")
\ No newline at end of file
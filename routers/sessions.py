@@ -0,0 +1,255 @@
+import asyncio
+import json
+import time
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException, WebSocket, WebSocketDisconnect, status
+from prometheus_client import Counter, Gauge
+from pydantic import ValidationError as PydanticValidationError
+
+from services.auth_service import AuthService, get_auth_service, get_optional_user
+from services.openai_service import OpenAIService, get_openai_service
+from services.user_repository import UserRecord
+from utils.admission import ADMISSION_SHED, AdmissionController, Overloaded, get_admission_controller
+from utils.canonical import canonicalize
+from utils.config import settings
+from utils.deadline import parse_timeout
+from utils.exceptions import APIError
+from utils.logger import logger
+
+from models.request import GenerateRequest, QuestionRequest
+
+router = APIRouter(tags=["Sessions"])
+
+WS_SESSIONS = Gauge("ws_sessions", "Open WebSocket sessions")
+WS_IN_FLIGHT = Gauge("ws_requests_in_flight", "Generation requests running over WebSocket sessions")
+WS_REJECTED = Counter("ws_sessions_rejected_total", "WebSocket handshakes refused because the worker is at WS_MAX_SESSIONS")
+
+_open_sessions = 0
+
+
+def _completion_params(kind: str, message: dict) -> tuple[dict, str]:
+    """Validates a request frame with the matching HTTP body model.
+
+    Returns the completion params and the canonical digest, which is the one
+    the HTTP route computes for the same body, so both share cache entries.
+    """
+    if kind == "generate":
+        canonical = canonicalize(kind, GenerateRequest.model_validate(message).model_dump())
+        fields = canonical.fields
+        params = {
+            "model": fields["model"],
+            "prompt": fields["prompt"],
+            "temperature": fields["temperature"],
+            "max_tokens": fields["max_tokens"],
+            "top_p": fields["top_p"],
+        }
+        return params, canonical.digest
+    canonical = canonicalize(kind, QuestionRequest.model_validate(message).model_dump())
+    fields = canonical.fields
+    # Same parameters as the /question route
+    params = {"model": fields["model"], "prompt": fields["question"], "temperature": 0.0, "max_tokens": 1000, "top_p": 1.0}
+    return params, canonical.digest
+
+
+class Session:
+    """One authenticated WebSocket connection carrying many concurrent requests.
+
+    Each request frame names an `id`; its tokens come back as `token` frames
+    with the same id, interleaved with other requests' frames, followed by
+    one `done` or `error` frame. A `cancel` frame stops a single request.
+    Finished turns are kept in a bounded transcript that later requests can
+    prepend with `"context": true`, so clients don't re-send history.
+
+    Each request takes a slot from the admission class of the matching HTTP
+    route, so streams share the same concurrency limits as HTTP traffic, and
+    the handshake token is re-verified before every request so an expired or
+    revoked token ends the session.
+    """
+
+    def __init__(
+        self,
+        websocket: WebSocket,
+        openai_service: OpenAIService,
+        user: Optional[UserRecord],
+        auth_service: Optional[AuthService] = None,
+        token: Optional[str] = None,
+        admission: Optional[AdmissionController] = None,
+    ):
+        self.websocket = websocket
+        self.openai_service = openai_service
+        self.username = user.username if user else None
+        self.auth_service = auth_service
+        self.token = token
+        self.admission = admission or get_admission_controller()
+        self.tasks: dict[str, asyncio.Task] = {}
+        self.transcript = ""
+        self._send_lock = asyncio.Lock()
+
+    async def send(self, message: dict) -> None:
+        # Frames from concurrent requests must not interleave mid-write
+        async with self._send_lock:
+            await self.websocket.send_text(json.dumps(message))
+
+    async def _stream(self, request_id: str, kind: str, params: dict, key: str, context: str, timeout: float) -> None:
+        prompt = params["prompt"]
+        if context:
+            # The transcript makes the request different from the same body sent alone
+            params["prompt"] = context + prompt
+            key = canonicalize(kind, {"context": context, **params}).digest
+        parts = []
+        stream = self.openai_service.stream_completion(kind, self.username, key=key, timeout=timeout, **params)
+        try:
+            async for text in stream:
+                parts.append(text)
+                await self.send({"type": "token", "id": request_id, "text": text})
+        finally:
+            # Release the upstream slot now rather than when the generator is collected
+            await stream.aclose()
+        turn = f"{prompt}\n{''.join(parts)}\n"
+        self.transcript = (self.transcript + turn)[-settings.WS_CONTEXT_MAX_CHARS:]
+
+    async def _run(self, request_id: str, kind: str, message: dict) -> None:
+        WS_IN_FLIGHT.inc()
+        limiter = None
+        try:
+            try:
+                context = self.transcript if message.pop("context", False) else ""
+                timeout = settings.ROUTE_DEADLINES.get(kind, settings.DEFAULT_DEADLINE)
+                if "timeout" in message:
+                    timeout = parse_timeout(message.pop("timeout"))
+                    if timeout is None:
+                        raise ValueError("timeout must be a positive number of seconds")
+                params, key = _completion_params(kind, message)
+            except (PydanticValidationError, TypeError, ValueError):
+                await self.send({"type": "error", "id": request_id, "status": 400, "message": "Invalid request data."})
+                return
+            candidate = self.admission.limiter_for(f"/{kind}")
+            if candidate is not None:
+                try:
+                    await candidate.acquire()
+                except Overloaded as e:
+                    ADMISSION_SHED.labels(candidate.name, e.reason).inc()
+                    await self.send(
+                        {"type": "error", "id": request_id, "status": 503, "message": "Service overloaded, retry later.", "retry_after": e.retry_after}
+                    )
+                    return
+                limiter, started = candidate, time.monotonic()
+            await asyncio.wait_for(self._stream(request_id, kind, params, key, context, timeout), timeout)
+            await self.send({"type": "done", "id": request_id})
+        except asyncio.TimeoutError:
+            await self.send({"type": "error", "id": request_id, "status": 504, "message": "Deadline exceeded."})
+        except APIError as e:
+            await self.send({"type": "error", "id": request_id, "status": e.status_code, "message": str(e)})
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error("Error in WebSocket request: %s", e, extra={"route": kind})
+            await self.send({"type": "error", "id": request_id, "status": 500, "message": "Error generating text."})
+        finally:
+            if limiter is not None:
+                limiter.release(time.monotonic() - started)
+            WS_IN_FLIGHT.dec()
+            self.tasks.pop(request_id, None)
+
+    async def _authorized(self) -> bool:
+        if self.token is None or self.auth_service is None:
+            return True
+        try:
+            await get_optional_user(self.token, self.auth_service)
+        except HTTPException:
+            return False
+        return True
+
+    async def handle(self, message: dict) -> None:
+        kind, request_id = message.pop("type", None), message.pop("id", None)
+        if not isinstance(request_id, str) or not request_id:
+            await self.send({"type": "error", "id": request_id, "status": 400, "message": "Every frame needs a string id."})
+        elif kind == "cancel":
+            task = self.tasks.pop(request_id, None)
+            if task is not None:
+                task.cancel()
+                await self.send({"type": "cancelled", "id": request_id})
+        elif kind not in ("generate", "question"):
+            await self.send({"type": "error", "id": request_id, "status": 400, "message": f"Unknown frame type '{kind}'."})
+        elif request_id in self.tasks:
+            await self.send({"type": "error", "id": request_id, "status": 409, "message": "Request id already in flight."})
+        elif len(self.tasks) >= settings.WS_MAX_CONCURRENT:
+            await self.send({"type": "error", "id": request_id, "status": 429, "message": "Too many concurrent requests on this session."})
+        elif not await self._authorized():
+            await self.send({"type": "error", "id": request_id, "status": 401, "message": "Token expired or revoked."})
+            await self.websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+            raise WebSocketDisconnect(status.WS_1008_POLICY_VIOLATION)
+        else:
+            self.tasks[request_id] = asyncio.create_task(self._run(request_id, kind, message))
+
+    async def close(self) -> None:
+        tasks = list(self.tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def _bearer_token(websocket: WebSocket) -> Optional[str]:
+    # Browsers cannot set headers on a WebSocket handshake, so also accept ?token=
+    authorization = websocket.headers.get("authorization", "")
+    if authorization.lower().startswith("bearer "):
+        return authorization[7:]
+    return websocket.query_params.get("token")
+
+
+@router.websocket("/ws")
+async def websocket_session(
+    websocket: WebSocket,
+    openai_service: OpenAIService = Depends(get_openai_service),
+    auth_service: AuthService = Depends(get_auth_service),
+):
+    """Multiplexed generation session over one WebSocket.
+
+    The caller authenticates on the handshake with a bearer token in the
+    `Authorization` header or the `token` query parameter (anonymous
+    sessions are allowed, as on the HTTP routes); the token is checked again
+    before each request. Client frames are JSON:
+    `{"type": "generate" | "question", "id": ..., <request body fields>,
+    "context": bool, "timeout": seconds}` or `{"type": "cancel", "id": ...}`.
+    A worker holds at most WS_MAX_SESSIONS sessions; further handshakes are
+    closed with 1013 (try again later).
+
+    Args:
+        websocket (WebSocket): The client connection.
+        openai_service (OpenAIService): The OpenAI service instance.
+        auth_service (AuthService): Verifies the handshake token.
+    """
+    global _open_sessions
+    token = _bearer_token(websocket)
+    try:
+        user = await get_optional_user(token, auth_service)
+    except HTTPException:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+    if _open_sessions >= settings.WS_MAX_SESSIONS:
+        WS_REJECTED.inc()
+        await websocket.close(code=status.WS_1013_TRY_AGAIN_LATER)
+        return
+    await websocket.accept()
+    session = Session(websocket, openai_service, user, auth_service=auth_service, token=token)
+    _open_sessions += 1
+    WS_SESSIONS.inc()
+    try:
+        while True:
+            raw = await websocket.receive_text()
+            try:
+                message = json.loads(raw)
+            except ValueError:
+                await session.send({"type": "error", "id": None, "status": 400, "message": "Frames must be JSON."})
+                continue
+            if not isinstance(message, dict):
+                await session.send({"type": "error", "id": None, "status": 400, "message": "Frames must be JSON objects."})
+                continue
+            await session.handle(message)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        _open_sessions -= 1
+        WS_SESSIONS.dec()
+        await session.close()
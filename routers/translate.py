@@ -1,39 +1,55 @@
-from fastapi import APIRouter, HTTPException
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
 from fastapi.responses import JSONResponse
-from pydantic import BaseModel
 
-from services.openai_service import OpenAIService
+from services.openai_service import OpenAIService, get_openai_service
+from services.auth_service import get_optional_user
+from services.idempotency import IdempotencyStore, get_idempotency_store, idempotent
+from services.job_service import JobRunner, accepted_response, callback_url, get_job_runner, wants_async
+from services.user_repository import UserRecord
+from utils.canonical import canonicalize_request
+from utils.deadline import Deadline, get_deadline, run_cancellable
+from utils.exceptions import APIError, NotFoundError
 from utils.logger import logger
+from utils.responses import PydanticJSONResponse
 
 from models.request import TranslateRequest
 from models.response import TranslateResponse
 
 router = APIRouter(prefix="/translate", tags=["Translation"])
 
-# Initialize the OpenAI service (already initialized in `utils.config`)
-openai_service = OpenAIService()
-
-# Define the request model for translation requests. 
-# Refer to `models/request.py` for more details.
-class TranslateRequest(BaseModel):
-    source_language: str
-    target_language: str
-    text: str
-
-# Define the response model for translation responses.
-# Refer to `models/response.py` for more details.
-class TranslateResponse(BaseModel):
-    translated_text: str
-
 @router.post("/", response_model=TranslateResponse)
-async def translate_text(request: TranslateRequest):
+async def translate_text(
+    request: TranslateRequest,
+    http_request: Request,
+    http_response: Response,
+    openai_service: OpenAIService = Depends(get_openai_service),
+    current_user: Optional[UserRecord] = Depends(get_optional_user),
+    deadline: Deadline = Depends(get_deadline),
+    job_runner: JobRunner = Depends(get_job_runner),
+    idempotency: IdempotencyStore = Depends(get_idempotency_store),
+):
     """Translates text between languages using OpenAI's API.
 
+    With `Prefer: respond-async` the translation runs as a background job:
+    the response is 202 with the job id, and the result is fetched from
+    `GET /jobs/{id}` or POSTed to the `X-Callback-URL` webhook. A retry sent
+    with the same `Idempotency-Key` header gets the first attempt's
+    translation (or, in async mode, its job) instead of a new (billed) one.
+
     Args:
         request (TranslateRequest): The request body containing the source language, target language, and text to translate.
+        http_request (Request): The raw request, watched for client disconnects.
+        http_response (Response): Carries the `Idempotent-Replayed` header on replays.
+        openai_service (OpenAIService): The OpenAI service instance.
+        current_user (Optional[UserRecord]): The authenticated caller, if a bearer token was sent.
+        deadline (Deadline): When the caller stops waiting; bounds the upstream call.
+        job_runner (JobRunner): Runs the translation in the background in async mode.
+        idempotency (IdempotencyStore): Remembers results by Idempotency-Key.
 
     Returns:
-        TranslateResponse: The translated text in a TranslateResponse object.
+        TranslateResponse: The translated text in a TranslateResponse object, or a 202 response in async mode.
 
     Raises:
         HTTPException: If an error occurs during translation.
@@ -41,21 +57,80 @@ async def translate_text(request: TranslateRequest):
     try:
         # Validate the request data using the TranslateRequest model.
         # Refer to `models/request.py` for validation rules. 
-        logger.info(f"Received translation request: {request}")
+        logger.info(
+            "Received translation request",
+            extra={
+                "route": "translate",
+                "source_language": request.source_language,
+                "target_language": request.target_language,
+                "text": request.text,
+            },
+        )
+
+        # Normalize the body once; every cache and deduplication layer keys on the digest
+        canonical = canonicalize_request(http_request, "translate", request)
+
+        username = current_user.username if current_user else None
+        if wants_async(http_request):
+            async def translate(timeout: float) -> dict:
+                translated = await openai_service.translate_text(
+                    source_language=request.source_language,
+                    target_language=request.target_language,
+                    text=request.text,
+                    user=username,
+                    timeout=timeout,
+                    key=canonical.digest,
+                )
+                return TranslateResponse(translated_text=translated).model_dump()
+
+            async def submit() -> str:
+                job = await job_runner.submit("translate", translate, owner=username, webhook_url=callback_url(http_request))
+                return job.id
+
+            # A retried submit gets the first attempt's job rather than a second (billed) one
+            job_id = await idempotent(
+                http_request, http_response, idempotency, "translate:async", username, canonical.digest, submit,
+                timeout=deadline.remaining(),
+            )
+            job = await job_runner.store.lookup(job_id)
+            if job is None:
+                raise NotFoundError("The job for this Idempotency-Key has expired.")
+            response = accepted_response(job)
+            response.headers.update(http_response.headers)
+            return response
 
         # Translate the text using the OpenAI service.
         # Refer to `services/openai_service.py` for the implementation.
-        response = await openai_service.translate_text(
-            source_language=request.source_language,
-            target_language=request.target_language,
-            text=request.text
+        response = await run_cancellable(
+            http_request,
+            "translate",
+            len(request.text) // 4,
+            idempotent(
+                http_request,
+                http_response,
+                idempotency,
+                "translate",
+                username,
+                canonical.digest,
+                lambda: openai_service.translate_text(
+                    source_language=request.source_language,
+                    target_language=request.target_language,
+                    text=request.text,
+                    user=username,
+                    timeout=deadline.remaining(),
+                    key=canonical.digest,
+                ),
+                timeout=deadline.remaining(),
+            ),
         )
 
         # Format the response data into the TranslateResponse model.
         # Refer to `models/response.py` for model details.
-        return TranslateResponse(translated_text=response)
+        return PydanticJSONResponse(TranslateResponse(translated_text=response), headers=http_response.headers)
 
+    except APIError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
     except Exception as e:
         # Log the error and return an error response.
-        logger.error(f"Error translating text: {e}")
+        logger.error("Error translating text: %s", e)
         raise HTTPException(status_code=500, detail="Error translating text.")
\ No newline at end of file
@@ -0,0 +1,198 @@
+import asyncio
+import math
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Optional
+
+from openai import RateLimitError
+from prometheus_client import Counter, Gauge
+
+from utils.config import settings
+
+ADAPTIVE_LIMIT = Gauge("upstream_adaptive_limit", "Current adaptive in-flight limit", ["model"])
+ADAPTIVE_IN_FLIGHT = Gauge("upstream_adaptive_in_flight", "Upstream calls in flight", ["model"])
+ADAPTIVE_BASELINE_RTT = Gauge("upstream_baseline_rtt_seconds", "No-load latency estimate", ["model"])
+ADAPTIVE_ADJUSTMENTS = Counter(
+    "upstream_limit_adjustments_total",
+    "Adaptive limit changes and why they happened",
+    ["model", "reason"],
+)
+
+
+class AdaptiveLimiter:
+    """Vegas-style adaptive concurrency limit for one upstream model.
+
+    Each completed call yields a latency sample. Against the lowest latency
+    seen recently (the no-load baseline), the limiter estimates how many
+    requests are queued upstream: `limit * (1 - baseline / rtt)`. While that
+    estimate stays small the limit grows; once it passes a threshold the
+    limit shrinks. A rate-limit error halves the limit immediately.
+
+    The baseline is the minimum latency observed, allowed to drift up by 10%
+    every `probe_interval` seconds so the limiter follows an upstream that
+    got permanently slower.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        initial_limit: float = 20,
+        min_limit: float = 1,
+        max_limit: float = 200,
+        backoff_ratio: float = 0.5,
+        probe_interval: float = 60.0,
+        rate_limit_errors: tuple = (RateLimitError,),
+    ):
+        self.name = name
+        self.limit = float(initial_limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.backoff_ratio = backoff_ratio
+        self.probe_interval = probe_interval
+        self.rate_limit_errors = rate_limit_errors
+        self.in_flight = 0
+        self.baseline_rtt: Optional[float] = None
+        self.last_reason = "initial"
+        self._last_probe = time.monotonic()
+        self._window_rtt = 0.0
+        self._window_count = 0
+        self._window_in_flight = 0
+        self._waiters: deque = deque()
+        ADAPTIVE_LIMIT.labels(name).set(self.limit)
+
+    def _adjust(self, new_limit: float, reason: str) -> None:
+        new_limit = min(self.max_limit, max(self.min_limit, new_limit))
+        if new_limit == self.limit:
+            return
+        self.limit = new_limit
+        self.last_reason = reason
+        ADAPTIVE_LIMIT.labels(self.name).set(new_limit)
+        ADAPTIVE_ADJUSTMENTS.labels(self.name, reason).inc()
+        self._wake()
+
+    def on_sample(self, rtt: float, in_flight: int) -> None:
+        """Feeds one successful call's latency (seconds) into the limit.
+
+        Samples are averaged over a window of roughly one round trip's worth
+        of calls (`limit` samples) and the limit moves at most once per window,
+        as in TCP Vegas; adjusting on every sample would overshoot badly.
+        """
+        now = time.monotonic()
+        if now - self._last_probe >= self.probe_interval and self.baseline_rtt is not None:
+            self._last_probe = now
+            # Let the baseline drift up slowly; resetting it under load would
+            # mistake queueing delay for the new no-load latency
+            self.baseline_rtt *= 1.1
+        if self.baseline_rtt is None or rtt < self.baseline_rtt:
+            self.baseline_rtt = rtt
+            ADAPTIVE_BASELINE_RTT.labels(self.name).set(rtt)
+        self._window_rtt += rtt
+        self._window_count += 1
+        self._window_in_flight = max(self._window_in_flight, in_flight)
+        if self._window_count < self.limit:
+            return
+        avg_rtt = self._window_rtt / self._window_count
+        max_in_flight = self._window_in_flight
+        self._window_rtt, self._window_count, self._window_in_flight = 0.0, 0, 0
+
+        queue = self.limit * (1 - self.baseline_rtt / avg_rtt) if avg_rtt > 0 else 0.0
+        step = max(1.0, math.log10(self.limit))
+        if queue > 6 * step:
+            self._adjust(self.limit - step, "latency_inflation")
+        elif queue < 3 * step and max_in_flight * 2 >= self.limit:
+            # Only grow when the current limit is actually being used
+            self._adjust(self.limit + step, "increase")
+
+    def on_rate_limited(self) -> None:
+        self._adjust(self.limit * self.backoff_ratio, "rate_limited")
+
+    def _wake(self) -> None:
+        while self._waiters and self.in_flight < int(self.limit):
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                self.in_flight += 1
+                waiter.set_result(None)
+        ADAPTIVE_IN_FLIGHT.labels(self.name).set(self.in_flight)
+
+    async def acquire(self) -> None:
+        if self.in_flight < int(self.limit) and not self._waiters:
+            self.in_flight += 1
+            ADAPTIVE_IN_FLIGHT.labels(self.name).set(self.in_flight)
+            return
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self.release()
+            else:
+                waiter.cancel()
+            raise
+
+    def release(self) -> None:
+        self.in_flight -= 1
+        self._wake()
+
+    @asynccontextmanager
+    async def slot(self):
+        """Holds one in-flight slot and feeds the call's outcome back into the limit."""
+        await self.acquire()
+        in_flight = self.in_flight
+        started = time.monotonic()
+        try:
+            yield
+        except Exception as e:
+            if isinstance(e, self.rate_limit_errors):
+                self.on_rate_limited()
+            raise
+        else:
+            self.on_sample(time.monotonic() - started, in_flight)
+        finally:
+            self.release()
+
+    def snapshot(self) -> dict:
+        return {
+            "limit": self.limit,
+            "in_flight": self.in_flight,
+            "queued": len(self._waiters),
+            "baseline_rtt": self.baseline_rtt,
+            "last_reason": self.last_reason,
+        }
+
+
+class AdaptiveLimiterRegistry:
+    """Lazily creates one AdaptiveLimiter per upstream model."""
+
+    def __init__(self, **limiter_kwargs):
+        self.limiter_kwargs = limiter_kwargs
+        self.limiters: dict[str, AdaptiveLimiter] = {}
+
+    def get(self, model: str) -> AdaptiveLimiter:
+        limiter = self.limiters.get(model)
+        if limiter is None:
+            limiter = AdaptiveLimiter(model, **self.limiter_kwargs)
+            self.limiters[model] = limiter
+        return limiter
+
+    def slot(self, model: str):
+        return self.get(model).slot()
+
+    def snapshot(self) -> dict:
+        return {model: limiter.snapshot() for model, limiter in self.limiters.items()}
+
+
+_limiters: Optional[AdaptiveLimiterRegistry] = None
+
+
+def get_adaptive_limiters() -> AdaptiveLimiterRegistry:
+    """Returns the process-wide per-model limiter registry."""
+    global _limiters
+    if _limiters is None:
+        _limiters = AdaptiveLimiterRegistry(
+            initial_limit=settings.ADAPTIVE_LIMIT_INITIAL,
+            min_limit=settings.ADAPTIVE_LIMIT_MIN,
+            max_limit=settings.ADAPTIVE_LIMIT_MAX,
+        )
+    return _limiters
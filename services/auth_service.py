@@ -1,60 +1,217 @@
+import asyncio
+import hashlib
+import math
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+import jwt
 from fastapi import Depends, HTTPException, status
-from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
-from jose import JWTError, jwt
+from fastapi.security import OAuth2PasswordBearer
 from pydantic import BaseModel
-from typing import Optional
 
 from utils.config import settings
 from utils.logger import logger
-from utils.auth import create_access_token, verify_password
+from utils.auth import (
+    SigningKeys,
+    TokenCache,
+    create_access_token,
+    decode_access_token,
+    verify_password,
+)
+from services.shared_store import SharedStore, SharedStoreError, get_shared_store
+from services.user_repository import CachedUserRepository, UserRecord, create_user_repository
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
+optional_oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token", auto_error=False)
+
+# Shared-store lifetime of a revocation for a token without `exp`
+_NO_EXPIRY_TTL = 10 * 365 * 86400.0
 
 class TokenData(BaseModel):
-    username: str = None
+    username: Optional[str] = None
+
+class AuthService:
+    def __init__(
+        self,
+        secret_key: str,
+        keys: Optional[SigningKeys] = None,
+        token_cache: Optional[TokenCache] = None,
+        user_repository: Optional[CachedUserRepository] = None,
+        shared_store: Optional[SharedStore] = None,
+        revocation_check_interval: float = 1.0,
+    ):
+        self.secret_key = secret_key
+        self.user_repository = user_repository
+        # Revocations are published here so every worker rejects the token, not just this one
+        self.shared_store = shared_store
+        self.revocation_check_interval = revocation_check_interval
+        self._revocation_checks: OrderedDict[str, float] = OrderedDict()
+        # Password hashing is deliberately slow; keep it off the event loop
+        self._hash_executor = ThreadPoolExecutor(
+            max_workers=settings.PASSWORD_HASH_WORKERS, thread_name_prefix="password-hash"
+        )
+        self.keys = keys or SigningKeys(
+            settings.ALGORITHM,
+            secret=secret_key,
+            private_key=settings.JWT_PRIVATE_KEY,
+            public_key=settings.JWT_PUBLIC_KEY,
+        )
+        self.token_cache = token_cache or TokenCache(
+            maxsize=settings.JWT_CACHE_SIZE, max_ttl=settings.AUTH_EXPIRY
+        )
+
+    def verify_token(self, token: str) -> dict:
+        """Returns the verified claims for `token`, using the cache when possible.
+
+        Raises:
+            jwt.PyJWTError: If the token is invalid, expired or revoked.
+        """
+        claims = self.token_cache.get(token)
+        if claims is not None:
+            return claims
+        claims = decode_access_token(token, self.keys)
+        if self.token_cache.is_revoked(token, claims):
+            raise jwt.InvalidTokenError("Token has been revoked.")
+        self.token_cache.put(token, claims)
+        return claims
+
+    async def revoke_token(self, token: Optional[str] = None, jti: Optional[str] = None, expires_at: Optional[float] = None) -> None:
+        """Revokes a token (or every token sharing a `jti`).
+
+        It takes effect on this process at once, and on the other workers
+        within `revocation_check_interval` seconds when a shared store is
+        configured; without one, only this process rejects the token. A `jti`
+        alone needs `expires_at` (epoch seconds) unless a token with that
+        `jti` is cached; see `TokenCache.revoke`.
+        """
+        until = self.token_cache.revoke(token=token, jti=jti, expires_at=expires_at)
+        if self.shared_store is None:
+            return
+        ttl = until - time.time() if math.isfinite(until) else _NO_EXPIRY_TTL
+        if ttl <= 0:
+            return
+        keys = ([_revocation_key(token)] if token is not None else []) + ([f"revoked:jti:{jti}"] if jti else [])
+        try:
+            for key in keys:
+                await self.shared_store.take(key, 1, None, ttl)
+        except SharedStoreError as e:
+            logger.warning("Could not publish a token revocation; other workers still accept it: %s", e)
+
+    async def revoked_elsewhere(self, token: str, claims: dict) -> bool:
+        """Whether another worker revoked `token`; asks the shared store at most every check interval per token."""
+        if self.shared_store is None:
+            return False
+        now = time.monotonic()
+        checked = self._revocation_checks.get(token)
+        if checked is not None and now - checked < self.revocation_check_interval:
+            return False
+        jti = claims.get("jti")
+        keys = [_revocation_key(token)] + ([f"revoked:jti:{jti}"] if jti else [])
+        try:
+            for key in keys:
+                _, used = await self.shared_store.take(key, 0, None, 1)
+                if used > 0:
+                    self.token_cache.revoke(token=token, jti=jti)
+                    self._revocation_checks.pop(token, None)
+                    return True
+        except SharedStoreError as e:
+            logger.warning("Could not check token revocations in the shared store: %s", e)
+            return False
+        self._revocation_checks[token] = now
+        self._revocation_checks.move_to_end(token)
+        while len(self._revocation_checks) > self.token_cache.maxsize:
+            self._revocation_checks.popitem(last=False)
+        return False
+
+    async def authenticate_user(self, username: str, password: str):
+        user = await self.get_user(username)
+        if user is None or user.disabled or user.hashed_password is None:
+            return False
+        loop = asyncio.get_running_loop()
+        verified = await loop.run_in_executor(
+            self._hash_executor, verify_password, password, user.hashed_password
+        )
+        if not verified:
+            return False
+        return True
+
+    async def get_user(self, username: str) -> Optional[UserRecord]:
+        if self.user_repository is None:
+            # No user store configured; every token subject is accepted as-is
+            return UserRecord(username=username)
+        return await self.user_repository.get_user(username)
+
+    async def close(self) -> None:
+        if self.user_repository is not None:
+            await self.user_repository.close()
+        self._hash_executor.shutdown(wait=False)
+
+    async def create_access_token(self, data: dict):
+        if self.keys.signing_key is None:
+            raise ValueError("This node holds only a verification key and cannot issue tokens.")
+        return create_access_token(data, self.keys.signing_key, self.keys.algorithm)
+
+    async def create_refresh_token(self, data: dict):
+        # Replace with your actual refresh token generation logic
+        return "refresh_token"
+
+_auth_service: Optional[AuthService] = None
+
+def get_auth_service() -> AuthService:
+    """Returns the process-wide AuthService so parsed keys and the token cache are shared."""
+    global _auth_service
+    if _auth_service is None:
+        _auth_service = AuthService(
+            settings.JWT_SECRET,
+            user_repository=create_user_repository(),
+            shared_store=get_shared_store(),
+            revocation_check_interval=settings.JWT_REVOCATION_CHECK_INTERVAL,
+        )
+    return _auth_service
+
+
+def _revocation_key(token: str) -> str:
+    # Raw tokens are credentials; the shared store only sees a digest
+    return "revoked:token:" + hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+
+def user_from_claims(claims: dict) -> UserRecord:
+    """Builds the user object directly from self-sufficient token claims."""
+    extra = {claim: claims[claim] for claim in settings.JWT_USER_CLAIMS if claim in claims}
+    return UserRecord(username=claims["sub"], claims=extra)
 
 async def get_current_user(token: str = Depends(oauth2_scheme), auth_service: AuthService = Depends(get_auth_service)):
+    return await _resolve_user(token, auth_service)
+
+async def get_optional_user(token: Optional[str] = Depends(optional_oauth2_scheme), auth_service: AuthService = Depends(get_auth_service)) -> Optional[UserRecord]:
+    """Like `get_current_user`, but anonymous requests resolve to None instead of 401."""
+    if token is None:
+        return None
+    return await _resolve_user(token, auth_service)
+
+async def _resolve_user(token: str, auth_service: AuthService) -> UserRecord:
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
     try:
-        payload = jwt.decode(token, settings.JWT_SECRET, algorithms=[settings.ALGORITHM])
+        payload = auth_service.verify_token(token)
+        if await auth_service.revoked_elsewhere(token, payload):
+            raise jwt.InvalidTokenError("Token has been revoked.")
         username: str = payload.get("sub")
         if username is None:
             raise credentials_exception
         token_data = TokenData(username=username)
-    except JWTError:
+    except jwt.PyJWTError as e:
+        logger.debug("Rejected token: %s", e)
         raise credentials_exception
+    if settings.JWT_STATELESS_USERS:
+        # Claims carry everything downstream needs; skip the user lookup
+        return user_from_claims(payload)
     user = await auth_service.get_user(username=token_data.username)
-    if user is None:
+    if user is None or user.disabled:
         raise credentials_exception
     return user
-
-async def get_auth_service():
-    return AuthService(settings.JWT_SECRET)
-
-class AuthService:
-    def __init__(self, secret_key: str):
-        self.secret_key = secret_key
-
-    async def authenticate_user(self, username: str, password: str):
-        user = await self.get_user(username)
-        if user is None:
-            return False
-        if not verify_password(password, user.hashed_password):
-            return False
-        return True
-
-    async def get_user(self, username: str):
-        # Replace with your actual user retrieval logic
-        # Example: Query a database
-        return {"username": username}
-
-    async def create_access_token(self, data: dict):
-        return create_access_token(data, settings.JWT_SECRET, settings.ALGORITHM)
-
-    async def create_refresh_token(self, data: dict):
-        # Replace with your actual refresh token generation logic
-        return "refresh_token"
\ No newline at end of file
@@ -0,0 +1,200 @@
+import random
+import time
+from typing import Optional
+
+from openai import APIConnectionError, APITimeoutError, InternalServerError
+from prometheus_client import Counter, Gauge
+
+from services.key_pool import ApiKey, KeyPool, create_key_pool
+from utils.config import settings
+from utils.exceptions import NotFoundError
+from utils.logger import logger
+
+BACKEND_LATENCY = Gauge("backend_latency_ewma_seconds", "EWMA upstream latency per backend", ["backend"])
+BACKEND_IN_FLIGHT = Gauge("backend_in_flight", "Calls in flight per backend", ["backend"])
+BACKEND_SELECTED = Counter("backend_selected_total", "Calls routed to each backend", ["backend"])
+BACKEND_UNHEALTHY = Counter("backend_marked_unhealthy_total", "Times a backend was marked unhealthy", ["backend"])
+
+# Errors that say something about the backend itself rather than the request
+BACKEND_ERRORS = (APIConnectionError, APITimeoutError, InternalServerError)
+
+
+class Backend:
+    """An OpenAI-compatible upstream: its models, capacity, latency and health.
+
+    `models=None` means the backend serves any model (the OpenAI API itself);
+    local inference servers declare the models they host. Health is tracked
+    passively: `failure_threshold` consecutive connection, timeout or 5xx
+    errors take the backend out of selection for `cooldown` seconds.
+
+    Calls routed to the backend that are still waiting for their upstream
+    slots are counted in `queued`, so they weigh on its load from the moment
+    it is chosen rather than only once they start.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        key_pool: KeyPool,
+        models: Optional[list[str]] = None,
+        capacity: int = 64,
+        failure_threshold: int = 3,
+        cooldown: float = 15.0,
+        alpha: float = 0.2,
+    ):
+        self.name = name
+        self.key_pool = key_pool
+        self.models = set(models) if models else None
+        self.capacity = capacity
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.alpha = alpha
+        self.in_flight = 0
+        self.queued = 0
+        self.ewma_latency = 0.0
+        self.failures = 0
+        self.unhealthy_until = 0.0
+
+    def serves(self, model: str) -> bool:
+        return self.models is None or model in self.models
+
+    def healthy(self, now: float) -> bool:
+        return now >= self.unhealthy_until
+
+    def load(self) -> int:
+        return self.in_flight + self.queued
+
+    def score(self, prior_latency: float = 1.0) -> float:
+        """Expected wait for one more call: latency scaled by current load.
+
+        A backend that has not answered yet is scored with `prior_latency`
+        rather than zero, so it doesn't win every comparison until it has.
+        """
+        return (self.ewma_latency or prior_latency) * (self.load() + 1)
+
+    def reserve(self) -> None:
+        self.queued += 1
+
+    def unreserve(self) -> None:
+        self.queued -= 1
+
+    def acquire(self, estimated_tokens: float) -> ApiKey:
+        self.in_flight += 1
+        BACKEND_IN_FLIGHT.labels(self.name).set(self.in_flight)
+        return self.key_pool.acquire(estimated_tokens)
+
+    def release(
+        self,
+        key: ApiKey,
+        estimated_tokens: float,
+        latency: float,
+        actual_tokens: Optional[int] = None,
+        error: Optional[BaseException] = None,
+    ) -> None:
+        self.in_flight -= 1
+        BACKEND_IN_FLIGHT.labels(self.name).set(self.in_flight)
+        self.key_pool.release(key, estimated_tokens, actual_tokens, error)
+        if isinstance(error, BACKEND_ERRORS):
+            self.failures += 1
+            if self.failures >= self.failure_threshold:
+                self.unhealthy_until = time.monotonic() + self.cooldown
+                self.failures = 0
+                BACKEND_UNHEALTHY.labels(self.name).inc()
+                logger.warning("Backend %s marked unhealthy for %.0fs", self.name, self.cooldown)
+        elif error is None:
+            self.failures = 0
+            self.ewma_latency = latency if not self.ewma_latency else (
+                (1 - self.alpha) * self.ewma_latency + self.alpha * latency
+            )
+            BACKEND_LATENCY.labels(self.name).set(self.ewma_latency)
+
+    def snapshot(self) -> dict:
+        return {
+            "models": sorted(self.models) if self.models else "*",
+            "in_flight": self.in_flight,
+            "queued": self.queued,
+            "capacity": self.capacity,
+            "ewma_latency": self.ewma_latency,
+            "healthy": self.healthy(time.monotonic()),
+        }
+
+    async def close(self) -> None:
+        await self.key_pool.close()
+
+
+class BackendRouter:
+    """Chooses a backend per call with power-of-two-choices.
+
+    Backends that list the model are preferred; catch-all backends, which
+    list none, are used only for models no backend declares. Two random
+    eligible backends (serving the model, healthy, below capacity) are
+    compared and the one with the lower `score` wins. This keeps most load
+    on fast, idle backends without herding every request onto the single
+    best one. `reserve` also counts the choice against the backend's load
+    right away, so calls selected together spread out.
+    """
+
+    def __init__(self, backends: list[Backend]):
+        if not backends:
+            raise ValueError("BackendRouter needs at least one backend")
+        self.backends = backends
+
+    def select(self, model: str, prior_latency: float = 1.0) -> Backend:
+        """Picks a backend for `model`; `prior_latency` stands in for backends with no latency yet."""
+        now = time.monotonic()
+        # A catch-all backend would answer 404 for a model only a local backend declares
+        serving = [b for b in self.backends if b.models is not None and model in b.models]
+        serving = serving or [b for b in self.backends if b.models is None]
+        if not serving:
+            raise NotFoundError(f"No backend serves model '{model}'.")
+        eligible = [b for b in serving if b.healthy(now) and b.load() < b.capacity]
+        if not eligible:
+            # Everything is down or saturated; try the least-bad option rather than fail outright
+            eligible = [min(serving, key=lambda b: (not b.healthy(now), b.load() / b.capacity))]
+        if len(eligible) == 1:
+            choice = eligible[0]
+        else:
+            first, second = random.sample(eligible, 2)
+            choice = first if first.score(prior_latency) <= second.score(prior_latency) else second
+        BACKEND_SELECTED.labels(choice.name).inc()
+        return choice
+
+    def reserve(self, model: str, prior_latency: float = 1.0) -> Backend:
+        """Like `select`, but the call counts against the backend until its `unreserve`."""
+        backend = self.select(model, prior_latency)
+        backend.reserve()
+        return backend
+
+    def declared_models(self) -> list[str]:
+        return sorted({model for b in self.backends if b.models for model in b.models})
+
+    def snapshot(self) -> dict:
+        return {backend.name: backend.snapshot() for backend in self.backends}
+
+    async def close(self) -> None:
+        for backend in self.backends:
+            await backend.close()
+
+
+def create_backend_router(key_pool: Optional[KeyPool] = None) -> BackendRouter:
+    """Builds the router: the OpenAI key pool plus any backends listed in BACKENDS."""
+    health = {"failure_threshold": settings.BACKEND_FAILURE_THRESHOLD, "cooldown": settings.BACKEND_COOLDOWN}
+    backends = [Backend("openai", key_pool or create_key_pool(), capacity=settings.OPENAI_BACKEND_CAPACITY, **health)]
+    for entry in settings.BACKENDS:
+        key = ApiKey(
+            entry.get("api_key", "not-needed"),
+            base_url=entry["base_url"],
+            rpm=float(entry.get("rpm", 1e9)),
+            tpm=float(entry.get("tpm", 1e12)),
+            max_connections=int(entry.get("capacity", 64)),
+        )
+        backends.append(
+            Backend(
+                entry["name"],
+                KeyPool([key]),
+                models=entry.get("models"),
+                capacity=int(entry.get("capacity", 64)),
+                **health,
+            )
+        )
+    return BackendRouter(backends)
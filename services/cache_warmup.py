@@ -0,0 +1,145 @@
+import asyncio
+import gzip
+import json
+import time
+from collections import Counter
+from typing import Optional
+
+from services.response_cache import ResponseCache
+from utils.config import settings
+from utils.logger import logger
+
+WARMING = "warming"
+READY = "ready"
+
+
+def top_questions(path: str, limit: int) -> list[tuple[str, str]]:
+    """The `limit` most frequent (model, question) pairs in a JSON-lines traffic log.
+
+    Each line is a JSON object with at least `route` and `question`; `model`
+    defaults to "auto". Traffic captures (see `utils.capture`) work too, the
+    fields then coming from each record's `body`, but only records captured
+    with CAPTURE_REDACT=none: redacted questions are stand-ins, and answering
+    them would spend upstream calls caching text no client will send. Lines
+    for other routes and unparsable lines are skipped, and a truncated gzip
+    file (one still being written) is read up to its last complete line.
+    """
+    counts: Counter = Counter()
+    redacted = 0
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rt", encoding="utf-8") as f:
+        try:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if record.get("route") != "question":
+                    continue
+                if isinstance(record.get("body"), dict):
+                    if record.get("redacted", True):
+                        redacted += 1
+                        continue
+                    fields = record["body"]
+                else:
+                    fields = record
+                if fields.get("question"):
+                    counts[(fields.get("model") or "auto", fields["question"])] += 1
+        except (EOFError, gzip.BadGzipFile):
+            logger.warning("Traffic file %s is truncated; read up to its last complete line", path)
+    if redacted:
+        logger.warning("Skipped %d redacted capture records in %s; warm-up needs CAPTURE_REDACT=none", redacted, path)
+    return [pair for pair, _ in counts.most_common(limit)]
+
+
+class CacheWarmer:
+    """Fills the response cache after a deploy so the hit rate doesn't start at zero.
+
+    Two stages share one time budget: first the most recently used entries of
+    the persistent cache are loaded into the in-process layer, then the top-N
+    `/question` prompts from the traffic log are answered (a cache hit for
+    anything already on disk) with at most `concurrency` upstream calls at a
+    time. `status` stays "warming" until both finish or the budget runs out.
+    """
+
+    def __init__(
+        self,
+        cache: ResponseCache,
+        openai_service=None,
+        traffic_file: Optional[str] = None,
+        top_n: int = 200,
+        concurrency: int = 4,
+        budget: float = 30.0,
+    ):
+        self.cache = cache
+        self.openai_service = openai_service
+        self.traffic_file = traffic_file
+        self.top_n = top_n
+        self.concurrency = concurrency
+        self.budget = budget
+        self.status = WARMING
+        self.loaded = 0
+        self.precomputed = 0
+        self._task: Optional[asyncio.Task] = None
+
+    async def _precompute(self) -> None:
+        if not self.traffic_file or self.openai_service is None:
+            return
+        pairs = await asyncio.to_thread(top_questions, self.traffic_file, self.top_n)
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def answer(model: str, question: str) -> None:
+            async with semaphore:
+                try:
+                    await self.openai_service.answer_question(model=model, question=question)
+                    self.precomputed += 1
+                except Exception as e:
+                    logger.warning("Cache warm-up failed for a question: %s", e)
+
+        await asyncio.gather(*(answer(model, question) for model, question in pairs))
+
+    async def _warm(self) -> None:
+        self.loaded = await self.cache.warm_memory(self.top_n)
+        await self._precompute()
+
+    async def run(self) -> None:
+        started = time.monotonic()
+        try:
+            await asyncio.wait_for(self._warm(), self.budget)
+        except asyncio.TimeoutError:
+            logger.warning("Cache warm-up stopped after its %.0fs budget", self.budget)
+        except Exception as e:
+            logger.error("Cache warm-up failed: %s", e)
+        finally:
+            self.status = READY
+            logger.info(
+                "Cache warm-up done: %d entries loaded, %d questions answered in %.1fs",
+                self.loaded,
+                self.precomputed,
+                time.monotonic() - started,
+            )
+
+    def start(self) -> asyncio.Task:
+        """Runs the warm-up in the background so the server can start accepting requests."""
+        self._task = asyncio.create_task(self.run())
+        return self._task
+
+    async def stop(self) -> None:
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+
+def create_cache_warmer(cache: ResponseCache, openai_service) -> CacheWarmer:
+    """Builds the warmer from the CACHE_WARMUP_* settings."""
+    return CacheWarmer(
+        cache,
+        openai_service,
+        traffic_file=settings.CACHE_WARMUP_TRAFFIC_FILE,
+        top_n=settings.CACHE_WARMUP_TOP_N,
+        concurrency=settings.CACHE_WARMUP_CONCURRENCY,
+        budget=settings.CACHE_WARMUP_BUDGET,
+    )
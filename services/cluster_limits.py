@@ -0,0 +1,141 @@
+import asyncio
+import time
+from typing import Optional
+
+from prometheus_client import Counter
+
+from services.shared_store import SharedStore, SharedStoreError, get_shared_store
+from utils.config import settings
+from utils.logger import logger
+
+LEASE_REQUESTS = Counter("cluster_lease_requests_total", "Round trips to the shared store for budget leases", ["budget"])
+LEASE_FALLBACKS = Counter(
+    "cluster_lease_fallbacks_total", "Budget taken from the local fallback while the shared store was down", ["budget"]
+)
+
+# How long to stop asking an unreachable store before trying again
+_STORE_RETRY_INTERVAL = 5.0
+
+
+class LeasedBudget:
+    """A cluster-wide per-window budget (e.g. requests or tokens per minute).
+
+    The budget lives in the shared store as one counter per window. Instead
+    of a round trip per request, each process leases a batch (`lease` units,
+    or more when a single request needs it) and spends it locally; leftovers
+    lapse when the window ends. When the store is unreachable the process
+    falls back to `fallback_share` of the budget on its own.
+    """
+
+    def __init__(
+        self,
+        store: Optional[SharedStore],
+        name: str,
+        capacity: float,
+        window: float = 60.0,
+        lease: Optional[float] = None,
+        fallback_share: float = 0.25,
+    ):
+        self.store = store
+        self.name = name
+        self.capacity = capacity
+        self.window = window
+        self.lease = lease or max(1.0, capacity * 0.02)
+        self.fallback_share = fallback_share
+        self.leased = 0.0
+        self._window_id: Optional[int] = None
+        self._exhausted_window: Optional[int] = None
+        self._fallback_used = 0.0
+        self._store_down_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _roll_window(self, now: float) -> int:
+        window_id = int(now // self.window)
+        if window_id != self._window_id:
+            self._window_id = window_id
+            self.leased = 0.0
+            self._fallback_used = 0.0
+        return window_id
+
+    async def _lease(self, window_id: int, needed: float) -> float:
+        """Leases at least `needed` units from the store; returns what was granted."""
+        LEASE_REQUESTS.labels(self.name).inc()
+        requested = max(needed, self.lease)
+        granted, _ = await self.store.take(f"budget:{self.name}:{window_id}", requested, self.capacity, self.window * 2)
+        if granted < requested:
+            # The cluster has spent this window; stop asking until the next one
+            self._exhausted_window = window_id
+        return granted
+
+    def _take_fallback(self, amount: float) -> bool:
+        if self._fallback_used + amount > self.capacity * self.fallback_share:
+            return False
+        self._fallback_used += amount
+        LEASE_FALLBACKS.labels(self.name).inc(amount)
+        return True
+
+    async def try_acquire(self, amount: float) -> bool:
+        """Spends `amount` from the budget if the current window still has it."""
+        amount = min(amount, self.capacity)
+        async with self._lock:
+            now = time.time()
+            window_id = self._roll_window(now)
+            if self.leased >= amount:
+                self.leased -= amount
+                return True
+            if self._exhausted_window == window_id:
+                return False
+            if self.store is None or time.monotonic() < self._store_down_until:
+                return self._take_fallback(amount)
+            try:
+                self.leased += await self._lease(window_id, amount - self.leased)
+            except SharedStoreError as e:
+                logger.warning("Shared store unreachable for %s budget, using local fallback: %s", self.name, e)
+                self._store_down_until = time.monotonic() + _STORE_RETRY_INTERVAL
+                return self._take_fallback(amount)
+            if self.leased >= amount:
+                self.leased -= amount
+                return True
+            return False
+
+    async def acquire(self, amount: float) -> None:
+        """Waits until the budget has `amount` units, sleeping through exhausted windows."""
+        while not await self.try_acquire(amount):
+            await asyncio.sleep(self.window - time.time() % self.window + 0.01)
+
+
+class ClusterLimits:
+    """Organization-wide RPM/TPM budgets per backend, shared by every worker on every node."""
+
+    def __init__(
+        self,
+        requests: Optional[dict[str, LeasedBudget]] = None,
+        tokens: Optional[dict[str, LeasedBudget]] = None,
+    ):
+        self.requests = requests or {}
+        self.tokens = tokens or {}
+
+    async def acquire(self, backend: str, estimated_tokens: float) -> None:
+        if backend in self.requests:
+            await self.requests[backend].acquire(1)
+        if backend in self.tokens:
+            await self.tokens[backend].acquire(estimated_tokens)
+
+
+def create_cluster_limits(store: Optional[SharedStore] = None) -> ClusterLimits:
+    """Builds the OpenAI organization budgets from CLUSTER_RPM / CLUSTER_TPM (0 disables each)."""
+    store = store or get_shared_store()
+
+    def budgets(unit: str, capacity: float) -> dict[str, LeasedBudget]:
+        if not capacity:
+            return {}
+        budget = LeasedBudget(
+            store,
+            f"openai:{unit}",
+            capacity,
+            lease=max(1.0, capacity * settings.CLUSTER_LEASE_FRACTION),
+            fallback_share=settings.CLUSTER_FALLBACK_SHARE,
+        )
+        return {"openai": budget}
+
+    return ClusterLimits(budgets("rpm", settings.CLUSTER_RPM), budgets("tpm", settings.CLUSTER_TPM))
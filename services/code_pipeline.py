@@ -0,0 +1,119 @@
+import asyncio
+import hashlib
+import multiprocessing
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Optional
+
+from prometheus_client import Counter, Histogram
+
+from utils.code_processing import PROCESSED_LANGUAGES, extract_code, process_code, warm_up
+from utils.config import settings
+from utils.logger import logger
+
+CODE_PIPELINE_STAGE_SECONDS = Histogram(
+    "code_pipeline_stage_seconds",
+    "Time spent in each code post-processing stage; queue is the wait for a worker plus the hand-off",
+    ["stage"],
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0),
+)
+CODE_PIPELINE_RESULTS = Counter("code_pipeline_results_total", "Post-processed code results, by outcome", ["outcome"])
+
+
+class CodePipeline:
+    """Post-processes generated code before it is returned.
+
+    Fenced code blocks for the requested language are extracted from the
+    completion; Python is then checked with `ast.parse` and, when it parses,
+    formatted with black. Checking and formatting run in a pool of `workers`
+    processes so they never block the event loop; extraction alone is cheap
+    and runs inline. Results are cached by a hash of the language and the
+    completion text, so a repeated completion is processed once.
+
+    The pipeline is best-effort: if a worker takes longer than `timeout`
+    seconds or the pool breaks, the extracted but unformatted code is used.
+    """
+
+    def __init__(self, workers: int = 2, cache_size: int = 1024, timeout: float = 5.0):
+        self.workers = workers
+        self.cache_size = cache_size
+        self.timeout = timeout
+        self._cache: OrderedDict[bytes, str] = OrderedDict()
+        self._pool: Optional[ProcessPoolExecutor] = None
+
+    def _executor(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            # Forking a process that runs an event loop and logging threads can
+            # copy held locks into the child; spawned workers start clean
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"), initializer=warm_up
+            )
+        return self._pool
+
+    @staticmethod
+    def _cache_key(text: str, language: str) -> bytes:
+        return hashlib.blake2b(f"{language}\0{text}".encode("utf-8", "surrogatepass"), digest_size=16).digest()
+
+    def _remember(self, key: bytes, code: str) -> None:
+        self._cache[key] = code
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    async def _run(self, text: str, language: str):
+        started = time.perf_counter()
+        result = await asyncio.wait_for(
+            asyncio.get_running_loop().run_in_executor(self._executor(), process_code, text, language), self.timeout
+        )
+        _, _, timings = result
+        CODE_PIPELINE_STAGE_SECONDS.labels("queue").observe(max(0.0, time.perf_counter() - started - sum(timings.values())))
+        return result
+
+    async def process(self, text: str, language: str) -> str:
+        """The post-processed code for the completion `text`."""
+        language = language.strip().lower()
+        key = self._cache_key(text, language)
+        code = self._cache.get(key)
+        if code is not None:
+            self._cache.move_to_end(key)
+            CODE_PIPELINE_RESULTS.labels("cached").inc()
+            return code
+
+        if language not in PROCESSED_LANGUAGES:
+            code, valid, timings = process_code(text, language)
+        else:
+            try:
+                code, valid, timings = await self._run(text, language)
+            except (asyncio.TimeoutError, BrokenProcessPool) as e:
+                logger.warning("Code post-processing failed, returning the code unformatted: %r", e)
+                CODE_PIPELINE_RESULTS.labels("failed").inc()
+                if isinstance(e, BrokenProcessPool):
+                    self._pool = None
+                return extract_code(text, language)
+
+        for stage, seconds in timings.items():
+            CODE_PIPELINE_STAGE_SECONDS.labels(stage).observe(seconds)
+        CODE_PIPELINE_RESULTS.labels({True: "valid", False: "invalid", None: "unchecked"}[valid]).inc()
+        self._remember(key, code)
+        return code
+
+    def close(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+
+_code_pipeline: Optional[CodePipeline] = None
+
+
+def get_code_pipeline() -> CodePipeline:
+    """Returns the process-wide CodePipeline; its worker processes start on first use."""
+    global _code_pipeline
+    if _code_pipeline is None:
+        _code_pipeline = CodePipeline(
+            workers=settings.CODE_PIPELINE_WORKERS,
+            cache_size=settings.CODE_PIPELINE_CACHE_SIZE,
+            timeout=settings.CODE_PIPELINE_TIMEOUT,
+        )
+    return _code_pipeline
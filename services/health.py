@@ -0,0 +1,170 @@
+import asyncio
+import time
+from collections import deque
+from typing import Awaitable, Callable, Optional
+
+from prometheus_client import Gauge
+
+from services.scheduler import FairScheduler, get_scheduler
+from utils.admission import AdmissionController, get_admission_controller
+from utils.config import settings
+from utils.logger import logger
+
+EVENT_LOOP_LAG = Gauge("event_loop_lag_seconds", "Worst event-loop lag over the recent window")
+UPSTREAM_PROBE_UP = Gauge("upstream_probe_up", "1 if the last upstream probe succeeded, else 0")
+
+
+class HealthMonitor:
+    """Tracks the signals behind `/readyz`.
+
+    A ticker sleeps `lag_interval` seconds at a time and records how late it
+    wakes up; the event-loop lag is the worst of the last `lag_window`
+    samples, so a stall keeps the worker unready for a few seconds after it
+    ends. A prober calls the upstream every `probe_interval` seconds and
+    keeps the outcome, so readiness checks never reach the upstream no
+    matter how often a load balancer polls them.
+
+    A worker is ready while the lag is at most `max_loop_lag`, every
+    admission class's queue is less than `max_queue_fraction` full, and
+    (when `require_upstream` is set) fewer than `probe_failures` probes in a
+    row have failed.
+    """
+
+    def __init__(
+        self,
+        probe: Callable[[], Awaitable[object]],
+        admission: Optional[AdmissionController] = None,
+        scheduler: Optional[FairScheduler] = None,
+        lag_interval: float = 0.5,
+        lag_window: int = 10,
+        max_loop_lag: float = 0.25,
+        max_queue_fraction: float = 0.8,
+        probe_interval: float = 30.0,
+        probe_timeout: float = 5.0,
+        probe_failures: int = 2,
+        require_upstream: bool = True,
+    ):
+        self.probe = probe
+        self.admission = admission or get_admission_controller()
+        self.scheduler = scheduler or get_scheduler()
+        self.lag_interval = lag_interval
+        self.max_loop_lag = max_loop_lag
+        self.max_queue_fraction = max_queue_fraction
+        self.probe_interval = probe_interval
+        self.probe_timeout = probe_timeout
+        self.probe_failures = probe_failures
+        self.require_upstream = require_upstream
+        self._lags: deque = deque(maxlen=lag_window)
+        self.consecutive_failures = 0
+        self.last_probe: Optional[float] = None
+        self.last_error: Optional[str] = None
+        self._stopping: Optional[asyncio.Event] = None
+        self._tasks: list[asyncio.Task] = []
+
+    @property
+    def loop_lag(self) -> float:
+        return max(self._lags, default=0.0)
+
+    def start(self) -> None:
+        if not self._tasks:
+            self._stopping = asyncio.Event()
+            self._tasks = [asyncio.create_task(self._watch_loop()), asyncio.create_task(self._probe_loop())]
+
+    async def stop(self) -> None:
+        if self._stopping is not None:
+            self._stopping.set()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _watch_loop(self) -> None:
+        loop = asyncio.get_running_loop()
+        while not self._stopping.is_set():
+            started = loop.time()
+            await asyncio.sleep(self.lag_interval)
+            self._lags.append(max(0.0, loop.time() - started - self.lag_interval))
+            EVENT_LOOP_LAG.set(self.loop_lag)
+
+    async def probe_once(self) -> bool:
+        """Calls the upstream once and records the outcome."""
+        try:
+            await asyncio.wait_for(self.probe(), self.probe_timeout)
+        except Exception as e:
+            self.consecutive_failures += 1
+            self.last_error = str(e) or type(e).__name__
+            logger.warning("Upstream probe failed (%d in a row): %s", self.consecutive_failures, self.last_error)
+        else:
+            self.consecutive_failures = 0
+            self.last_error = None
+        self.last_probe = time.monotonic()
+        UPSTREAM_PROBE_UP.set(0 if self.consecutive_failures else 1)
+        return not self.consecutive_failures
+
+    async def _probe_loop(self) -> None:
+        # Checks the stop event rather than relying on cancellation alone:
+        # on Python 3.11, wait_for can swallow a cancel that lands as the probe finishes
+        while not self._stopping.is_set():
+            await self.probe_once()
+            try:
+                await asyncio.wait_for(self._stopping.wait(), self.probe_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    def readiness(self) -> tuple[bool, dict]:
+        """Whether the worker should take traffic, and the checks behind the answer."""
+        lag = self.loop_lag
+        classes = self.admission.snapshot()
+        saturated = sorted(
+            name
+            for name, limiter in classes.items()
+            if limiter["max_queue"] and limiter["queued"] >= self.max_queue_fraction * limiter["max_queue"]
+        )
+        scheduler = self.scheduler.snapshot()
+        upstream_ok = not self.require_upstream or self.consecutive_failures < self.probe_failures
+        checks = {
+            "event_loop": {"ok": lag <= self.max_loop_lag, "lag": round(lag, 4), "max_lag": self.max_loop_lag},
+            "saturation": {
+                "ok": not saturated,
+                "saturated": saturated,
+                "admission": classes,
+                "upstream": {
+                    "in_flight": scheduler["in_flight"],
+                    "capacity": scheduler["capacity"],
+                    "queued": sum(tenant["queued"] for tenant in scheduler["tenants"].values()),
+                },
+            },
+            "upstream": {
+                "ok": upstream_ok,
+                "consecutive_failures": self.consecutive_failures,
+                "last_probe_age": None if self.last_probe is None else round(time.monotonic() - self.last_probe, 1),
+                "error": self.last_error,
+            },
+        }
+        return all(check["ok"] for check in checks.values()), checks
+
+
+_health_monitor: Optional[HealthMonitor] = None
+
+
+def get_health_monitor() -> HealthMonitor:
+    """Returns the process-wide HealthMonitor; it probes the upstream by listing models."""
+    global _health_monitor
+    if _health_monitor is None:
+        from services.openai_service import get_openai_service
+
+        async def probe():
+            return await (await get_openai_service()).get_models()
+
+        _health_monitor = HealthMonitor(
+            probe,
+            lag_interval=settings.HEALTH_LAG_INTERVAL,
+            lag_window=settings.HEALTH_LAG_WINDOW,
+            max_loop_lag=settings.HEALTH_MAX_LOOP_LAG,
+            max_queue_fraction=settings.HEALTH_MAX_QUEUE_FRACTION,
+            probe_interval=settings.HEALTH_PROBE_INTERVAL,
+            probe_timeout=settings.HEALTH_PROBE_TIMEOUT,
+            probe_failures=settings.HEALTH_PROBE_FAILURES,
+            require_upstream=settings.HEALTH_REQUIRE_UPSTREAM,
+        )
+    return _health_monitor
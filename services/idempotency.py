@@ -0,0 +1,251 @@
+import asyncio
+import sqlite3
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Optional
+
+from fastapi import Request, Response
+from prometheus_client import Counter
+
+from services.response_cache import DiskCache
+from services.usage_service import ANONYMOUS_USER
+from utils.config import settings
+from utils.exceptions import DeadlineExceededError, IdempotencyKeyMismatchError, ValidationError
+from utils.logger import logger
+
+IDEMPOTENCY_HEADER = "idempotency-key"
+REPLAYED_HEADER = "Idempotent-Replayed"
+
+IDEMPOTENT_REQUESTS = Counter(
+    "idempotent_requests_total", "Requests carrying an Idempotency-Key, by outcome", ["route", "outcome"]
+)
+
+# How often a worker checks on a key that another worker is still computing
+_POLL_INTERVAL = 0.05
+
+_MAX_KEY_LENGTH = 255
+
+
+class _Record:
+    """What is known about one idempotency key in this process."""
+
+    __slots__ = ("digest", "future", "expires")
+
+    def __init__(self, digest: str, future: asyncio.Future, expires: float):
+        self.digest = digest
+        self.future = future
+        self.expires = expires
+
+
+class IdempotencyStore:
+    """Remembers the outcome of requests sent with an `Idempotency-Key`.
+
+    The first request with a key runs; its in-flight future, then its
+    result, is kept for `ttl` seconds together with the digest of its
+    canonical body. A repeat of the key gets the same result, waiting for
+    the first call if it is still running, without another upstream call.
+    A repeat with a different body is refused. Failed or cancelled calls
+    are forgotten so the client's retry runs again.
+
+    The table holds at most `maxsize` keys per process; finished keys are
+    dropped oldest first, running ones never. With a `DiskCache` the keys
+    are shared by every worker on the host: the first worker claims the key
+    atomically, and the others poll for its result (a claim lapses after
+    `claim_ttl` seconds, in case that worker dies). A repeat waits for the
+    first call no longer than its own deadline.
+    """
+
+    def __init__(
+        self,
+        maxsize: int = 10000,
+        ttl: float = 86400.0,
+        disk: Optional[DiskCache] = None,
+        claim_ttl: float = 300.0,
+    ):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.disk = disk
+        self.claim_ttl = claim_ttl
+        self._records: OrderedDict[str, _Record] = OrderedDict()
+
+    def _lookup(self, key: str) -> Optional[_Record]:
+        record = self._records.get(key)
+        if record is not None and record.expires <= time.monotonic():
+            del self._records[key]
+            return None
+        return record
+
+    def _remember(self, key: str, record: _Record) -> None:
+        self._records[key] = record
+        if len(self._records) > self.maxsize:
+            finished = [k for k, r in self._records.items() if r.future.done()]
+            for old in finished[: len(self._records) - self.maxsize]:
+                del self._records[old]
+
+    def _forget(self, key: str, record: _Record) -> None:
+        if self._records.get(key) is record:
+            del self._records[key]
+
+    @staticmethod
+    def _check_digest(stored: str, digest: str) -> None:
+        if stored != digest:
+            raise IdempotencyKeyMismatchError()
+
+    async def _claim(self, key: str, digest: str, deadline: Optional[float]) -> Optional[Any]:
+        """Claims `key` across workers; returns None once claimed, or the result another worker stored.
+
+        Raises:
+            DeadlineExceededError: If another worker still holds the key at `deadline` (monotonic).
+        """
+        while True:
+            try:
+                if await self.disk.add(key, {"digest": digest, "done": False}, self.claim_ttl):
+                    return None
+                entry = await self.disk.get(key)
+            except sqlite3.Error as e:
+                logger.warning("Idempotency store unavailable, deduplicating in this worker only: %s", e)
+                return None
+            if entry is not None:
+                self._check_digest(entry["digest"], digest)
+                if entry["done"]:
+                    return entry
+            if deadline is not None and time.monotonic() >= deadline:
+                raise DeadlineExceededError("Deadline exceeded waiting for the first request with this Idempotency-Key.")
+            await asyncio.sleep(_POLL_INTERVAL)
+
+    async def _persist(self, key: str, digest: str, result: Any) -> None:
+        try:
+            await self.disk.set(key, {"digest": digest, "done": True, "result": result}, self.ttl)
+        except sqlite3.Error as e:
+            logger.warning("Could not persist an idempotent result: %s", e)
+
+    async def _release(self, key: str) -> None:
+        try:
+            await self.disk.delete(key)
+        except sqlite3.Error as e:
+            logger.warning("Could not release an idempotency key: %s", e)
+
+    async def run(
+        self, key: str, digest: str, call: Callable[[], Awaitable[Any]], timeout: Optional[float] = None
+    ) -> tuple[Any, bool]:
+        """Runs `call` once per `key`; returns its result and whether it was replayed.
+
+        A repeat of a key that is still running waits at most `timeout` seconds.
+
+        Raises:
+            IdempotencyKeyMismatchError: If `key` was first used with a different body.
+            DeadlineExceededError: If the first call is still running after `timeout` seconds.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            record = self._lookup(key)
+            if record is None:
+                break
+            self._check_digest(record.digest, digest)
+            try:
+                if not record.future.done():
+                    wait = None if deadline is None else max(0.0, deadline - time.monotonic())
+                    await asyncio.wait_for(asyncio.shield(record.future), wait)
+                return record.future.result(), True
+            except asyncio.TimeoutError:
+                raise DeadlineExceededError("Deadline exceeded waiting for the first request with this Idempotency-Key.")
+            except asyncio.CancelledError:
+                if not record.future.cancelled():
+                    raise
+                # The first caller went away before finishing; run it ourselves
+
+        future = asyncio.get_running_loop().create_future()
+        record = _Record(digest, future, time.monotonic() + self.ttl)
+        self._remember(key, record)
+        if self.disk is not None:
+            try:
+                stored = await self._claim(key, digest, deadline)
+            except BaseException:
+                # Nothing ran here; waiters in this worker retry with their own deadlines
+                self._forget(key, record)
+                future.cancel()
+                raise
+            if stored is not None:
+                future.set_result(stored["result"])
+                return stored["result"], True
+        try:
+            try:
+                result = await call()
+            except BaseException:
+                if self.disk is not None:
+                    await asyncio.shield(self._release(key))
+                raise
+        except asyncio.CancelledError:
+            self._forget(key, record)
+            future.cancel()
+            raise
+        except BaseException as e:
+            self._forget(key, record)
+            future.set_exception(e)
+            # Waiters re-raise it; don't warn about an unretrieved exception
+            future.exception()
+            raise
+        future.set_result(result)
+        if self.disk is not None:
+            await self._persist(key, digest, result)
+        return result, False
+
+    async def close(self) -> None:
+        if self.disk is not None:
+            await self.disk.close()
+
+
+async def idempotent(
+    request: Request,
+    response: Response,
+    store: IdempotencyStore,
+    route: str,
+    user: Optional[str],
+    digest: str,
+    call: Callable[[], Awaitable[Any]],
+    timeout: Optional[float] = None,
+) -> Any:
+    """Awaits `call()`, deduplicated through `store` when the request has an `Idempotency-Key`.
+
+    Keys are scoped to the route and the caller. Replayed results are marked
+    with an `Idempotent-Replayed: true` response header. A repeat waits for
+    a first request that is still running at most `timeout` seconds.
+
+    Raises:
+        ValidationError: If the key is empty or too long.
+        IdempotencyKeyMismatchError: If the key was first used with a different body.
+        DeadlineExceededError: If the first request is still running after `timeout` seconds.
+    """
+    key = request.headers.get(IDEMPOTENCY_HEADER)
+    if key is None:
+        return await call()
+    if not key or len(key) > _MAX_KEY_LENGTH:
+        raise ValidationError(f"Idempotency-Key must be 1 to {_MAX_KEY_LENGTH} characters.")
+    try:
+        result, replayed = await store.run(f"{route}:{user or ANONYMOUS_USER}:{key}", digest, call, timeout)
+    except IdempotencyKeyMismatchError:
+        IDEMPOTENT_REQUESTS.labels(route, "mismatch").inc()
+        raise
+    IDEMPOTENT_REQUESTS.labels(route, "replayed" if replayed else "first").inc()
+    if replayed:
+        response.headers[REPLAYED_HEADER] = "true"
+    return result
+
+
+_idempotency_store: Optional[IdempotencyStore] = None
+
+
+def get_idempotency_store() -> IdempotencyStore:
+    """Returns the process-wide IdempotencyStore; keys stay in this worker unless IDEMPOTENCY_STORE_PATH is set."""
+    global _idempotency_store
+    if _idempotency_store is None:
+        disk = None
+        if settings.IDEMPOTENCY_STORE_PATH:
+            disk = DiskCache(settings.IDEMPOTENCY_STORE_PATH, ttl=settings.IDEMPOTENCY_TTL)
+        _idempotency_store = IdempotencyStore(
+            maxsize=settings.IDEMPOTENCY_MAX_KEYS,
+            ttl=settings.IDEMPOTENCY_TTL,
+            disk=disk,
+            claim_ttl=settings.IDEMPOTENCY_CLAIM_TTL,
+        )
+    return _idempotency_store
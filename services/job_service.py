@@ -0,0 +1,414 @@
+import asyncio
+import hashlib
+import hmac
+import ipaddress
+import socket
+import sqlite3
+import time
+import uuid
+from collections import OrderedDict
+from typing import Awaitable, Callable, Optional
+from urllib.parse import urlsplit, urlunsplit
+
+import httpx
+from fastapi import Request
+from fastapi.responses import JSONResponse
+from prometheus_client import Counter, Gauge
+from pydantic import BaseModel, Field
+
+from services.response_cache import DiskCache
+from utils.config import settings
+from utils.exceptions import APIError, JobQueueFullError, ValidationError
+from utils.logger import logger
+
+JOBS_QUEUED = Gauge("jobs_queued", "Async jobs waiting for a worker")
+JOBS_FINISHED = Counter("jobs_finished_total", "Async jobs finished", ["route", "status"])
+WEBHOOK_DELIVERIES = Counter("job_webhook_deliveries_total", "Webhook delivery attempts", ["outcome"])
+
+CALLBACK_HEADER = "x-callback-url"
+
+# How often a worker checks on a job that another worker is running
+_POLL_INTERVAL = 0.25
+
+PENDING = "pending"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+
+
+class Job(BaseModel):
+    """
+    State of one asynchronous request.
+
+    Attributes:
+        id (str): The job id returned with the 202 response.
+        route (str): The endpoint that accepted the job.
+        status (str): pending, running, succeeded or failed.
+        result (Optional[dict]): The response body the endpoint would have returned synchronously.
+        error (Optional[str]): Why the job failed.
+        owner (Optional[str]): The user that submitted the job; only they can read it.
+        webhook_url (Optional[str]): Where to POST the finished job.
+    """
+    id: str = Field(..., description="The job id returned with the 202 response.")
+    route: str = Field(..., description="The endpoint that accepted the job.")
+    status: str = Field(PENDING, description="pending, running, succeeded or failed.")
+    result: Optional[dict] = Field(None, description="The response body the endpoint would have returned.")
+    error: Optional[str] = Field(None, description="Why the job failed.")
+    owner: Optional[str] = Field(None, description="The user that submitted the job.")
+    webhook_url: Optional[str] = Field(None, description="Where to POST the finished job.")
+    created_at: float = Field(default_factory=time.time, description="Submission time (epoch seconds).")
+    finished_at: Optional[float] = Field(None, description="Completion time (epoch seconds).")
+
+    @property
+    def done(self) -> bool:
+        return self.status in (SUCCEEDED, FAILED)
+
+
+class JobStore:
+    """Bounded in-memory job table with a retention TTL for finished jobs.
+
+    When full, the oldest finished jobs go first; jobs that are still queued
+    or running are never dropped.
+
+    Without a `DiskCache` a job is only visible to the worker that accepted
+    it, so `GET /jobs/{id}` needs a single worker. With one, every state
+    change is written through to the file shared by all workers on the
+    host, and a worker asked about a job it doesn't hold reads it from there
+    (polling it while the client long-polls).
+    """
+
+    def __init__(self, maxsize: int = 10000, retention: float = 3600.0, disk: Optional[DiskCache] = None):
+        self.maxsize = maxsize
+        self.retention = retention
+        self.disk = disk
+        self._jobs: OrderedDict[str, Job] = OrderedDict()
+        self._events: dict[str, asyncio.Event] = {}
+
+    def _prune(self) -> None:
+        cutoff = time.time() - self.retention
+        for job_id in [j.id for j in self._jobs.values() if j.done and j.finished_at < cutoff]:
+            self._remove(job_id)
+        if len(self._jobs) >= self.maxsize:
+            for job_id in [j.id for j in self._jobs.values() if j.done][: len(self._jobs) - self.maxsize + 1]:
+                self._remove(job_id)
+
+    def _remove(self, job_id: str) -> None:
+        self._jobs.pop(job_id, None)
+        self._events.pop(job_id, None)
+
+    def add(self, job: Job) -> bool:
+        """Stores `job`; False if the store is full of unfinished jobs."""
+        self._prune()
+        if len(self._jobs) >= self.maxsize:
+            return False
+        self._jobs[job.id] = job
+        self._events[job.id] = asyncio.Event()
+        return True
+
+    def get(self, job_id: str) -> Optional[Job]:
+        job = self._jobs.get(job_id)
+        if job is not None and job.done and job.finished_at < time.time() - self.retention:
+            self._remove(job_id)
+            return None
+        return job
+
+    async def save(self, job: Job) -> None:
+        """Writes `job` through to the shared file, if there is one."""
+        if self.disk is None:
+            return
+        # Unfinished jobs keep their entry until they finish and are written again
+        ttl = self.retention if job.done else self.retention + settings.JOBS_TIMEOUT
+        try:
+            await self.disk.set(f"job:{job.id}", job.model_dump(mode="json"), max(ttl, 0.001))
+        except sqlite3.Error as e:
+            logger.warning("Could not persist job %s: %s", job.id, e)
+
+    async def lookup(self, job_id: str) -> Optional[Job]:
+        """The job from this worker's table, else from the shared file."""
+        job = self.get(job_id)
+        if job is not None or self.disk is None:
+            return job
+        try:
+            entry = await self.disk.get(f"job:{job_id}")
+        except sqlite3.Error as e:
+            logger.warning("Could not read job %s: %s", job_id, e)
+            return None
+        return Job.model_validate(entry) if entry is not None else None
+
+    def finish(self, job: Job, result: Optional[dict] = None, error: Optional[str] = None) -> None:
+        job.status = FAILED if error is not None else SUCCEEDED
+        job.result, job.error, job.finished_at = result, error, time.time()
+        event = self._events.get(job.id)
+        if event is not None:
+            event.set()
+
+    async def wait(self, job_id: str, timeout: float) -> Optional[Job]:
+        """Returns the job once it is done or `timeout` seconds have passed (long-poll)."""
+        job = self.get(job_id)
+        event = self._events.get(job_id)
+        if job is None and self.disk is not None:
+            return await self._poll(job_id, timeout)
+        if job is None or job.done or event is None or timeout <= 0:
+            return job
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        return job
+
+    async def _poll(self, job_id: str, timeout: float) -> Optional[Job]:
+        deadline = time.monotonic() + timeout
+        while True:
+            job = await self.lookup(job_id)
+            if job is None or job.done or time.monotonic() >= deadline:
+                return job
+            await asyncio.sleep(min(_POLL_INTERVAL, max(0.0, deadline - time.monotonic())))
+
+
+class JobRunner:
+    """Runs accepted jobs on a fixed pool of background workers.
+
+    The queue is bounded, so a burst of submissions is refused with 503
+    instead of piling up. Finished jobs with a webhook are POSTed there,
+    retried with exponential backoff; the body is signed with HMAC-SHA256
+    in `X-Signature` when a secret is configured. Webhooks go only to hosts
+    in `callback_hosts` when it is set; otherwise the host must resolve to
+    public addresses only, so a client can't make the server call loopback,
+    private or cloud-metadata endpoints, and the POST goes to the address
+    that was checked, so a DNS answer that changes in between can't either.
+
+    On `stop`, jobs that are still queued or running are marked failed, so
+    clients polling a shared store don't wait on them forever.
+    """
+
+    def __init__(
+        self,
+        store: JobStore,
+        workers: int = 8,
+        queue_size: int = 1000,
+        timeout: float = 300.0,
+        webhook_retries: int = 3,
+        webhook_backoff: float = 1.0,
+        webhook_secret: Optional[str] = None,
+        callback_hosts: Optional[list[str]] = None,
+        http_client: Optional[httpx.AsyncClient] = None,
+    ):
+        self.store = store
+        self.workers = workers
+        self.timeout = timeout
+        self.webhook_retries = webhook_retries
+        self.webhook_backoff = webhook_backoff
+        self.webhook_secret = webhook_secret
+        self.callback_hosts = callback_hosts or []
+        self.http_client = http_client or httpx.AsyncClient(timeout=10.0)
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self._tasks: list[asyncio.Task] = []
+        self._deliveries: set[asyncio.Task] = set()
+
+    async def submit(
+        self,
+        route: str,
+        call: Callable[[float], Awaitable[dict]],
+        owner: Optional[str] = None,
+        webhook_url: Optional[str] = None,
+    ) -> Job:
+        """Queues `call(timeout)`, whose result becomes the job's `result`.
+
+        Raises:
+            JobQueueFullError: If the queue or the job store is full.
+        """
+        job = Job(id=uuid.uuid4().hex, route=route, owner=owner, webhook_url=webhook_url)
+        if self._queue.full() or not self.store.add(job):
+            raise JobQueueFullError()
+        self._queue.put_nowait((job, call))
+        JOBS_QUEUED.set(self._queue.qsize())
+        await self.store.save(job)
+        return job
+
+    async def _run(self, job: Job, call: Callable[[float], Awaitable[dict]]) -> None:
+        job.status = RUNNING
+        await self.store.save(job)
+        try:
+            result = await asyncio.wait_for(call(self.timeout), self.timeout)
+        except asyncio.TimeoutError:
+            self.store.finish(job, error="Job timed out.")
+        except APIError as e:
+            self.store.finish(job, error=str(e))
+        except Exception as e:
+            logger.error("Error running job %s: %s", job.id, e)
+            self.store.finish(job, error="Error running job.")
+        else:
+            self.store.finish(job, result=result)
+        await self.store.save(job)
+        JOBS_FINISHED.labels(job.route, job.status).inc()
+        if job.webhook_url:
+            delivery = asyncio.create_task(self._deliver(job))
+            self._deliveries.add(delivery)
+            delivery.add_done_callback(self._deliveries.discard)
+
+    async def _deliver(self, job: Job) -> bool:
+        # Checked at delivery, not only at submission, so re-pointing DNS in between doesn't help
+        target = await callback_target(job.webhook_url, self.callback_hosts)
+        if target is None:
+            logger.warning("Webhook for job %s refused: %s is not a public host", job.id, job.webhook_url)
+            WEBHOOK_DELIVERIES.labels("blocked").inc()
+            return False
+        body = job.model_dump_json(exclude={"owner", "webhook_url"}).encode("utf-8")
+        headers = {"Content-Type": "application/json"}
+        extensions = {}
+        if target != job.webhook_url:
+            # Connected by address; the name still goes in Host and, for TLS, SNI and certificate checks
+            parts = urlsplit(job.webhook_url)
+            headers["Host"] = parts.netloc.rpartition("@")[2]
+            if parts.scheme == "https":
+                extensions["sni_hostname"] = parts.hostname
+        if self.webhook_secret:
+            signature = hmac.new(self.webhook_secret.encode("utf-8"), body, hashlib.sha256).hexdigest()
+            headers["X-Signature"] = f"sha256={signature}"
+        for attempt in range(self.webhook_retries + 1):
+            try:
+                response = await self.http_client.post(target, content=body, headers=headers, extensions=extensions)
+                if response.status_code < 500 and response.status_code != 429:
+                    WEBHOOK_DELIVERIES.labels("delivered" if response.is_success else "rejected").inc()
+                    return response.is_success
+            except httpx.HTTPError as e:
+                logger.warning("Webhook delivery for job %s failed: %s", job.id, e)
+            WEBHOOK_DELIVERIES.labels("retry").inc()
+            if attempt < self.webhook_retries:
+                await asyncio.sleep(self.webhook_backoff * 2 ** attempt)
+        WEBHOOK_DELIVERIES.labels("gave_up").inc()
+        return False
+
+    async def _worker(self) -> None:
+        while True:
+            job, call = await self._queue.get()
+            JOBS_QUEUED.set(self._queue.qsize())
+            try:
+                await self._run(job, call)
+            finally:
+                self._queue.task_done()
+
+    def start(self) -> None:
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self) -> None:
+        pending = {*self._tasks, *self._deliveries}
+        while pending:
+            # wait_for can swallow a cancel that races with the call finishing; cancel again
+            for task in pending:
+                task.cancel()
+            _, pending = await asyncio.wait(pending, timeout=0.1)
+        self._tasks = []
+        while not self._queue.empty():
+            self._queue.get_nowait()
+        JOBS_QUEUED.set(0)
+        for job in [job for job in self.store._jobs.values() if not job.done]:
+            self.store.finish(job, error="Server shut down before the job finished.")
+            await self.store.save(job)
+            JOBS_FINISHED.labels(job.route, job.status).inc()
+        await self.http_client.aclose()
+        if self.store.disk is not None:
+            await self.store.disk.close()
+
+
+def wants_async(request: Request) -> bool:
+    """True when the client opted into job mode with `Prefer: respond-async` (RFC 7240)."""
+    return "respond-async" in request.headers.get("prefer", "").lower()
+
+
+def _host_listed(host: str, allowed: list[str]) -> bool:
+    """Whether `host` is in `allowed`; an entry starting with "." also matches its subdomains."""
+    return any(host == entry or (entry.startswith(".") and host.endswith(entry)) for entry in allowed)
+
+
+def _is_public(address: str) -> bool:
+    return ipaddress.ip_address(address.split("%", 1)[0]).is_global
+
+
+async def callback_target(url: str, allowed: list[str]) -> Optional[str]:
+    """The URL to POST a webhook for `url` to, or None if the server may not call it.
+
+    A host in `allowed` is used as is. Otherwise the host must resolve only
+    to public addresses, and the URL returned names one of them, so the
+    connection goes where the check looked.
+    """
+    parts = urlsplit(url)
+    host = parts.hostname
+    if not host:
+        return None
+    if allowed:
+        return url if _host_listed(host.lower(), allowed) else None
+    try:
+        infos = await asyncio.get_running_loop().getaddrinfo(host, parts.port, type=socket.SOCK_STREAM)
+    except (socket.gaierror, UnicodeError):
+        return None
+    if not infos or not all(_is_public(info[4][0]) for info in infos):
+        return None
+    address = infos[0][4][0].split("%", 1)[0]
+    netloc = f"[{address}]" if ":" in address else address
+    if parts.port is not None:
+        netloc = f"{netloc}:{parts.port}"
+    return urlunsplit(parts._replace(netloc=netloc))
+
+
+def callback_url(request: Request) -> Optional[str]:
+    """The webhook from the `X-Callback-URL` header, if any.
+
+    Hosts that can't be accepted without resolving them are checked again
+    when the webhook is delivered.
+
+    Raises:
+        ValidationError: If the URL is not http(s), its host is not in
+            JOBS_CALLBACK_HOSTS (when set), or it is a non-public IP address.
+    """
+    url = request.headers.get(CALLBACK_HEADER)
+    if not url:
+        return None
+    parts = urlsplit(url)
+    if parts.scheme not in ("http", "https") or not parts.hostname:
+        raise ValidationError("X-Callback-URL must be an http(s) URL.")
+    host = parts.hostname.lower()
+    if settings.JOBS_CALLBACK_HOSTS:
+        if not _host_listed(host, settings.JOBS_CALLBACK_HOSTS):
+            raise ValidationError("X-Callback-URL host is not allowed.")
+        return url
+    try:
+        public = _is_public(host)
+    except ValueError:
+        return url  # A name; resolved at delivery
+    if not public:
+        raise ValidationError("X-Callback-URL host is not allowed.")
+    return url
+
+
+def accepted_response(job: Job) -> JSONResponse:
+    """The 202 response pointing the client at the job."""
+    location = f"/jobs/{job.id}"
+    return JSONResponse(
+        status_code=202,
+        content={"job_id": job.id, "status": job.status, "location": location},
+        headers={"Location": location},
+    )
+
+
+_job_runner: Optional[JobRunner] = None
+
+
+def get_job_runner() -> JobRunner:
+    """Returns the process-wide JobRunner; jobs stay in this worker unless JOBS_STORE_PATH is set."""
+    global _job_runner
+    if _job_runner is None:
+        disk = None
+        if settings.JOBS_STORE_PATH:
+            disk = DiskCache(settings.JOBS_STORE_PATH, ttl=settings.JOBS_RETENTION)
+        _job_runner = JobRunner(
+            JobStore(maxsize=settings.JOBS_MAX_STORED, retention=settings.JOBS_RETENTION, disk=disk),
+            workers=settings.JOBS_WORKERS,
+            queue_size=settings.JOBS_QUEUE_SIZE,
+            timeout=settings.JOBS_TIMEOUT,
+            webhook_retries=settings.JOBS_WEBHOOK_RETRIES,
+            webhook_secret=settings.JOBS_WEBHOOK_SECRET,
+            callback_hosts=settings.JOBS_CALLBACK_HOSTS,
+        )
+    return _job_runner
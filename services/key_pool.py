@@ -0,0 +1,159 @@
+import time
+from typing import Optional
+
+import httpx
+from openai import AsyncOpenAI, AuthenticationError, DefaultAsyncHttpxClient, PermissionDeniedError, RateLimitError
+from prometheus_client import Counter, Gauge
+
+from utils.config import settings
+from utils.logger import logger
+
+KEY_HEADROOM = Gauge("openai_key_headroom", "Fraction of the key's RPM/TPM budget still available", ["key"])
+KEY_REQUESTS = Counter("openai_key_requests_total", "Upstream requests per API key", ["key", "outcome"])
+KEY_COOLDOWNS = Counter("openai_key_cooldowns_total", "Times an API key was taken out of rotation", ["key", "reason"])
+
+
+class _TokenBucket:
+    """Continuously refilling budget of `capacity` units per minute."""
+
+    __slots__ = ("capacity", "tokens", "updated")
+
+    def __init__(self, capacity: float):
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def level(self, now: float) -> float:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.capacity / 60.0)
+        self.updated = now
+        return self.tokens
+
+    def take(self, amount: float, now: float) -> None:
+        self.level(now)
+        self.tokens -= amount
+
+
+class ApiKey:
+    """One API key (optionally scoped to an organization/project) with its own client and budgets."""
+
+    def __init__(
+        self,
+        api_key: str,
+        organization: Optional[str] = None,
+        project: Optional[str] = None,
+        rpm: float = 3500,
+        tpm: float = 90000,
+        max_connections: int = 100,
+        base_url: Optional[str] = None,
+    ):
+        self.label = f"...{api_key[-4:]}" if len(api_key) > 4 else "key"
+        self.client = AsyncOpenAI(
+            api_key=api_key,
+            organization=organization,
+            project=project,
+            base_url=base_url,
+            http_client=DefaultAsyncHttpxClient(
+                limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+            ),
+        )
+        self.requests = _TokenBucket(rpm)
+        self.tokens = _TokenBucket(tpm)
+        self.failures = 0
+        self.cooldowns = 0
+        self.disabled_until = 0.0
+        self.in_flight = 0
+
+    def headroom(self, now: float) -> float:
+        return min(self.requests.level(now) / self.requests.capacity, self.tokens.level(now) / self.tokens.capacity)
+
+    def available(self, now: float) -> bool:
+        return now >= self.disabled_until
+
+
+class KeyPool:
+    """Spreads upstream calls over several API keys by remaining RPM/TPM headroom.
+
+    Each key keeps local request and token buckets refilled at its per-minute
+    limits. A call goes to the available key with the most headroom. After
+    `failure_threshold` consecutive rate-limit or auth failures a key is
+    taken out of rotation for `cooldown` seconds, doubling on each repeat.
+    """
+
+    def __init__(self, keys: list[ApiKey], failure_threshold: int = 3, cooldown: float = 30.0, max_cooldown: float = 600.0):
+        if not keys:
+            raise ValueError("KeyPool needs at least one API key")
+        self.keys = keys
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+
+    def acquire(self, estimated_tokens: float) -> ApiKey:
+        """Picks the key with the most headroom and charges the request against it."""
+        now = time.monotonic()
+        candidates = [key for key in self.keys if key.available(now)]
+        if candidates:
+            key = max(candidates, key=lambda k: (k.headroom(now), -k.in_flight))
+        else:
+            # Every key is cooling down; use the one that recovers first
+            key = min(self.keys, key=lambda k: k.disabled_until)
+        key.requests.take(1, now)
+        key.tokens.take(estimated_tokens, now)
+        key.in_flight += 1
+        KEY_HEADROOM.labels(key.label).set(key.headroom(now))
+        return key
+
+    def release(self, key: ApiKey, estimated_tokens: float, actual_tokens: Optional[int] = None, error: Optional[BaseException] = None) -> None:
+        """Reconciles token accounting and tracks failures for `key`."""
+        key.in_flight -= 1
+        now = time.monotonic()
+        if actual_tokens is not None:
+            key.tokens.take(actual_tokens - estimated_tokens, now)
+        if isinstance(error, (RateLimitError, AuthenticationError, PermissionDeniedError)):
+            reason = "rate_limited" if isinstance(error, RateLimitError) else "auth_failed"
+            KEY_REQUESTS.labels(key.label, reason).inc()
+            key.failures += 1
+            if key.failures >= self.failure_threshold:
+                duration = min(self.max_cooldown, self.cooldown * 2 ** key.cooldowns)
+                key.disabled_until = now + duration
+                key.cooldowns += 1
+                key.failures = 0
+                KEY_COOLDOWNS.labels(key.label, reason).inc()
+                logger.warning("API key %s out of rotation for %.0fs (%s)", key.label, duration, reason)
+        elif error is None:
+            KEY_REQUESTS.labels(key.label, "ok").inc()
+            key.failures = 0
+            key.cooldowns = 0
+        KEY_HEADROOM.labels(key.label).set(key.headroom(now))
+
+    def snapshot(self) -> list[dict]:
+        now = time.monotonic()
+        return [
+            {
+                "key": key.label,
+                "headroom": round(key.headroom(now), 3),
+                "in_flight": key.in_flight,
+                "available": key.available(now),
+            }
+            for key in self.keys
+        ]
+
+    async def close(self) -> None:
+        for key in self.keys:
+            await key.client.close()
+
+
+def create_key_pool(api_key: Optional[str] = None) -> KeyPool:
+    """Builds the pool from OPENAI_API_KEYS, falling back to the single OPENAI_API_KEY."""
+    entries = settings.OPENAI_API_KEYS or [{"api_key": api_key or settings.OPENAI_API_KEY}]
+    keys = [
+        ApiKey(
+            entry["api_key"],
+            organization=entry.get("organization"),
+            project=entry.get("project"),
+            rpm=float(entry.get("rpm", settings.OPENAI_KEY_RPM)),
+            tpm=float(entry.get("tpm", settings.OPENAI_KEY_TPM)),
+            max_connections=settings.OPENAI_MAX_CONNECTIONS,
+        )
+        for entry in entries
+    ]
+    return KeyPool(keys, failure_threshold=settings.OPENAI_KEY_FAILURE_THRESHOLD, cooldown=settings.OPENAI_KEY_COOLDOWN)
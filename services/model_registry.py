@@ -0,0 +1,131 @@
+import json
+from typing import Any, Optional
+
+from pydantic import BaseModel, Field
+
+from utils.config import settings
+from utils.exceptions import ValidationError
+from utils.logger import logger
+
+AUTO_MODEL = "auto"
+STRATEGIES = ("cheapest", "fastest")
+
+# What each route needs from a model
+ROUTE_CAPABILITIES = {
+    "generate": "text",
+    "question": "instruct",
+    "code": "code",
+    "translate": "translation",
+}
+
+
+class ModelProfile(BaseModel):
+    """
+    Describes one upstream model for routing and cost decisions.
+
+    Attributes:
+        name (str): The model name sent upstream.
+        context_window (int): Maximum prompt plus completion tokens.
+        input_price (float): USD per 1K prompt tokens.
+        output_price (float): USD per 1K completion tokens.
+        typical_latency (float): Typical seconds for a short completion.
+        capabilities (List[str]): Tasks the model is good enough for.
+    """
+    name: str = Field(..., description="The model name sent upstream.")
+    context_window: int = Field(..., gt=0, description="Maximum prompt plus completion tokens.")
+    input_price: float = Field(0.0, ge=0, description="USD per 1K prompt tokens.")
+    output_price: float = Field(0.0, ge=0, description="USD per 1K completion tokens.")
+    typical_latency: float = Field(1.0, gt=0, description="Typical seconds for a short completion.")
+    capabilities: list[str] = Field(default_factory=list, description="Tasks the model is good enough for.")
+
+    def cost(self, prompt_tokens: float, max_tokens: int) -> float:
+        return (prompt_tokens * self.input_price + max_tokens * self.output_price) / 1000
+
+
+DEFAULT_PROFILES = [
+    {"name": "babbage-002", "context_window": 16384, "input_price": 0.0004, "output_price": 0.0004,
+     "typical_latency": 0.4, "capabilities": ["text"]},
+    {"name": "davinci-002", "context_window": 16384, "input_price": 0.002, "output_price": 0.002,
+     "typical_latency": 0.8, "capabilities": ["text"]},
+    {"name": "gpt-3.5-turbo-instruct", "context_window": 4096, "input_price": 0.0015, "output_price": 0.002,
+     "typical_latency": 0.6, "capabilities": ["text", "instruct", "code", "translation"]},
+    # Chat-only: no capabilities, so `auto` never sends it a completions-style call
+    {"name": "gpt-3.5-turbo", "context_window": 16385, "input_price": 0.0005, "output_price": 0.0015,
+     "typical_latency": 0.9, "capabilities": []},
+    {"name": "text-davinci-003", "context_window": 4097, "input_price": 0.02, "output_price": 0.02,
+     "typical_latency": 1.5, "capabilities": ["text", "instruct", "code", "translation"]},
+    {"name": "code-davinci-002", "context_window": 8001, "input_price": 0.02, "output_price": 0.02,
+     "typical_latency": 1.5, "capabilities": ["code"]},
+]
+
+
+class ModelRegistry:
+    """Model profiles plus the `model: "auto"` selection policy.
+
+    `auto` (or `auto:cheapest` / `auto:fastest`) picks, among the models with
+    the capability the route needs and a context window large enough for the
+    prompt and `max_tokens`, the one with the lowest estimated cost or typical
+    latency. Explicit model names pass through unchanged, so models served by
+    local backends keep working without a profile.
+    """
+
+    def __init__(self, profiles: list[ModelProfile], strategy: str = "cheapest"):
+        if strategy not in STRATEGIES:
+            raise ValueError(f"Unknown model selection strategy '{strategy}'")
+        self.profiles = {profile.name: profile for profile in profiles}
+        self.strategy = strategy
+
+    def get(self, name: str) -> Optional[ModelProfile]:
+        return self.profiles.get(name)
+
+    def candidates(self, capability: str, prompt_tokens: float, max_tokens: int) -> list[ModelProfile]:
+        return [
+            profile
+            for profile in self.profiles.values()
+            if capability in profile.capabilities and prompt_tokens + max_tokens <= profile.context_window
+        ]
+
+    def resolve(self, model: str, capability: str, prompt_tokens: float, max_tokens: int) -> str:
+        """Returns the upstream model name for a request.
+
+        Raises:
+            ValidationError: If `model` is auto and no profile fits the request.
+        """
+        if model != AUTO_MODEL and not model.startswith(AUTO_MODEL + ":"):
+            return model
+        strategy = model.partition(":")[2] or self.strategy
+        if strategy not in STRATEGIES:
+            raise ValidationError(f"Unknown model selection strategy '{strategy}'.")
+        candidates = self.candidates(capability, prompt_tokens, max_tokens)
+        if not candidates:
+            raise ValidationError(
+                f"No model supports '{capability}' with {int(prompt_tokens + max_tokens)} tokens of context."
+            )
+        if strategy == "fastest":
+            choice = min(candidates, key=lambda p: (p.typical_latency, p.cost(prompt_tokens, max_tokens)))
+        else:
+            choice = min(candidates, key=lambda p: (p.cost(prompt_tokens, max_tokens), p.typical_latency))
+        return choice.name
+
+
+def load_profiles(path: Optional[str] = None, overrides: Optional[list[dict[str, Any]]] = None) -> list[ModelProfile]:
+    """Built-in profiles, then entries from the JSON file at `path`, then `overrides`; later names win."""
+    entries = {entry["name"]: entry for entry in DEFAULT_PROFILES}
+    if path:
+        with open(path, encoding="utf-8") as f:
+            entries.update({entry["name"]: entry for entry in json.load(f)})
+    entries.update({entry["name"]: entry for entry in overrides or []})
+    return [ModelProfile(**entry) for entry in entries.values()]
+
+
+_model_registry: Optional[ModelRegistry] = None
+
+
+def get_model_registry() -> ModelRegistry:
+    """Returns the process-wide ModelRegistry, loading the profiles on first use."""
+    global _model_registry
+    if _model_registry is None:
+        profiles = load_profiles(settings.MODEL_PROFILES_FILE, settings.MODEL_PROFILES)
+        _model_registry = ModelRegistry(profiles, strategy=settings.MODEL_SELECTION_STRATEGY)
+        logger.info("Loaded %d model profiles", len(profiles))
+    return _model_registry
@@ -1,85 +1,379 @@
-from typing import Optional
-from fastapi import HTTPException, status
-from openai import OpenAI
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Optional
+from openai import NOT_GIVEN, APITimeoutError
+from utils.canonical import canonicalize
+from utils.capture import record_upstream
 from utils.config import settings
 from utils.logger import logger
-from models.response import ModelResponse
-
-# Initialize OpenAI client
-openai = OpenAI(api_key=settings.OPENAI_API_KEY)
+from services.backends import BackendRouter, create_backend_router
+from services.code_pipeline import CodePipeline, get_code_pipeline
+from services.cluster_limits import ClusterLimits, create_cluster_limits
+from services.key_pool import KeyPool, create_key_pool
+from services.model_registry import AUTO_MODEL, ROUTE_CAPABILITIES, ModelRegistry, get_model_registry
+from services.adaptive_limiter import AdaptiveLimiterRegistry, get_adaptive_limiters
+from services.response_cache import ResponseCache, get_response_cache
+from services.scheduler import FairScheduler, estimate_cost, get_scheduler
+from services.stream_fanout import StreamFanout
+from services.usage_service import ANONYMOUS_USER, UsageTracker, get_usage_tracker
+from utils.exceptions import APIError, DeadlineExceededError, QuotaExceededError
 
 # Define a custom exception for OpenAI errors
 class OpenAIError(Exception):
     pass
 
+class _UpstreamCall:
+    """The client for one upstream call and the tokens it actually used."""
+
+    __slots__ = ("client", "actual_tokens")
+
+    def __init__(self, client):
+        self.client = client
+        self.actual_tokens: Optional[int] = None
+
+    def record_usage(self, usage) -> None:
+        if usage is not None:
+            self.actual_tokens = (usage.prompt_tokens or 0) + (usage.completion_tokens or 0)
+
+_openai_service: Optional["OpenAIService"] = None
+
 async def get_openai_service():
-    return OpenAIService()
+    """Returns the process-wide OpenAIService so its client and connection pool are shared."""
+    global _openai_service
+    if _openai_service is None:
+        _openai_service = OpenAIService()
+    return _openai_service
 
 class OpenAIService:
-    async def generate_text(self, model: str = "text-davinci-003", prompt: str = "", temperature: float = 0.5, max_tokens: int = 100, top_p: float = 1.0) -> str:
-        """Generates text using the specified OpenAI model."""
+    def __init__(
+        self,
+        api_key: Optional[str] = None,
+        usage_tracker: Optional[UsageTracker] = None,
+        scheduler: Optional[FairScheduler] = None,
+        limiters: Optional[AdaptiveLimiterRegistry] = None,
+        key_pool: Optional[KeyPool] = None,
+        backends: Optional[BackendRouter] = None,
+        models: Optional[ModelRegistry] = None,
+        cache: Optional[ResponseCache] = None,
+        cluster_limits: Optional[ClusterLimits] = None,
+        fanout: Optional[StreamFanout] = None,
+        code_pipeline: Optional[CodePipeline] = None,
+    ):
+        self.backends = backends or create_backend_router(key_pool or create_key_pool(api_key))
+        # The OpenAI backend always comes first; model listing goes through its keys
+        self.key_pool = self.backends.backends[0].key_pool
+        self.usage_tracker = usage_tracker or get_usage_tracker()
+        self.scheduler = scheduler or get_scheduler()
+        self.limiters = limiters or get_adaptive_limiters()
+        self.models = models or get_model_registry()
+        self.cache = cache or get_response_cache()
+        self.cluster_limits = cluster_limits or create_cluster_limits()
+        # The starter's quota or deadline must not fail the requests that joined its stream
+        self.fanout = fanout or StreamFanout(
+            self.cache,
+            buffer_size=settings.STREAM_FANOUT_BUFFER,
+            private_errors=(QuotaExceededError, DeadlineExceededError, APITimeoutError, asyncio.TimeoutError),
+        )
+        self.code_pipeline = code_pipeline or (get_code_pipeline() if settings.CODE_PIPELINE_ENABLED else None)
+
+    @staticmethod
+    async def _with_deadline(call, timeout: Optional[float]):
+        """Awaits `call`, giving up once `timeout` seconds (queueing included) have passed."""
+        if timeout is None:
+            return await call
+        try:
+            return await asyncio.wait_for(call, timeout)
+        except (asyncio.TimeoutError, APITimeoutError) as e:
+            raise DeadlineExceededError() from e
+
+    @asynccontextmanager
+    async def _upstream_slot(self, user: Optional[str], model: str, cost: float):
+        """Holds capacity in every upstream layer for the duration of one call.
+
+        The router picks a backend, counting the call against its load at
+        once, and the caller waits for that backend's cluster-wide budget
+        first: that wait can last until the next rate window, and holding a
+        fair-queuing or concurrency slot through it would block other tenants
+        and count as upstream latency. The caller
+        then waits for its fair-queuing slot and for a slot under the model's
+        adaptive concurrency limit, and calls the backend with its API key
+        that has the most headroom. Yields an `_UpstreamCall` whose client to
+        use and whose usage to report.
+        """
+        profile = self.models.get(model)
+        backend = self.backends.reserve(model, profile.typical_latency if profile else 1.0)
+        reserved = True
+        try:
+            await self.cluster_limits.acquire(backend.name, cost)
+            async with self.scheduler.slot(user or ANONYMOUS_USER, cost):
+                async with self.limiters.slot(model):
+                    backend.unreserve()
+                    reserved = False
+                    key = backend.acquire(cost)
+                    upstream = _UpstreamCall(key.client)
+                    started = time.monotonic()
+                    error = None
+                    try:
+                        yield upstream
+                    except BaseException as e:
+                        error = e
+                        raise
+                    finally:
+                        backend.release(key, cost, time.monotonic() - started, upstream.actual_tokens, error)
+        finally:
+            if reserved:
+                backend.unreserve()
+
+    async def _call_upstream(self, user: Optional[str], model: str, cost: float, timeout: Optional[float], resource: str, params: dict):
+        """Calls `client.<resource>.create(**params)` in an upstream slot; `timeout` bounds the wait plus the call.
+
+        `timeout` is also passed to the SDK as the upstream request timeout.
+        The call is recorded when the request is being captured.
+        """
+
+        async def call():
+            async with self._upstream_slot(user, model, cost) as upstream:
+                started = time.monotonic()
+                response = await getattr(upstream.client, resource).create(
+                    **params, timeout=NOT_GIVEN if timeout is None else timeout
+                )
+                upstream.record_usage(getattr(response, "usage", None))
+                record_upstream(f"{resource}.create", params, time.monotonic() - started, response)
+                return response
+
+        return await self._with_deadline(call(), timeout)
+
+    def _resolve_model(self, route: str, params: dict) -> None:
+        params["model"] = self.models.resolve(
+            params["model"], ROUTE_CAPABILITIES[route], len(params["prompt"]) / 4, params["max_tokens"]
+        )
+
+    async def _create_completion(self, route: str, user: Optional[str], timeout: Optional[float] = None, **params):
+        """Runs a completion call, enforcing the caller's quota and recording token usage.
+
+        `model="auto"` is resolved through the model registry first.
+        """
+        self.usage_tracker.check_quota(user)
+        self._resolve_model(route, params)
+        cost = estimate_cost(params["prompt"], params["max_tokens"])
+        response = await self._call_upstream(user, params["model"], cost, timeout, "completions", params)
+        usage = getattr(response, "usage", None)
+        if usage is not None:
+            self.usage_tracker.record(
+                user, params["model"], route, usage.prompt_tokens or 0, usage.completion_tokens or 0
+            )
+        return response
+
+    async def _stream_upstream(self, route: str, user: Optional[str], timeout: Optional[float] = None, emit_usage: bool = False, **params) -> AsyncIterator[str]:
+        """Yields completion text from one upstream streaming call.
+
+        Quota, model resolution and usage accounting work as in
+        `_create_completion`, and `timeout` is passed to the SDK as the
+        upstream request timeout. The upstream slot is held until the stream
+        ends or the consumer stops iterating, so cancelling the consumer frees it.
+        With `emit_usage`, the (model, usage) pair is also yielded, for the
+        fan-out to bill the requests that joined the stream.
+        """
+        self.usage_tracker.check_quota(user)
+        self._resolve_model(route, params)
+        cost = estimate_cost(params["prompt"], params["max_tokens"])
+        async with self._upstream_slot(user, params["model"], cost) as upstream:
+            stream = await upstream.client.completions.create(
+                **params,
+                stream=True,
+                stream_options={"include_usage": True},
+                timeout=NOT_GIVEN if timeout is None else timeout,
+            )
+            async for chunk in stream:
+                if chunk.usage is not None:
+                    upstream.record_usage(chunk.usage)
+                    self.usage_tracker.record(
+                        user, params["model"], route, chunk.usage.prompt_tokens or 0, chunk.usage.completion_tokens or 0
+                    )
+                    if emit_usage:
+                        yield params["model"], chunk.usage
+                if chunk.choices:
+                    yield chunk.choices[0].text
+
+    async def stream_completion(self, route: str, user: Optional[str] = None, key: Optional[str] = None, timeout: Optional[float] = None, **params) -> AsyncIterator[str]:
+        """Yields completion text as the upstream generates it.
+
+        Deterministic requests (see `_cached`) come from the response cache
+        when it has them; otherwise identical ones in flight share a single
+        upstream stream through the fan-out, which caches it once complete.
+        Every request that reaches the upstream or a shared stream has its
+        own quota checked and its own usage recorded. `key` is the request's
+        canonical digest when the caller has one; `timeout` is the caller's
+        remaining deadline, passed to the SDK.
+        """
+        if params["temperature"] > settings.RESPONSE_CACHE_MAX_TEMPERATURE:
+            stream = self._stream_upstream(route, user, timeout, **params)
+        else:
+            key = key or canonicalize(route, params).digest
+            cached = await self.cache.get(key)
+            if cached is not None:
+                yield cached
+                return
+            self.usage_tracker.check_quota(user)
+
+            def record_usage(item) -> None:
+                model, usage = item
+                self.usage_tracker.record(user, model, route, usage.prompt_tokens or 0, usage.completion_tokens or 0)
+
+            stream = self.fanout.subscribe(
+                key, lambda: self._stream_upstream(route, user, timeout, emit_usage=True, **params), on_usage=record_usage
+            )
         try:
-            response = await openai.completions.create(
+            async for text in stream:
+                yield text
+        finally:
+            await stream.aclose()
+
+    @staticmethod
+    def _request_key(route: str, key: Optional[str], **fields) -> str:
+        """The request's canonical digest; routers that already canonicalized the request pass it as `key`."""
+        return key or canonicalize(route, fields).digest
+
+    async def _cached(self, temperature: float, key: str, compute):
+        """Serves deterministic requests (temperature at most RESPONSE_CACHE_MAX_TEMPERATURE) from the response cache."""
+        if temperature > settings.RESPONSE_CACHE_MAX_TEMPERATURE:
+            return await compute()
+        return await self.cache.get_or_compute(key, compute)
+
+    async def _completion_text(self, route: str, user: Optional[str], timeout: Optional[float], key: str, **params) -> str:
+        async def compute():
+            response = await self._create_completion(route, user, timeout, **params)
+            return response.choices[0].text
+
+        return await self._cached(params["temperature"], key, compute)
+
+    async def generate_text(self, model: str = AUTO_MODEL, prompt: str = "", temperature: float = 0.5, max_tokens: int = 100, top_p: float = 1.0, user: Optional[str] = None, timeout: Optional[float] = None, key: Optional[str] = None) -> str:
+        """Generates text using the specified OpenAI model, or the registry's pick for "auto"."""
+        try:
+            key = self._request_key(
+                "generate", key, model=model, prompt=prompt, temperature=temperature, max_tokens=max_tokens, top_p=top_p
+            )
+            return await self._completion_text(
+                "generate",
+                user,
+                timeout,
+                key,
                 model=model,
                 prompt=prompt,
                 temperature=temperature,
                 max_tokens=max_tokens,
                 top_p=top_p,
             )
-            return response.choices[0].text
+        except APIError:
+            raise
         except Exception as e:
-            logger.error(f"Error generating text: {e}")
+            logger.error("Error generating text: %s", e)
             raise OpenAIError("Error generating text.") from e
 
-    async def translate_text(self, source_language: str, target_language: str, text: str) -> str:
+    async def translate_text(self, source_language: str, target_language: str, text: str, user: Optional[str] = None, timeout: Optional[float] = None, key: Optional[str] = None) -> str:
         """Translates text between languages."""
-        try:
-            response = await openai.translations.create(
-                model="gpt-3.5-turbo",
-                source_language=source_language,
-                target_language=target_language,
-                text=text,
+        async def compute():
+            self.usage_tracker.check_quota(user)
+            model = self.models.resolve(AUTO_MODEL, ROUTE_CAPABILITIES["translate"], len(text) / 4, len(text) // 4)
+            response = await self._call_upstream(
+                user,
+                model,
+                estimate_cost(text, len(text) // 4),
+                timeout,
+                "translations",
+                {"model": model, "source_language": source_language, "target_language": target_language, "text": text},
             )
             return response.text
+
+        try:
+            key = self._request_key(
+                "translate", key, source_language=source_language, target_language=target_language, text=text
+            )
+            return await self._cached(0.0, key, compute)
+        except APIError:
+            raise
         except Exception as e:
-            logger.error(f"Error translating text: {e}")
+            logger.error("Error translating text: %s", e)
             raise OpenAIError("Error translating text.") from e
 
-    async def answer_question(self, model: str = "text-davinci-003", question: str = "") -> str:
+    async def answer_question(self, model: str = AUTO_MODEL, question: str = "", user: Optional[str] = None, timeout: Optional[float] = None, key: Optional[str] = None) -> str:
         """Answers a question using the specified OpenAI model."""
         try:
-            response = await openai.completions.create(
+            key = self._request_key("question", key, model=model, question=question)
+            return await self._completion_text(
+                "question",
+                user,
+                timeout,
+                key,
                 model=model,
                 prompt=question,
                 temperature=0.0,
                 max_tokens=1000,
                 top_p=1.0,
             )
-            return response.choices[0].text
+        except APIError:
+            raise
         except Exception as e:
-            logger.error(f"Error answering question: {e}")
+            logger.error("Error answering question: %s", e)
             raise OpenAIError("Error answering question.") from e
 
-    async def generate_code(self, model: str = "code-davinci-002", prompt: str = "", language: str = "python", temperature: float = 0.5, max_tokens: int = 100, top_p: float = 1.0) -> str:
-        """Generates code in the specified language using the specified OpenAI model."""
+    async def generate_code(self, model: str = AUTO_MODEL, prompt: str = "", language: str = "python", temperature: float = 0.5, max_tokens: int = 100, top_p: float = 1.0, user: Optional[str] = None, timeout: Optional[float] = None, key: Optional[str] = None) -> str:
+        """Generates code in the specified language using the specified OpenAI model.
+
+        With the code pipeline enabled, the code is extracted from the
+        completion and, for Python, syntax-checked and formatted.
+        """
         try:
-            response = await openai.completions.create(
+            key = self._request_key(
+                "code",
+                key,
+                language=language,
                 model=model,
                 prompt=prompt,
                 temperature=temperature,
                 max_tokens=max_tokens,
                 top_p=top_p,
             )
-            return response.choices[0].text
+            text = await self._completion_text(
+                "code",
+                user,
+                timeout,
+                key,
+                model=model,
+                prompt=prompt,
+                temperature=temperature,
+                max_tokens=max_tokens,
+                top_p=top_p,
+            )
+            if self.code_pipeline is not None:
+                text = await self.code_pipeline.process(text, language)
+            return text
+        except APIError:
+            raise
         except Exception as e:
-            logger.error(f"Error generating code: {e}")
+            logger.error("Error generating code: %s", e)
             raise OpenAIError("Error generating code.") from e
 
     async def get_models(self) -> list[str]:
-        """Retrieves a list of available OpenAI models."""
+        """Retrieves a list of available models, including those served by local backends."""
         try:
-            models = await openai.models.list()
-            return [model.id for model in models.data]
+            key = self.key_pool.acquire(0)
+            try:
+                started = time.monotonic()
+                models = await key.client.models.list()
+                record_upstream("models.list", {}, time.monotonic() - started, models)
+            finally:
+                self.key_pool.release(key, 0)
+            names = [model.id for model in models.data]
+            return names + [name for name in self.backends.declared_models() if name not in names]
         except Exception as e:
-            logger.error(f"Error retrieving models: {e}")
-            raise OpenAIError("Error retrieving models.") from e
\ No newline at end of file
+            logger.error("Error retrieving models: %s", e)
+            raise OpenAIError("Error retrieving models.") from e
+
+    async def close(self) -> None:
+        if self.code_pipeline is not None:
+            self.code_pipeline.close()
+        await self.fanout.close()
+        await self.backends.close()
+        await self.cache.close()
@@ -0,0 +1,426 @@
+import asyncio
+import json
+import os
+import sqlite3
+import sys
+import time
+import zlib
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Optional
+
+from prometheus_client import Counter, Gauge
+
+from utils.config import settings
+from utils.logger import logger
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - payloads fall back to zlib
+    zstandard = None
+
+CACHE_LOOKUPS = Counter("response_cache_lookups_total", "Response cache lookups by layer and outcome", ["layer", "outcome"])
+CACHE_EVICTIONS = Counter("response_cache_evictions_total", "Entries evicted from the disk cache", ["reason"])
+CACHE_MEMORY_BYTES = Gauge("response_cache_memory_bytes", "Bytes held by the in-process response cache layer")
+CACHE_MEMORY_ENTRIES = Gauge("response_cache_memory_entries", "Entries in the in-process response cache layer")
+
+# Only refresh an entry's LRU timestamp this often, so hot keys don't turn reads into writes
+_TOUCH_INTERVAL = 60.0
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    value BLOB NOT NULL,
+    expires REAL NOT NULL,
+    accessed REAL NOT NULL
+) WITHOUT ROWID
+"""
+
+
+class DiskCache:
+    """Compressed key/value store in a SQLite database in WAL mode.
+
+    Every worker process on the host opens the same file, so they share
+    entries and the cache survives restarts. All SQLite work runs on one
+    dedicated thread per process, keeping the event loop free. The file is
+    bounded by `max_bytes`: once live pages exceed it, the least recently
+    used tenth of the entries is dropped.
+    """
+
+    def __init__(self, path: str, max_bytes: int = 256 * 1024 * 1024, ttl: float = 86400.0):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="response-cache")
+        self._conn: Optional[sqlite3.Connection] = None
+        self._writes = 0
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA mmap_size=268435456")
+            conn.execute(_SCHEMA)
+            conn.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+            self._conn = conn
+        return self._conn
+
+    def _get(self, key: str) -> Optional[Any]:
+        now = time.time()
+        conn = self._connection()
+        row = conn.execute("SELECT value, expires, accessed FROM responses WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        value, expires, accessed = row
+        if expires <= now:
+            conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            CACHE_EVICTIONS.labels("expired").inc()
+            return None
+        if now - accessed > _TOUCH_INTERVAL:
+            conn.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+        return json.loads(zlib.decompress(value))
+
+    def _set(self, key: str, value: Any, ttl: Optional[float]) -> None:
+        now = time.time()
+        blob = zlib.compress(json.dumps(value, separators=(",", ":")).encode("utf-8"))
+        conn = self._connection()
+        conn.execute(
+            "INSERT OR REPLACE INTO responses (key, value, expires, accessed) VALUES (?, ?, ?, ?)",
+            (key, blob, now + (ttl or self.ttl), now),
+        )
+        self._writes += 1
+        if self._writes % 100 == 0:
+            self._evict()
+
+    def _add(self, key: str, value: Any, ttl: Optional[float]) -> bool:
+        now = time.time()
+        blob = zlib.compress(json.dumps(value, separators=(",", ":")).encode("utf-8"))
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM responses WHERE key = ? AND expires <= ?", (key, now))
+            added = conn.execute(
+                "INSERT OR IGNORE INTO responses (key, value, expires, accessed) VALUES (?, ?, ?, ?)",
+                (key, blob, now + (ttl or self.ttl), now),
+            ).rowcount
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return added == 1
+
+    def _delete(self, key: str) -> None:
+        self._connection().execute("DELETE FROM responses WHERE key = ?", (key,))
+
+    def _live_bytes(self, conn: sqlite3.Connection) -> int:
+        page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+        page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+        free_pages = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        return (page_count - free_pages) * page_size
+
+    def _evict(self) -> None:
+        conn = self._connection()
+        expired = conn.execute("DELETE FROM responses WHERE expires <= ?", (time.time(),)).rowcount
+        CACHE_EVICTIONS.labels("expired").inc(max(expired, 0))
+        if self._live_bytes(conn) <= self.max_bytes:
+            return
+        count = conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        evicted = conn.execute(
+            "DELETE FROM responses WHERE key IN (SELECT key FROM responses ORDER BY accessed LIMIT ?)",
+            (max(1, count // 10),),
+        ).rowcount
+        CACHE_EVICTIONS.labels("size").inc(max(evicted, 0))
+
+    def _recent_entries(self, limit: int) -> list[tuple[str, Any, float]]:
+        now = time.time()
+        rows = self._connection().execute(
+            "SELECT key, value, expires FROM responses WHERE expires > ? ORDER BY accessed DESC LIMIT ?", (now, limit)
+        )
+        return [(key, json.loads(zlib.decompress(value)), expires - now) for key, value, expires in rows]
+
+    def _close(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    async def get(self, key: str) -> Optional[Any]:
+        return await self._run(self._get, key)
+
+    async def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        await self._run(self._set, key, value, ttl)
+
+    async def add(self, key: str, value: Any, ttl: Optional[float] = None) -> bool:
+        """Stores `value` only if `key` has no live entry; True if it was stored (an atomic claim)."""
+        return await self._run(self._add, key, value, ttl)
+
+    async def delete(self, key: str) -> None:
+        await self._run(self._delete, key)
+
+    async def evict(self) -> None:
+        await self._run(self._evict)
+
+    async def recent_entries(self, limit: int) -> list[tuple[str, Any, float]]:
+        """The `limit` most recently used live entries as (key, value, remaining ttl)."""
+        return await self._run(self._recent_entries, limit)
+
+    async def close(self) -> None:
+        await self._run(self._close)
+        self._executor.shutdown(wait=True)
+
+
+# Payload flags
+_JSON = 1  # not a string; stored as JSON
+_ZLIB = 2
+_ZSTD = 4
+_ZSTD_DICT = 8  # zstd with the trained dictionary
+
+
+class PayloadCodec:
+    """Turns cached values into compact bytes and back.
+
+    Strings are stored as UTF-8 and anything else as JSON. Payloads of at
+    least `threshold` bytes are compressed: with zstd when it is installed,
+    using a dictionary trained on sample entries once `train` has been
+    called (most completions are short and alike, which a dictionary
+    captures), and with zlib otherwise.
+    """
+
+    def __init__(self, threshold: int = 512, level: int = 3):
+        self.threshold = threshold
+        self.level = level
+        self.dictionary: Optional[bytes] = None
+        if zstandard is not None:
+            self._compressor = zstandard.ZstdCompressor(level=level)
+            self._decompressor = zstandard.ZstdDecompressor()
+
+    def train(self, samples: list[bytes], size: int = 16 * 1024) -> bool:
+        """Trains the zstd dictionary on `samples`; False if zstd is missing, already trained, or training fails."""
+        if zstandard is None or self.dictionary is not None or len(samples) < 16:
+            return False
+        try:
+            trained = zstandard.train_dictionary(size, samples)
+        except zstandard.ZstdError as e:
+            logger.info("Response cache dictionary not trained: %s", e)
+            return False
+        self.dictionary = trained.as_bytes()
+        self._dict_compressor = zstandard.ZstdCompressor(level=self.level, dict_data=trained)
+        self._dict_decompressor = zstandard.ZstdDecompressor(dict_data=trained)
+        return True
+
+    def encode(self, value: Any) -> tuple[int, bytes]:
+        if isinstance(value, str):
+            flags, data = 0, value.encode("utf-8")
+        else:
+            flags, data = _JSON, json.dumps(value, separators=(",", ":")).encode("utf-8")
+        if len(data) < self.threshold:
+            return flags, data
+        if zstandard is None:
+            return flags | _ZLIB, zlib.compress(data, 6)
+        if self.dictionary is not None:
+            flags, compressed = flags | _ZSTD | _ZSTD_DICT, self._dict_compressor.compress(data)
+        else:
+            flags, compressed = flags | _ZSTD, self._compressor.compress(data)
+        # zstd returns its worst-case sized buffer with a shortened length; copy out what is used
+        return flags, bytes(memoryview(compressed))
+
+    def decode(self, flags: int, payload: bytes) -> Any:
+        if flags & _ZSTD_DICT:
+            payload = self._dict_decompressor.decompress(payload)
+        elif flags & _ZSTD:
+            payload = self._decompressor.decompress(payload)
+        elif flags & _ZLIB:
+            payload = zlib.decompress(payload)
+        return json.loads(payload) if flags & _JSON else payload.decode("utf-8")
+
+
+class _Entry:
+    """One in-process cache entry; slots keep the per-entry overhead to a single small object."""
+
+    __slots__ = ("expires", "flags", "payload")
+
+    def __init__(self, expires: float, flags: int, payload: bytes):
+        self.expires = expires
+        self.flags = flags
+        self.payload = payload
+
+    def size(self) -> int:
+        # `flags` is a small int, which CPython shares, so it costs nothing per entry
+        return sys.getsizeof(self) + sys.getsizeof(self.expires) + sys.getsizeof(self.payload)
+
+
+def _compact_key(key: str) -> bytes:
+    # Cache keys are hex digests; their raw bytes take half the space
+    try:
+        return bytes.fromhex(key)
+    except ValueError:
+        return key.encode("utf-8")
+
+
+class ResponseCache:
+    """Two-level cache for upstream results: a small in-process LRU in front of a `DiskCache`.
+
+    The in-process layer keeps each entry as a slotted record holding the
+    raw digest key and an encoded, possibly compressed payload (see
+    `PayloadCodec`). It is bounded by entry count and by a byte budget
+    checked against the exact size reported by `memory_bytes`.
+
+    Concurrent misses for the same key share one computation, so a cold cache
+    after a deploy costs one upstream call per distinct request rather than
+    one per client.
+    """
+
+    def __init__(
+        self,
+        disk: Optional[DiskCache] = None,
+        memory_size: int = 1024,
+        ttl: float = 86400.0,
+        memory_bytes: int = 64 * 1024 * 1024,
+        codec: Optional[PayloadCodec] = None,
+    ):
+        self.disk = disk
+        self.memory_size = memory_size
+        self.memory_budget = memory_bytes
+        self.ttl = ttl
+        self.codec = codec or PayloadCodec()
+        self._memory: OrderedDict[bytes, _Entry] = OrderedDict()
+        self._entry_bytes = 0
+        self._inflight: dict[str, asyncio.Future] = {}
+
+    @property
+    def memory_bytes(self) -> int:
+        """Bytes held by the in-process layer: every key, entry and payload object plus the table itself."""
+        return self._entry_bytes + sys.getsizeof(self._memory)
+
+    def _drop(self, key: bytes) -> None:
+        entry = self._memory.pop(key)
+        self._entry_bytes -= sys.getsizeof(key) + entry.size()
+
+    def get_memory(self, key: str) -> Optional[Any]:
+        compact = _compact_key(key)
+        entry = self._memory.get(compact)
+        if entry is None:
+            return None
+        if entry.expires <= time.monotonic():
+            self._drop(compact)
+            return None
+        self._memory.move_to_end(compact)
+        return self.codec.decode(entry.flags, entry.payload)
+
+    def put_memory(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        compact = _compact_key(key)
+        if compact in self._memory:
+            self._drop(compact)
+        entry = _Entry(time.monotonic() + (ttl or self.ttl), *self.codec.encode(value))
+        self._memory[compact] = entry
+        self._entry_bytes += sys.getsizeof(compact) + entry.size()
+        while self._memory and (len(self._memory) > self.memory_size or self.memory_bytes > self.memory_budget):
+            self._drop(next(iter(self._memory)))
+        CACHE_MEMORY_BYTES.set(self.memory_bytes)
+        CACHE_MEMORY_ENTRIES.set(len(self._memory))
+
+    async def get(self, key: str) -> Optional[Any]:
+        value = self.get_memory(key)
+        if value is not None:
+            CACHE_LOOKUPS.labels("memory", "hit").inc()
+            return value
+        if self.disk is not None:
+            try:
+                value = await self.disk.get(key)
+            except sqlite3.Error as e:
+                logger.warning("Response cache read failed: %s", e)
+                value = None
+            if value is not None:
+                CACHE_LOOKUPS.labels("disk", "hit").inc()
+                self.put_memory(key, value)
+                return value
+        CACHE_LOOKUPS.labels("all", "miss").inc()
+        return None
+
+    async def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        self.put_memory(key, value, ttl)
+        if self.disk is not None:
+            try:
+                await self.disk.set(key, value, ttl)
+            except sqlite3.Error as e:
+                logger.warning("Response cache write failed: %s", e)
+
+    async def warm_memory(self, limit: int) -> int:
+        """Loads the most recently used disk entries into the in-process layer; returns how many."""
+        if self.disk is None:
+            return 0
+        entries = await self.disk.recent_entries(min(limit, self.memory_size))
+        # Warm-up is the first time a process sees a representative sample of entries
+        self.codec.train([value.encode("utf-8") for _, value, _ in entries if isinstance(value, str)])
+        # Oldest first, so the hottest entries end up most recently used
+        for key, value, ttl in reversed(entries):
+            self.put_memory(key, value, ttl)
+        return len(entries)
+
+    async def get_or_compute(self, key: str, compute: Callable[[], Awaitable[Any]]) -> Any:
+        """Returns the cached value for `key`, or awaits `compute()` once and caches its result."""
+        while True:
+            value = await self.get(key)
+            if value is not None:
+                return value
+            pending = self._inflight.get(key)
+            if pending is None:
+                break
+            try:
+                return await asyncio.shield(pending)
+            except asyncio.CancelledError:
+                if not pending.cancelled():
+                    raise
+                # The caller that owned the computation went away; try again ourselves
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            value = await compute()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            # Followers re-raise it; don't warn about an unretrieved exception
+            future.exception()
+            raise
+        finally:
+            self._inflight.pop(key, None)
+        future.set_result(value)
+        await self.set(key, value)
+        return value
+
+    async def close(self) -> None:
+        if self.disk is not None:
+            await self.disk.close()
+
+
+_response_cache: Optional[ResponseCache] = None
+
+
+def get_response_cache() -> ResponseCache:
+    """Returns the process-wide ResponseCache; the disk layer is off when RESPONSE_CACHE_PATH is unset."""
+    global _response_cache
+    if _response_cache is None:
+        disk = None
+        if settings.RESPONSE_CACHE_PATH:
+            disk = DiskCache(
+                settings.RESPONSE_CACHE_PATH,
+                max_bytes=settings.RESPONSE_CACHE_MAX_BYTES,
+                ttl=settings.RESPONSE_CACHE_TTL,
+            )
+        _response_cache = ResponseCache(
+            disk,
+            memory_size=settings.RESPONSE_CACHE_MEMORY_SIZE,
+            ttl=settings.RESPONSE_CACHE_TTL,
+            memory_bytes=settings.RESPONSE_CACHE_MEMORY_BYTES,
+            codec=PayloadCodec(threshold=settings.RESPONSE_CACHE_COMPRESS_THRESHOLD),
+        )
+    return _response_cache
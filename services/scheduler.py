@@ -0,0 +1,173 @@
+import asyncio
+import heapq
+import itertools
+import time
+from contextlib import asynccontextmanager
+from typing import Optional
+
+from prometheus_client import Gauge, Histogram
+
+from utils.config import settings
+
+TENANT_QUEUE_WAIT = Histogram(
+    "upstream_tenant_queue_wait_seconds",
+    "Time a tenant's request waited for upstream capacity",
+    ["tenant"],
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0),
+)
+TENANT_IN_FLIGHT = Gauge("upstream_tenant_in_flight", "Upstream calls in flight per tenant", ["tenant"])
+TENANT_QUEUED = Gauge("upstream_tenant_queued", "Upstream calls waiting per tenant", ["tenant"])
+
+# Metric label for tenants without their own series; tenant names come from JWT
+# subjects, so labelling every one would grow the number of series without bound
+OTHER_TENANTS = "other"
+
+
+class _Tenant:
+    __slots__ = ("name", "label", "weight", "last_finish", "in_flight", "queued")
+
+    def __init__(self, name: str, label: str, weight: float):
+        self.name = name
+        self.label = label
+        self.weight = weight
+        self.last_finish = 0.0
+        self.in_flight = 0
+        self.queued = 0
+
+
+class FairScheduler:
+    """Weighted fair queuing of a fixed upstream concurrency budget across tenants.
+
+    Implements start-time fair queuing: each request gets a virtual start
+    tag and a finish tag of `start + cost / weight`, and freed slots go to
+    the waiter with the smallest finish tag. A tenant that sends a flood of
+    requests pushes its own tags far ahead, so a light tenant arriving later
+    is served next. Idle tenants earn up to `burst` cost units of credit, so
+    an occasional request from a small tenant skips the backlog entirely.
+
+    Metrics are labelled by tenant only for `metric_tenants` (by default the
+    tenants with a configured weight); all others share the "other" series.
+    """
+
+    def __init__(
+        self,
+        capacity: int,
+        weights: Optional[dict[str, float]] = None,
+        default_weight: float = 1.0,
+        burst: float = 0.0,
+        metric_tenants: Optional[set[str]] = None,
+    ):
+        self.capacity = capacity
+        self.weights = weights or {}
+        self.metric_tenants = set(self.weights) if metric_tenants is None else set(metric_tenants)
+        self.default_weight = default_weight
+        self.burst = burst
+        self.in_flight = 0
+        self.virtual_time = 0.0
+        self._tenants: dict[str, _Tenant] = {}
+        self._heap: list = []
+        self._seq = itertools.count()
+
+    def _tenant(self, name: str) -> _Tenant:
+        tenant = self._tenants.get(name)
+        if tenant is None:
+            label = name if name in self.metric_tenants else OTHER_TENANTS
+            tenant = _Tenant(name, label, self.weights.get(name, self.default_weight))
+            self._tenants[name] = tenant
+        return tenant
+
+    def _grant(self, tenant: _Tenant, start: float) -> None:
+        self.in_flight += 1
+        tenant.in_flight += 1
+        self.virtual_time = max(self.virtual_time, start)
+        TENANT_IN_FLIGHT.labels(tenant.label).inc()
+
+    async def acquire(self, tenant_name: str, cost: float = 1.0) -> None:
+        tenant = self._tenant(tenant_name)
+        start = max(self.virtual_time - self.burst / tenant.weight, tenant.last_finish)
+        finish = start + cost / tenant.weight
+        tenant.last_finish = finish
+        if self.in_flight < self.capacity and not self._heap:
+            self._grant(tenant, start)
+            return
+        waiter = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._heap, (finish, next(self._seq), start, tenant, waiter))
+        tenant.queued += 1
+        TENANT_QUEUED.labels(tenant.label).inc()
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self.release(tenant_name)
+            else:
+                waiter.cancel()  # Skipped lazily when it reaches the top of the heap
+                tenant.queued -= 1
+                TENANT_QUEUED.labels(tenant.label).dec()
+            raise
+
+    def release(self, tenant_name: str) -> None:
+        tenant = self._tenants[tenant_name]
+        tenant.in_flight -= 1
+        self.in_flight -= 1
+        TENANT_IN_FLIGHT.labels(tenant.label).dec()
+        if not tenant.in_flight and not tenant.queued and tenant.last_finish <= self.virtual_time - self.burst / tenant.weight:
+            # An idle tenant with no outstanding credit is indistinguishable from a new one
+            del self._tenants[tenant_name]
+        self._dispatch()
+
+    def _dispatch(self) -> None:
+        while self._heap and self.in_flight < self.capacity:
+            _, _, start, tenant, waiter = heapq.heappop(self._heap)
+            if waiter.done():
+                continue
+            tenant.queued -= 1
+            TENANT_QUEUED.labels(tenant.label).dec()
+            self._grant(tenant, start)
+            waiter.set_result(None)
+
+    def set_capacity(self, capacity: int) -> None:
+        self.capacity = capacity
+        self._dispatch()
+
+    @asynccontextmanager
+    async def slot(self, tenant_name: str, cost: float = 1.0):
+        """Holds one unit of upstream capacity for `tenant_name` while the block runs."""
+        started = time.monotonic()
+        await self.acquire(tenant_name, cost)
+        TENANT_QUEUE_WAIT.labels(self._tenants[tenant_name].label).observe(time.monotonic() - started)
+        try:
+            yield
+        finally:
+            self.release(tenant_name)
+
+    def snapshot(self) -> dict:
+        return {
+            "capacity": self.capacity,
+            "in_flight": self.in_flight,
+            "tenants": {
+                name: {"weight": t.weight, "in_flight": t.in_flight, "queued": t.queued}
+                for name, t in self._tenants.items()
+            },
+        }
+
+
+def estimate_cost(prompt: str, max_tokens: int) -> float:
+    """Approximates the upstream tokens a request will consume (~4 chars per token)."""
+    return len(prompt) / 4 + max_tokens
+
+
+_scheduler: Optional[FairScheduler] = None
+
+
+def get_scheduler() -> FairScheduler:
+    """Returns the process-wide FairScheduler."""
+    global _scheduler
+    if _scheduler is None:
+        _scheduler = FairScheduler(
+            settings.UPSTREAM_MAX_CONCURRENCY,
+            weights=settings.TENANT_WEIGHTS,
+            default_weight=settings.TENANT_DEFAULT_WEIGHT,
+            burst=settings.TENANT_BURST_TOKENS,
+            metric_tenants=set(settings.TENANT_METRIC_LABELS) if settings.TENANT_METRIC_LABELS else None,
+        )
+    return _scheduler
@@ -0,0 +1,160 @@
+import asyncio
+import os
+from abc import ABC, abstractmethod
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+from utils.config import settings
+from utils.logger import logger
+
+try:
+    import redis.asyncio as aioredis
+except ImportError:  # pragma: no cover - redis is only needed for a redis:// store
+    aioredis = None
+
+
+class SharedStoreError(Exception):
+    """The shared store could not be reached or failed to answer."""
+
+
+class SharedStore(ABC):
+    """Atomic, expiring counters shared by every process in the cluster.
+
+    The one primitive is `take`: add up to `amount` to the counter at `key`
+    without pushing it past `limit` (no limit when None), and report what was
+    added and the counter's new value. Counters disappear `ttl` seconds after
+    they were created, so windowed budgets clean themselves up. A take of 0
+    only reads the counter; it never creates one.
+    """
+
+    @abstractmethod
+    async def take(self, key: str, amount: float, limit: Optional[float], ttl: float) -> tuple[float, float]:
+        """Adds up to `amount` to `key` without passing `limit`; returns (added, new value)."""
+
+    @abstractmethod
+    async def close(self) -> None:
+        """Releases the store's connections."""
+
+
+_TAKE_SCRIPT = """
+local used = tonumber(redis.call('GET', KEYS[1]) or '0')
+local amount = tonumber(ARGV[1])
+local limit = tonumber(ARGV[2])
+if limit >= 0 then
+    amount = math.max(0, math.min(amount, limit - used))
+end
+if amount > 0 then
+    used = tonumber(redis.call('INCRBYFLOAT', KEYS[1], amount))
+end
+if redis.call('TTL', KEYS[1]) < 0 then
+    redis.call('EXPIRE', KEYS[1], ARGV[3])
+end
+return {tostring(amount), tostring(used)}
+"""
+
+
+class RedisStore(SharedStore):
+    """Counters in Redis (or anything speaking its protocol), updated by one Lua script per call."""
+
+    def __init__(self, url: str, timeout: float = 0.5):
+        if aioredis is None:
+            raise SharedStoreError("redis is not installed")
+        self.client = aioredis.from_url(url, socket_timeout=timeout, socket_connect_timeout=timeout)
+        self._take = self.client.register_script(_TAKE_SCRIPT)
+
+    async def take(self, key: str, amount: float, limit: Optional[float], ttl: float) -> tuple[float, float]:
+        try:
+            granted, used = await self._take(keys=[key], args=[amount, -1 if limit is None else limit, int(ttl) + 1])
+        except Exception as e:
+            raise SharedStoreError(str(e)) from e
+        return float(granted), float(used)
+
+    async def close(self) -> None:
+        await self.client.aclose()
+
+
+class SQLiteStore(SharedStore):
+    """Counters in a SQLite file; shares budgets between the processes of one host.
+
+    Meant for single-host deployments and tests. Each `take` is one
+    `BEGIN IMMEDIATE` transaction on a dedicated thread.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="shared-store")
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS counters (key TEXT PRIMARY KEY, used REAL NOT NULL, expires REAL NOT NULL)"
+            )
+            self._conn = conn
+        return self._conn
+
+    def _take(self, key: str, amount: float, limit: Optional[float], ttl: float) -> tuple[float, float]:
+        now = time.time()
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT used, expires FROM counters WHERE key = ?", (key,)).fetchone()
+            used, expires = (row[0], row[1]) if row and row[1] > now else (0.0, now + ttl)
+            if amount <= 0:
+                conn.execute("COMMIT")
+                return 0.0, used
+            if limit is not None:
+                amount = max(0.0, min(amount, limit - used))
+            used += amount
+            conn.execute(
+                "INSERT OR REPLACE INTO counters (key, used, expires) VALUES (?, ?, ?)", (key, used, expires)
+            )
+            conn.execute("DELETE FROM counters WHERE expires <= ?", (now,))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return amount, used
+
+    async def take(self, key: str, amount: float, limit: Optional[float], ttl: float) -> tuple[float, float]:
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, self._take, key, amount, limit, ttl)
+        except sqlite3.Error as e:
+            raise SharedStoreError(str(e)) from e
+
+    async def close(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+        self._executor.shutdown(wait=True)
+
+
+def create_shared_store(url: Optional[str]) -> Optional[SharedStore]:
+    """Builds a store from a `redis://`, `rediss://` or `sqlite:///path` URL; None without a URL."""
+    if not url:
+        return None
+    if url.startswith("sqlite:///"):
+        return SQLiteStore(url[len("sqlite:///"):])
+    try:
+        return RedisStore(url)
+    except SharedStoreError as e:
+        logger.warning("Shared store disabled (%s); limits are enforced per process", e)
+        return None
+
+
+_shared_store: Optional[SharedStore] = None
+
+
+def get_shared_store() -> Optional[SharedStore]:
+    """Returns the process-wide shared store, or None when none is configured."""
+    global _shared_store
+    if _shared_store is None:
+        _shared_store = create_shared_store(settings.SHARED_STORE_URL or settings.REDIS_URL)
+    return _shared_store
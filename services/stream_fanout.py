@@ -0,0 +1,169 @@
+import asyncio
+from typing import Any, AsyncIterator, Callable, Optional
+
+from prometheus_client import Counter, Gauge
+
+from services.response_cache import ResponseCache
+from utils.exceptions import SlowConsumerError
+from utils.logger import logger
+
+FANOUT_SUBSCRIBERS = Counter(
+    "stream_fanout_subscribers_total", "Streaming requests by whether they started or joined an upstream stream", ["role"]
+)
+FANOUT_STREAMS = Gauge("stream_fanout_streams", "Upstream streams currently shared through the fan-out")
+FANOUT_DROPPED = Counter("stream_fanout_dropped_total", "Subscribers dropped for falling too far behind")
+FANOUT_RESTARTS = Counter(
+    "stream_fanout_restarts_total", "Subscribers moved to their own stream after the starter's private error"
+)
+
+# Queue item marking the end of a stream
+_DONE = object()
+
+
+class _SharedStream:
+    """One upstream stream and the subscribers reading it."""
+
+    def __init__(self, key: str):
+        self.key = key
+        self.tokens: list[str] = []
+        self.subscribers: set[asyncio.Queue] = set()
+        self.task: Optional[asyncio.Task] = None
+        self.finished = False
+        self.usage: Any = None
+
+
+class StreamFanout:
+    """Shares in-flight upstream streams between identical requests.
+
+    The first request for a key starts the upstream stream in a background
+    task; requests for the same key that arrive while it runs subscribe to
+    it instead of opening their own. A subscriber first gets every token
+    produced so far, then live tokens through its own queue of at most
+    `buffer_size` tokens: one that falls further behind is dropped with
+    `SlowConsumerError` rather than holding the others back. The upstream
+    stream runs while anyone is subscribed and is cancelled when the last
+    subscriber leaves; a stream that completes is committed to the
+    response cache under its key.
+
+    The upstream stream may also yield one non-text item, its usage, which
+    is kept rather than published and handed to each joining subscriber's
+    `on_usage` when it finishes the stream, so every request is billed. An
+    error in `private_errors` (the starter's quota or deadline) fails only
+    the request that started the stream; the others carry on from where
+    they were on a stream of their own.
+    """
+
+    def __init__(
+        self,
+        cache: Optional[ResponseCache] = None,
+        buffer_size: int = 256,
+        private_errors: tuple[type[BaseException], ...] = (),
+    ):
+        self.cache = cache
+        self.buffer_size = buffer_size
+        self.private_errors = private_errors
+        self._streams: dict[str, _SharedStream] = {}
+
+    def _publish(self, shared: _SharedStream, item) -> None:
+        for queue in list(shared.subscribers):
+            if item is not _DONE and not isinstance(item, BaseException) and queue.qsize() >= self.buffer_size:
+                shared.subscribers.discard(queue)
+                FANOUT_DROPPED.inc()
+                queue.put_nowait(SlowConsumerError())
+            else:
+                queue.put_nowait(item)
+
+    def _forget(self, shared: _SharedStream) -> None:
+        if self._streams.get(shared.key) is shared:
+            del self._streams[shared.key]
+            FANOUT_STREAMS.set(len(self._streams))
+
+    async def _produce(self, shared: _SharedStream, start: Callable[[], AsyncIterator[str]]) -> None:
+        stream = start()
+        try:
+            async for text in stream:
+                if not isinstance(text, str):
+                    shared.usage = text
+                    continue
+                shared.tokens.append(text)
+                self._publish(shared, text)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            shared.finished = True
+            self._publish(shared, e)
+            return
+        finally:
+            await stream.aclose()
+            self._forget(shared)
+        shared.finished = True
+        self._publish(shared, _DONE)
+        if self.cache is not None:
+            try:
+                await self.cache.set(shared.key, "".join(shared.tokens))
+            except Exception as e:
+                logger.warning("Could not cache a completed stream: %s", e)
+
+    async def subscribe(
+        self,
+        key: str,
+        start: Callable[[], AsyncIterator[str]],
+        on_usage: Optional[Callable[[Any], None]] = None,
+    ) -> AsyncIterator[str]:
+        """Yields the stream for `key`, calling `start()` for the upstream stream only if none is in flight.
+
+        `on_usage` gets the upstream usage if this request joined a stream
+        another request started and read it to the end.
+        """
+        delivered = 0
+        while True:
+            shared = self._streams.get(key)
+            owner = shared is None
+            if owner:
+                shared = _SharedStream(key)
+                self._streams[key] = shared
+                FANOUT_STREAMS.set(len(self._streams))
+                shared.task = asyncio.create_task(self._produce(shared, start))
+                FANOUT_SUBSCRIBERS.labels("owner").inc()
+            else:
+                FANOUT_SUBSCRIBERS.labels("subscriber").inc()
+            # Snapshot and registration happen without a suspension point, so no token is missed or repeated
+            pending = list(shared.tokens)
+            queue: asyncio.Queue = asyncio.Queue()
+            shared.subscribers.add(queue)
+            # After a restart, the text already delivered is skipped on the new stream
+            skip = delivered
+            try:
+                while True:
+                    for text in pending:
+                        if skip:
+                            cut = min(skip, len(text))
+                            text, skip = text[cut:], skip - cut
+                        if text:
+                            delivered += len(text)
+                            yield text
+                    item = await queue.get()
+                    if item is _DONE:
+                        if not owner and on_usage is not None and shared.usage is not None:
+                            on_usage(shared.usage)
+                        return
+                    if isinstance(item, BaseException):
+                        if owner or not isinstance(item, self.private_errors):
+                            raise item
+                        break
+                    pending = [item]
+            finally:
+                shared.subscribers.discard(queue)
+                if not shared.subscribers and not shared.finished:
+                    # Nobody is listening any more; stop the upstream call. A request
+                    # arriving meanwhile must start a new stream, not join this one
+                    self._forget(shared)
+                    shared.task.cancel()
+            FANOUT_RESTARTS.inc()
+            logger.debug("Shared stream failed with its starter's own error; continuing on another stream")
+
+    async def close(self) -> None:
+        tasks = [shared.task for shared in self._streams.values() if shared.task is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
@@ -0,0 +1,243 @@
+import asyncio
+import datetime
+import os
+from typing import Optional
+
+from sqlalchemy import Column, Date, Integer, MetaData, String, Table, select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+
+from services.shared_store import SharedStore, SharedStoreError, get_shared_store
+from utils.config import settings
+from utils.exceptions import QuotaExceededError
+from utils.logger import logger
+
+metadata = MetaData()
+
+usage_table = Table(
+    "token_usage",
+    metadata,
+    Column("username", String(255), primary_key=True),
+    Column("model", String(255), primary_key=True),
+    Column("route", String(64), primary_key=True),
+    Column("day", Date, primary_key=True),
+    Column("requests", Integer, nullable=False, default=0),
+    Column("prompt_tokens", Integer, nullable=False, default=0),
+    Column("completion_tokens", Integer, nullable=False, default=0),
+)
+
+ANONYMOUS_USER = "anonymous"
+
+
+class UsageTracker:
+    """Aggregates token usage in memory and persists it in periodic bulk upserts.
+
+    Counters are keyed by (user, model, route, day). Each flush swaps out the
+    pending deltas and writes them in one statement, so the database sees one
+    write per key per interval instead of one per request. Quota checks read
+    the in-memory daily totals only.
+
+    With a `shared_store`, every `sync_interval` seconds each process adds its
+    new usage to per-user daily counters shared by the cluster and adopts the
+    cluster-wide totals, so quotas hold across nodes at one round trip per
+    active user per interval rather than per request. Active means the user
+    recorded usage or had their quota checked since the last sync; idle
+    users cost nothing.
+    """
+
+    def __init__(
+        self,
+        engine: Optional[AsyncEngine] = None,
+        flush_interval: float = 10.0,
+        daily_quota: int = 0,
+        quota_overrides: Optional[dict[str, int]] = None,
+        shared_store: Optional[SharedStore] = None,
+        sync_interval: float = 1.0,
+    ):
+        self.engine = engine
+        self.flush_interval = flush_interval
+        self.daily_quota = daily_quota
+        self.quota_overrides = quota_overrides or {}
+        self.shared_store = shared_store
+        self.sync_interval = sync_interval
+        self._pending: dict[tuple, list[int]] = {}
+        self._daily_totals: dict[str, int] = {}
+        self._unsynced: dict[str, int] = {}
+        self._checked: set[str] = set()
+        self._day = datetime.date.today()
+        self._flush_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self._sync_task: Optional[asyncio.Task] = None
+
+    def _roll_day(self) -> datetime.date:
+        today = datetime.date.today()
+        if today != self._day:
+            self._day = today
+            self._daily_totals.clear()
+            self._unsynced.clear()
+            self._checked.clear()
+        return today
+
+    def record(self, user: Optional[str], model: str, route: str, prompt_tokens: int, completion_tokens: int) -> None:
+        user = user or ANONYMOUS_USER
+        day = self._roll_day()
+        counters = self._pending.setdefault((user, model, route, day), [0, 0, 0])
+        counters[0] += 1
+        counters[1] += prompt_tokens
+        counters[2] += completion_tokens
+        self._daily_totals[user] = self._daily_totals.get(user, 0) + prompt_tokens + completion_tokens
+        if self.shared_store is not None:
+            self._unsynced[user] = self._unsynced.get(user, 0) + prompt_tokens + completion_tokens
+
+    def used_today(self, user: Optional[str]) -> int:
+        self._roll_day()
+        return self._daily_totals.get(user or ANONYMOUS_USER, 0)
+
+    def quota_for(self, user: Optional[str]) -> int:
+        return self.quota_overrides.get(user or ANONYMOUS_USER, self.daily_quota)
+
+    def check_quota(self, user: Optional[str]) -> None:
+        """Raises QuotaExceededError if `user` has used up today's token quota."""
+        quota = self.quota_for(user)
+        if quota and self.shared_store is not None:
+            # Refresh this user's cluster-wide total at the next sync
+            self._checked.add(user or ANONYMOUS_USER)
+        if quota and self.used_today(user) >= quota:
+            raise QuotaExceededError()
+
+    def _upsert(self):
+        dialect = self.engine.dialect.name
+        insert = postgresql.insert if dialect == "postgresql" else sqlite.insert
+        stmt = insert(usage_table)
+        return stmt.on_conflict_do_update(
+            index_elements=["username", "model", "route", "day"],
+            set_={
+                "requests": usage_table.c.requests + stmt.excluded.requests,
+                "prompt_tokens": usage_table.c.prompt_tokens + stmt.excluded.prompt_tokens,
+                "completion_tokens": usage_table.c.completion_tokens + stmt.excluded.completion_tokens,
+            },
+        )
+
+    async def flush(self) -> int:
+        """Writes pending deltas in one bulk upsert and returns the row count."""
+        async with self._flush_lock:
+            if not self._pending or self.engine is None:
+                return 0
+            pending, self._pending = self._pending, {}
+            rows = [
+                {
+                    "username": user,
+                    "model": model,
+                    "route": route,
+                    "day": day,
+                    "requests": counters[0],
+                    "prompt_tokens": counters[1],
+                    "completion_tokens": counters[2],
+                }
+                for (user, model, route, day), counters in pending.items()
+            ]
+            try:
+                async with self.engine.begin() as conn:
+                    await conn.execute(self._upsert(), rows)
+            except Exception as e:
+                logger.error("Error flushing token usage: %s", e)
+                # Put the deltas back so the next flush retries them
+                for key, counters in pending.items():
+                    merged = self._pending.setdefault(key, [0, 0, 0])
+                    for i, value in enumerate(counters):
+                        merged[i] += value
+                return 0
+            return len(rows)
+
+    async def _load_daily_totals(self) -> None:
+        day = self._roll_day()
+        total = usage_table.c.prompt_tokens + usage_table.c.completion_tokens
+        async with self.engine.connect() as conn:
+            result = await conn.execute(
+                select(usage_table.c.username, total).where(usage_table.c.day == day)
+            )
+            for user, tokens in result:
+                self._daily_totals[user] = self._daily_totals.get(user, 0) + tokens
+
+    async def sync_shared(self) -> None:
+        """Publishes usage since the last sync and adopts the cluster-wide daily totals."""
+        if self.shared_store is None:
+            return
+        day = self._roll_day()
+        unsynced, self._unsynced = self._unsynced, {}
+        checked, self._checked = self._checked, set()
+        users = list(set(unsynced) | checked)
+        for i, user in enumerate(users):
+            try:
+                _, used = await self.shared_store.take(
+                    f"usage:{user}:{day.isoformat()}", unsynced.get(user, 0), None, 2 * 86400
+                )
+            except SharedStoreError as e:
+                logger.warning("Error syncing token usage with the shared store: %s", e)
+                # Keep the unsent deltas for the next sync
+                for remaining in users[i:]:
+                    if remaining in unsynced:
+                        self._unsynced[remaining] = self._unsynced.get(remaining, 0) + unsynced[remaining]
+                    elif remaining in checked:
+                        self._checked.add(remaining)
+                return
+            self._daily_totals[user] = max(self._daily_totals.get(user, 0), int(used))
+
+    async def _sync_periodically(self) -> None:
+        while True:
+            await asyncio.sleep(self.sync_interval)
+            await self.sync_shared()
+
+    async def _flush_periodically(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    async def start(self) -> None:
+        if self.shared_store is not None and (self.daily_quota or self.quota_overrides):
+            self._sync_task = asyncio.create_task(self._sync_periodically())
+        if self.engine is None:
+            return
+        async with self.engine.begin() as conn:
+            await conn.run_sync(metadata.create_all)
+        await self._load_daily_totals()
+        self._task = asyncio.create_task(self._flush_periodically())
+
+    async def stop(self) -> None:
+        """Stops the background loops and writes whatever is still pending."""
+        for task in (self._task, self._sync_task):
+            if task is not None:
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        self._task = self._sync_task = None
+        if self.shared_store is not None and self._unsynced:
+            await self.sync_shared()
+        await self.flush()
+        if self.engine is not None:
+            await self.engine.dispose()
+
+
+_usage_tracker: Optional[UsageTracker] = None
+
+
+def get_usage_tracker() -> UsageTracker:
+    """Returns the process-wide UsageTracker; usage is persisted to usage.db in DATA_DIR unless USAGE_DATABASE_URL says otherwise."""
+    global _usage_tracker
+    if _usage_tracker is None:
+        url = settings.USAGE_DATABASE_URL
+        if url is None:
+            os.makedirs(settings.DATA_DIR, exist_ok=True)
+            url = f"sqlite+aiosqlite:///{os.path.join(settings.DATA_DIR, 'usage.db')}"
+        engine = create_async_engine(url) if url else None
+        _usage_tracker = UsageTracker(
+            engine,
+            flush_interval=settings.USAGE_FLUSH_INTERVAL,
+            daily_quota=settings.USAGE_DAILY_TOKEN_QUOTA,
+            quota_overrides=settings.USAGE_QUOTA_OVERRIDES,
+            shared_store=get_shared_store(),
+            sync_interval=settings.CLUSTER_SYNC_INTERVAL,
+        )
+    return _usage_tracker
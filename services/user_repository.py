@@ -0,0 +1,178 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from pydantic import BaseModel, Field
+from sqlalchemy import Boolean, String, select
+from sqlalchemy.ext.asyncio import AsyncEngine, async_sessionmaker, create_async_engine
+from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column
+
+from utils.config import settings
+from utils.exceptions import DatabaseError
+from utils.logger import logger
+
+
+class Base(DeclarativeBase):
+    pass
+
+
+class UserRow(Base):
+    __tablename__ = "users"
+
+    username: Mapped[str] = mapped_column(String(255), primary_key=True)
+    hashed_password: Mapped[str] = mapped_column(String(255))
+    disabled: Mapped[bool] = mapped_column(Boolean, default=False)
+
+
+class UserRecord(BaseModel):
+    """
+    Defines the user object handed to routes by `get_current_user`.
+
+    Attributes:
+        username (str): The user's unique name (the JWT `sub`).
+        hashed_password (Optional[str]): The stored password hash, if loaded from the user store.
+        disabled (bool): Whether the account is disabled.
+        claims (dict): Extra token claims when the user was built from a self-sufficient token.
+    """
+    username: str = Field(..., description="The user's unique name.")
+    hashed_password: Optional[str] = Field(None, description="The stored password hash.")
+    disabled: bool = Field(False, description="Whether the account is disabled.")
+    claims: dict = Field(default_factory=dict, description="Extra token claims.")
+
+
+def create_engine_from_settings(url: str) -> AsyncEngine:
+    """Creates an async engine whose pool is sized from `Settings`."""
+    kwargs = {"pool_pre_ping": True}
+    if ":memory:" not in url:
+        kwargs.update(
+            pool_size=settings.DB_POOL_SIZE,
+            max_overflow=settings.DB_MAX_OVERFLOW,
+            pool_timeout=settings.DB_POOL_TIMEOUT,
+            pool_recycle=settings.DB_POOL_RECYCLE,
+        )
+    return create_async_engine(url, **kwargs)
+
+
+class UserRepository:
+    """Loads users from the database through a pooled async engine."""
+
+    def __init__(self, engine: AsyncEngine):
+        self.engine = engine
+        self._sessions = async_sessionmaker(engine, expire_on_commit=False)
+
+    async def create_schema(self) -> None:
+        async with self.engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+
+    async def get_user(self, username: str) -> Optional[UserRecord]:
+        try:
+            async with self._sessions() as session:
+                row = await session.scalar(select(UserRow).where(UserRow.username == username))
+        except Exception as e:
+            logger.error("Error loading user: %s", e)
+            raise DatabaseError("Error loading user.") from e
+        if row is None:
+            return None
+        return UserRecord(username=row.username, hashed_password=row.hashed_password, disabled=row.disabled)
+
+    async def add_user(self, username: str, hashed_password: str, disabled: bool = False) -> None:
+        async with self._sessions() as session:
+            async with session.begin():
+                session.add(UserRow(username=username, hashed_password=hashed_password, disabled=disabled))
+
+    async def close(self) -> None:
+        await self.engine.dispose()
+
+
+_MISSING = object()
+
+
+class CachedUserRepository:
+    """Read-through TTL cache in front of a `UserRepository`.
+
+    Unknown users are cached too (for `negative_ttl` seconds) so a stream of
+    requests for a missing user does not reach the database, and concurrent
+    misses for the same user share a single query.
+    """
+
+    def __init__(self, repository: UserRepository, ttl: float = 60.0, negative_ttl: float = 10.0, maxsize: int = 10000):
+        self.repository = repository
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.maxsize = maxsize
+        self._entries: "OrderedDict[str, tuple[Optional[UserRecord], float]]" = OrderedDict()
+        self._inflight: dict[str, asyncio.Future] = {}
+
+    def _lookup(self, username: str):
+        entry = self._entries.get(username)
+        if entry is None:
+            return _MISSING
+        user, expires_at = entry
+        if expires_at <= time.monotonic():
+            del self._entries[username]
+            return _MISSING
+        self._entries.move_to_end(username)
+        return user
+
+    def _store(self, username: str, user: Optional[UserRecord]) -> None:
+        ttl = self.ttl if user is not None else self.negative_ttl
+        self._entries[username] = (user, time.monotonic() + ttl)
+        self._entries.move_to_end(username)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    async def get_user(self, username: str) -> Optional[UserRecord]:
+        while True:
+            cached = self._lookup(username)
+            if cached is not _MISSING:
+                return cached
+            pending = self._inflight.get(username)
+            if pending is None:
+                break
+            try:
+                return await asyncio.shield(pending)
+            except asyncio.CancelledError:
+                if not pending.cancelled():
+                    raise
+                # The caller that owned the query went away; try again ourselves
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[username] = future
+        try:
+            user = await self.repository.get_user(username)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            future.exception()  # Mark retrieved when nobody else is waiting
+            raise
+        else:
+            self._store(username, user)
+            future.set_result(user)
+            return user
+        finally:
+            self._inflight.pop(username, None)
+
+    def invalidate(self, username: Optional[str] = None) -> None:
+        if username is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(username, None)
+
+    async def close(self) -> None:
+        await self.repository.close()
+
+
+def create_user_repository() -> Optional[CachedUserRepository]:
+    """Builds the cached repository, or None when no database is configured."""
+    if not settings.DATABASE_URL:
+        return None
+    repository = UserRepository(create_engine_from_settings(settings.DATABASE_URL))
+    return CachedUserRepository(
+        repository,
+        ttl=settings.USER_CACHE_TTL,
+        negative_ttl=settings.USER_CACHE_NEGATIVE_TTL,
+        maxsize=settings.USER_CACHE_SIZE,
+    )
@@ -204,5 +204,236 @@ class TestRouters(unittest.TestCase):
             self.assertEqual(response.status_code, 500)
             self.assertEqual(response.json()["detail"], "Error generating code.")
 
+class TestWebSocketSession(unittest.TestCase):
+
+    def setUp(self):
+        import asyncio
+        from services.openai_service import get_openai_service
+
+        class FakeService:
+            def __init__(self):
+                self.prompts = []
+
+            async def stream_completion(self, route, user=None, **params):
+                self.prompts.append(params["prompt"])
+                if params["prompt"].endswith("slow"):
+                    await asyncio.sleep(10)
+                for word in ("Hello", " world"):
+                    await asyncio.sleep(0.01)
+                    yield word
+
+        self.service = FakeService()
+        app.dependency_overrides[get_openai_service] = lambda: self.service
+        self.client = TestClient(app)
+
+    def tearDown(self):
+        app.dependency_overrides.clear()
+
+    def _collect(self, ws, until):
+        frames = []
+        while len([f for f in frames if f["type"] in ("done", "error", "cancelled")]) < until:
+            frames.append(ws.receive_json())
+        return frames
+
+    def test_concurrent_requests_stream_interleaved(self):
+        with self.client.websocket_connect("/ws") as ws:
+            ws.send_json({"type": "generate", "id": "a", "prompt": "one"})
+            ws.send_json({"type": "question", "id": "b", "question": "two"})
+            frames = self._collect(ws, until=2)
+        for request_id in ("a", "b"):
+            tokens = [f["text"] for f in frames if f["id"] == request_id and f["type"] == "token"]
+            self.assertEqual("".join(tokens), "Hello world")
+        self.assertEqual({f["id"] for f in frames if f["type"] == "done"}, {"a", "b"})
+
+    def test_cancel_stops_one_request(self):
+        with self.client.websocket_connect("/ws") as ws:
+            ws.send_json({"type": "generate", "id": "slow", "prompt": "slow"})
+            ws.send_json({"type": "generate", "id": "fast", "prompt": "fast"})
+            ws.send_json({"type": "cancel", "id": "slow"})
+            frames = self._collect(ws, until=2)
+        self.assertIn({"type": "cancelled", "id": "slow"}, frames)
+        self.assertIn({"type": "done", "id": "fast"}, frames)
+
+    def test_context_prepends_previous_turns(self):
+        with self.client.websocket_connect("/ws") as ws:
+            ws.send_json({"type": "question", "id": "1", "question": "first"})
+            self._collect(ws, until=1)
+            ws.send_json({"type": "question", "id": "2", "question": "second", "context": True})
+            self._collect(ws, until=1)
+        self.assertEqual(self.service.prompts[-1], "first\nHello world\nsecond")
+
+    def test_invalid_frame_is_reported(self):
+        with self.client.websocket_connect("/ws") as ws:
+            ws.send_json({"type": "generate", "id": "x"})
+            frame = ws.receive_json()
+        self.assertEqual((frame["type"], frame["status"]), ("error", 400))
+
+    def test_bad_token_is_rejected(self):
+        from starlette.websockets import WebSocketDisconnect
+        with self.assertRaises(WebSocketDisconnect):
+            with self.client.websocket_connect("/ws?token=not-a-jwt") as ws:
+                ws.receive_json()
+
+    def test_invalid_timeout_is_reported(self):
+        with self.client.websocket_connect("/ws") as ws:
+            for timeout in (-1, 0, "nan"):
+                ws.send_json({"type": "generate", "id": str(timeout), "prompt": "one", "timeout": timeout})
+                frame = ws.receive_json()
+                self.assertEqual((frame["type"], frame["status"]), ("error", 400))
+
+    def test_requests_are_shed_by_the_route_admission_class(self):
+        from utils.admission import get_admission_controller
+        limiter = get_admission_controller().limiter_for("/generate")
+        saved = limiter.limit, limiter.max_queue
+        limiter.limit, limiter.max_queue = 0, 0
+        try:
+            with self.client.websocket_connect("/ws") as ws:
+                ws.send_json({"type": "generate", "id": "a", "prompt": "one"})
+                frame = ws.receive_json()
+        finally:
+            limiter.limit, limiter.max_queue = saved
+        self.assertEqual((frame["type"], frame["status"]), ("error", 503))
+        self.assertEqual(self.service.prompts, [])
+
+    def test_revoked_token_ends_the_session(self):
+        import asyncio
+        from starlette.websockets import WebSocketDisconnect
+        from services.auth_service import get_auth_service
+        auth_service = get_auth_service()
+        token = asyncio.run(auth_service.create_access_token({"sub": "alice"}))
+        with self.client.websocket_connect(f"/ws?token={token}") as ws:
+            ws.send_json({"type": "generate", "id": "a", "prompt": "one"})
+            self._collect(ws, until=1)
+            asyncio.run(auth_service.revoke_token(token))
+            ws.send_json({"type": "generate", "id": "b", "prompt": "two"})
+            frame = ws.receive_json()
+            self.assertEqual((frame["type"], frame["status"]), ("error", 401))
+            with self.assertRaises(WebSocketDisconnect):
+                ws.receive_json()
+        self.assertEqual(self.service.prompts, ["one"])
+
+    def test_handshakes_past_the_session_cap_are_refused(self):
+        from starlette.websockets import WebSocketDisconnect
+        with patch.object(settings, "WS_MAX_SESSIONS", 1):
+            with self.client.websocket_connect("/ws"):
+                with self.assertRaises(WebSocketDisconnect) as raised:
+                    with self.client.websocket_connect("/ws") as ws:
+                        ws.receive_json()
+        self.assertEqual(raised.exception.code, 1013)
+
+
+class TestIdempotencyKey(unittest.TestCase):
+
+    def setUp(self):
+        from services.idempotency import IdempotencyStore, get_idempotency_store
+        from services.openai_service import get_openai_service
+        self.service = MagicMock()
+        self.calls = 0
+
+        async def generate_text(**kwargs):
+            self.calls += 1
+            return f"text {self.calls}"
+
+        self.service.generate_text = generate_text
+        app.dependency_overrides[get_openai_service] = lambda: self.service
+        app.dependency_overrides[get_idempotency_store] = lambda: self.store
+        self.store = IdempotencyStore()
+        self.client = TestClient(app)
+
+    def tearDown(self):
+        app.dependency_overrides.clear()
+
+    def _post(self, prompt, key="retry-1"):
+        return self.client.post("/generate/generate/", json={"prompt": prompt}, headers={"Idempotency-Key": key})
+
+    def test_retry_is_replayed_without_a_second_call(self):
+        first, retry = self._post("Hello"), self._post("Hello  ")
+        self.assertEqual(first.json(), {"text": "text 1"})
+        self.assertEqual(retry.json(), {"text": "text 1"})
+        self.assertNotIn("idempotent-replayed", first.headers)
+        self.assertEqual(retry.headers["idempotent-replayed"], "true")
+        self.assertEqual(self.calls, 1)
+
+    def test_reused_key_with_another_body_is_rejected(self):
+        self._post("Hello")
+        self.assertEqual(self._post("Goodbye").status_code, 422)
+
+    def test_async_submit_retry_returns_the_first_job(self):
+        from services.job_service import JobRunner, JobStore, get_job_runner
+        runner = JobRunner(JobStore())
+        app.dependency_overrides[get_job_runner] = lambda: runner
+        body = {"source_language": "en", "target_language": "fr", "text": "Hello"}
+        headers = {"Idempotency-Key": "submit-1", "Prefer": "respond-async"}
+        first = self.client.post("/translate/translate/", json=body, headers=headers)
+        retry = self.client.post("/translate/translate/", json=body, headers=headers)
+        self.assertEqual(first.status_code, 202)
+        self.assertEqual(retry.status_code, 202)
+        self.assertEqual(retry.json()["job_id"], first.json()["job_id"])
+        self.assertEqual(retry.headers["idempotent-replayed"], "true")
+        self.assertEqual(len(runner.store._jobs), 1)
+
+
+class TestSharedModels(unittest.TestCase):
+
+    def setUp(self):
+        from services.openai_service import get_openai_service
+        self.service = MagicMock()
+        self.kwargs = {}
+
+        async def generate_code(**kwargs):
+            self.kwargs = kwargs
+            return "print('hi')"
+
+        self.service.generate_code = generate_code
+        app.dependency_overrides[get_openai_service] = lambda: self.service
+        self.client = TestClient(app)
+
+    def tearDown(self):
+        app.dependency_overrides.clear()
+
+    def test_route_uses_the_shared_request_and_response_models(self):
+        response = self.client.post(
+            "/code/code/", json={"language": "Python", "prompt": "hello", "top_p": 0.5, "stop": ["\n\n"]}
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers["content-type"], "application/json")
+        self.assertEqual(response.json(), {"code": "print('hi')"})
+        self.assertEqual(self.kwargs["top_p"], 0.5)
+        self.assertEqual(self.kwargs["language"], "python")
+
+    def test_invalid_body_is_rejected(self):
+        response = self.client.post("/code/code/", json={"prompt": "hello"})
+        self.assertEqual(response.status_code, 400)
+
+
+class TestHealthEndpoints(unittest.TestCase):
+
+    def setUp(self):
+        self.client = TestClient(app)
+
+    def test_healthz_reports_liveness_and_loop_lag(self):
+        response = self.client.get("/healthz")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["status"], "ok")
+        self.assertIn("event_loop_lag", response.json())
+
+    def test_readyz_fails_when_the_upstream_probe_keeps_failing(self):
+        from services.health import get_health_monitor
+        monitor = get_health_monitor()
+        app.state.cache_warmer = MagicMock(status="ready")
+        try:
+            response = self.client.get("/readyz")
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.json()["status"], "ready")
+            with patch.object(monitor, "consecutive_failures", monitor.probe_failures):
+                response = self.client.get("/readyz")
+            self.assertEqual(response.status_code, 503)
+            self.assertEqual(response.json()["status"], "unavailable")
+            self.assertFalse(response.json()["checks"]["upstream"]["ok"])
+            self.assertTrue(response.json()["checks"]["cache_warmup"]["ok"])
+        finally:
+            del app.state.cache_warmer
+
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
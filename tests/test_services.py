@@ -5,6 +5,7 @@ from services.openai_service import OpenAIService, OpenAIError
 from utils.config import settings
 from models.request import GenerateRequest, TranslateRequest, QuestionRequest, CodeRequest
 from models.response import GenerateResponse, TranslateResponse, QuestionResponse, CodeResponse
+from utils.auth import decode_access_token, hash_password
 
 class TestOpenAIService(unittest.TestCase):
 
@@ -183,5 +184,1342 @@ class TestOpenAIService(unittest.TestCase):
 
         mock_openai.models.list.assert_called_once()
 
+
+class TestAuthService(unittest.TestCase):
+
+    def setUp(self):
+        from services.auth_service import AuthService
+        self.auth_service = AuthService("test-secret")
+
+    def _token(self, **claims):
+        import asyncio
+        return asyncio.run(self.auth_service.create_access_token({"sub": "alice", **claims}))
+
+    def test_verify_token_caches_claims(self):
+        token = self._token()
+        with patch("services.auth_service.decode_access_token", wraps=decode_access_token) as decode:
+            first = self.auth_service.verify_token(token)
+            second = self.auth_service.verify_token(token)
+        self.assertEqual(first["sub"], "alice")
+        self.assertIs(first, second)
+        decode.assert_called_once()
+
+    def test_cached_entry_expires_with_token(self):
+        import time
+        token = self._token(exp=int(time.time()) + 60)
+        self.auth_service.verify_token(token)
+        with patch("utils.auth.time.time", return_value=time.time() + 120):
+            self.assertIsNone(self.auth_service.token_cache.get(token))
+
+    def test_revoked_token_is_rejected(self):
+        import asyncio
+        import jwt
+        token = self._token(jti="abc")
+        self.auth_service.verify_token(token)
+        asyncio.run(self.auth_service.revoke_token(jti="abc"))
+        with self.assertRaises(jwt.InvalidTokenError):
+            self.auth_service.verify_token(token)
+
+    def test_uncached_token_stays_revoked_until_its_own_expiry(self):
+        import asyncio
+        import time
+        import jwt
+        token = self._token(exp=int(time.time()) + 7 * 86400)
+        self.auth_service.token_cache.max_ttl = 60
+        asyncio.run(self.auth_service.revoke_token(token=token))
+        with patch("utils.auth.time.time", return_value=time.time() + 86400):
+            with self.assertRaises(jwt.InvalidTokenError):
+                self.auth_service.verify_token(token)
+        with self.assertRaises(ValueError):
+            asyncio.run(self.auth_service.revoke_token(jti="unknown"))
+
+    def test_revocation_reaches_workers_sharing_a_store(self):
+        import asyncio
+        import os
+        import tempfile
+        from fastapi import HTTPException
+        from services.auth_service import AuthService, get_current_user
+        from services.shared_store import SQLiteStore
+        path = os.path.join(tempfile.mkdtemp(), "shared.db")
+
+        async def scenario():
+            stores = [SQLiteStore(path), SQLiteStore(path)]
+            workers = [AuthService("test-secret", shared_store=store, revocation_check_interval=0) for store in stores]
+            token = await workers[0].create_access_token({"sub": "alice", "jti": "abc"})
+            self.assertEqual((await get_current_user(token, workers[1])).username, "alice")
+            await workers[0].revoke_token(token=token)
+            with self.assertRaises(HTTPException):
+                await get_current_user(token, workers[1])
+            self.assertTrue(workers[1].token_cache.is_revoked(token))
+            for store in stores:
+                await store.close()
+
+        asyncio.run(scenario())
+
+    def test_token_cache_is_bounded(self):
+        from utils.auth import TokenCache
+        cache = TokenCache(maxsize=2)
+        for token in ("a", "b", "c"):
+            cache.put(token, {"sub": token})
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(cache.get("c"), {"sub": "c"})
+
+    def test_asymmetric_keys_verify_with_public_key_only(self):
+        from cryptography.hazmat.primitives import serialization
+        from cryptography.hazmat.primitives.asymmetric import ed25519
+        from utils.auth import SigningKeys, create_access_token, decode_access_token
+
+        private = ed25519.Ed25519PrivateKey.generate()
+        private_pem = private.private_bytes(
+            serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()
+        ).decode()
+        public_pem = private.public_key().public_bytes(
+            serialization.Encoding.PEM, serialization.PublicFormat.SubjectPublicKeyInfo
+        ).decode()
+        issuer = SigningKeys("EdDSA", private_key=private_pem)
+        verifier = SigningKeys("EdDSA", public_key=public_pem)
+        token = create_access_token({"sub": "alice"}, issuer.signing_key, "EdDSA")
+        self.assertIsNone(verifier.signing_key)
+        self.assertEqual(decode_access_token(token, verifier)["sub"], "alice")
+
+
+class TestUserRepository(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        from services.user_repository import CachedUserRepository, UserRepository, create_engine_from_settings
+        self.repository = UserRepository(create_engine_from_settings("sqlite+aiosqlite:///:memory:"))
+        await self.repository.create_schema()
+        await self.repository.add_user("alice", hash_password("secret", iterations=1000))
+        self.cached = CachedUserRepository(self.repository, ttl=60, negative_ttl=60)
+
+    async def asyncTearDown(self):
+        await self.cached.close()
+
+    async def test_read_through_cache_hits_database_once(self):
+        with patch.object(self.repository, "get_user", wraps=self.repository.get_user) as get_user:
+            first = await self.cached.get_user("alice")
+            second = await self.cached.get_user("alice")
+        self.assertEqual(first.username, "alice")
+        self.assertIs(first, second)
+        get_user.assert_called_once()
+
+    async def test_unknown_users_are_negatively_cached(self):
+        with patch.object(self.repository, "get_user", wraps=self.repository.get_user) as get_user:
+            self.assertIsNone(await self.cached.get_user("mallory"))
+            self.assertIsNone(await self.cached.get_user("mallory"))
+        get_user.assert_called_once()
+
+    async def test_concurrent_misses_share_one_query(self):
+        import asyncio
+        with patch.object(self.repository, "get_user", wraps=self.repository.get_user) as get_user:
+            users = await asyncio.gather(*(self.cached.get_user("alice") for _ in range(5)))
+        self.assertTrue(all(user.username == "alice" for user in users))
+        get_user.assert_called_once()
+
+    async def test_cancelled_lookup_does_not_strand_waiters(self):
+        import asyncio
+        release = asyncio.Event()
+        real_get_user = self.repository.get_user
+
+        async def slow_get_user(username):
+            await release.wait()
+            return await real_get_user(username)
+
+        with patch.object(self.repository, "get_user", side_effect=slow_get_user):
+            owner = asyncio.create_task(self.cached.get_user("alice"))
+            await asyncio.sleep(0)
+            waiter = asyncio.create_task(self.cached.get_user("alice"))
+            await asyncio.sleep(0)
+            owner.cancel()
+            await asyncio.sleep(0)
+            release.set()
+            user = await asyncio.wait_for(waiter, 1)
+        self.assertEqual(user.username, "alice")
+        self.assertEqual(self.cached._inflight, {})
+
+    async def test_authenticate_user_verifies_password_off_loop(self):
+        from services.auth_service import AuthService
+        auth_service = AuthService("test-secret", user_repository=self.cached)
+        self.assertTrue(await auth_service.authenticate_user("alice", "secret"))
+        self.assertFalse(await auth_service.authenticate_user("alice", "wrong"))
+        self.assertFalse(await auth_service.authenticate_user("mallory", "secret"))
+
+
+class TestUsageTracker(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        from sqlalchemy.ext.asyncio import create_async_engine
+        from services.usage_service import UsageTracker
+        self.tracker = UsageTracker(create_async_engine("sqlite+aiosqlite:///:memory:"), flush_interval=3600)
+        await self.tracker.start()
+
+    async def asyncTearDown(self):
+        await self.tracker.stop()
+
+    async def _rows(self):
+        from sqlalchemy import select
+        from services.usage_service import usage_table
+        async with self.tracker.engine.connect() as conn:
+            result = await conn.execute(select(usage_table))
+            return [dict(row._mapping) for row in result]
+
+    async def test_flush_aggregates_per_key_and_upserts(self):
+        for _ in range(3):
+            self.tracker.record("alice", "gpt-4o-mini", "generate", 10, 5)
+        self.tracker.record("bob", "gpt-4o-mini", "code", 1, 1)
+        self.assertEqual(await self.tracker.flush(), 2)
+        self.tracker.record("alice", "gpt-4o-mini", "generate", 10, 5)
+        self.assertEqual(await self.tracker.flush(), 1)
+
+        rows = {row["username"]: row for row in await self._rows()}
+        self.assertEqual(rows["alice"]["requests"], 4)
+        self.assertEqual(rows["alice"]["prompt_tokens"], 40)
+        self.assertEqual(rows["alice"]["completion_tokens"], 20)
+        self.assertEqual(rows["bob"]["requests"], 1)
+
+    async def test_quota_is_checked_against_memory(self):
+        from utils.exceptions import QuotaExceededError
+        self.tracker.daily_quota = 20
+        self.tracker.record("alice", "gpt-4o-mini", "generate", 10, 5)
+        self.tracker.check_quota("alice")
+        self.tracker.record("alice", "gpt-4o-mini", "generate", 10, 5)
+        with self.assertRaises(QuotaExceededError):
+            self.tracker.check_quota("alice")
+        self.tracker.check_quota("bob")
+
+    async def test_failed_flush_keeps_pending_usage(self):
+        self.tracker.record("alice", "gpt-4o-mini", "generate", 10, 5)
+        with patch.object(self.tracker, "_upsert", side_effect=Exception("database down")):
+            self.assertEqual(await self.tracker.flush(), 0)
+        self.assertEqual(await self.tracker.flush(), 1)
+
+
+class TestFairScheduler(unittest.IsolatedAsyncioTestCase):
+
+    async def test_light_tenant_is_served_ahead_of_heavy_backlog(self):
+        import asyncio
+        from services.scheduler import FairScheduler
+
+        scheduler = FairScheduler(capacity=1)
+        await scheduler.acquire("heavy", cost=100)
+        order = []
+
+        async def call(tenant):
+            async with scheduler.slot(tenant, cost=100):
+                order.append(tenant)
+
+        heavy = [asyncio.create_task(call("heavy")) for _ in range(5)]
+        await asyncio.sleep(0)
+        light = asyncio.create_task(call("light"))
+        await asyncio.sleep(0)
+        scheduler.release("heavy")
+        await asyncio.gather(*heavy, light)
+        self.assertLessEqual(order.index("light"), 1)
+        self.assertEqual(scheduler.in_flight, 0)
+
+    async def test_weights_split_capacity_proportionally(self):
+        import asyncio
+        from services.scheduler import FairScheduler
+
+        scheduler = FairScheduler(capacity=1, weights={"gold": 3.0})
+        await scheduler.acquire("gold")
+        order = []
+
+        async def call(tenant):
+            async with scheduler.slot(tenant):
+                order.append(tenant)
+
+        tasks = [asyncio.create_task(call(t)) for t in ["gold"] * 6 + ["bronze"] * 6]
+        await asyncio.sleep(0)
+        scheduler.release("gold")
+        await asyncio.gather(*tasks)
+        self.assertEqual(order[:8].count("gold"), 6)
+
+    async def test_cancelled_waiter_does_not_leak_capacity(self):
+        import asyncio
+        from services.scheduler import FairScheduler
+
+        scheduler = FairScheduler(capacity=1)
+        await scheduler.acquire("a")
+        waiter = asyncio.create_task(scheduler.acquire("b"))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await waiter
+        scheduler.release("a")
+        self.assertEqual(scheduler.in_flight, 0)
+        await asyncio.wait_for(scheduler.acquire("c"), 1)
+
+    async def test_unlisted_tenants_share_one_metric_series(self):
+        from prometheus_client import REGISTRY
+        from services.scheduler import FairScheduler
+
+        scheduler = FairScheduler(capacity=10, weights={"gold": 2.0})
+        before = REGISTRY.get_sample_value("upstream_tenant_in_flight", {"tenant": "other"}) or 0
+        for tenant in ("user-1", "user-2", "gold"):
+            await scheduler.acquire(tenant)
+        self.assertEqual(REGISTRY.get_sample_value("upstream_tenant_in_flight", {"tenant": "other"}), before + 2)
+        self.assertEqual(REGISTRY.get_sample_value("upstream_tenant_in_flight", {"tenant": "gold"}), 1)
+        self.assertIsNone(REGISTRY.get_sample_value("upstream_tenant_in_flight", {"tenant": "user-1"}))
+        for tenant in ("user-1", "user-2", "gold"):
+            scheduler.release(tenant)
+        self.assertEqual(REGISTRY.get_sample_value("upstream_tenant_in_flight", {"tenant": "other"}), before)
+
+class TestAdaptiveLimiter(unittest.TestCase):
+
+    def _feed(self, limiter, rtt, windows=1):
+        for _ in range(windows):
+            for _ in range(int(limiter.limit) + 1):
+                limiter.on_sample(rtt, in_flight=int(limiter.limit))
+
+    def test_limit_grows_while_latency_stays_at_baseline(self):
+        from services.adaptive_limiter import AdaptiveLimiter
+        limiter = AdaptiveLimiter("test-model", initial_limit=10)
+        self._feed(limiter, 0.1, windows=5)
+        self.assertGreater(limiter.limit, 10)
+        self.assertEqual(limiter.last_reason, "increase")
+
+    def test_limit_shrinks_on_latency_inflation(self):
+        from services.adaptive_limiter import AdaptiveLimiter
+        limiter = AdaptiveLimiter("test-model", initial_limit=50)
+        limiter.on_sample(0.1, in_flight=1)
+        self._feed(limiter, 0.5, windows=3)
+        self.assertLess(limiter.limit, 50)
+        self.assertEqual(limiter.last_reason, "latency_inflation")
+
+    def test_rate_limit_halves_limit(self):
+        import asyncio
+        from services.adaptive_limiter import AdaptiveLimiter
+
+        class RateLimited(Exception):
+            pass
+
+        limiter = AdaptiveLimiter("test-model", initial_limit=40, rate_limit_errors=(RateLimited,))
+
+        async def call():
+            async with limiter.slot():
+                raise RateLimited()
+
+        with self.assertRaises(RateLimited):
+            asyncio.run(call())
+        self.assertEqual(limiter.limit, 20)
+        self.assertEqual(limiter.in_flight, 0)
+        self.assertEqual(limiter.snapshot()["last_reason"], "rate_limited")
+
+
+class TestOpenAIServiceDeadlines(unittest.IsolatedAsyncioTestCase):
+
+    async def test_deadline_bounds_upstream_call(self):
+        import asyncio
+        from unittest.mock import AsyncMock
+        from utils.exceptions import DeadlineExceededError
+
+        async def slow_create(**kwargs):
+            await asyncio.sleep(10)
+
+        openai_service = OpenAIService(api_key="test-key")
+        client = openai_service.key_pool.keys[0].client
+        client.completions.create = AsyncMock(side_effect=slow_create)
+        with self.assertRaises(DeadlineExceededError):
+            await openai_service.generate_text(prompt="Test prompt", timeout=0.01)
+        self.assertEqual(client.completions.create.call_args.kwargs["timeout"], 0.01)
+
+    async def test_cluster_budget_is_awaited_before_taking_upstream_slots(self):
+        from unittest.mock import AsyncMock
+        openai_service = OpenAIService(api_key="test-key")
+        held = []
+
+        async def acquire(backend, cost):
+            held.append(openai_service.scheduler.in_flight)
+
+        openai_service.cluster_limits.acquire = AsyncMock(side_effect=acquire)
+        client = openai_service.key_pool.keys[0].client
+        client.completions.create = AsyncMock(return_value=MagicMock(choices=[MagicMock(text="Hi")], usage=None))
+        await openai_service.generate_text(prompt="Test prompt")
+        self.assertEqual(held, [0])
+
+    async def test_deadline_is_passed_to_streamed_calls(self):
+        from unittest.mock import AsyncMock
+
+        async def chunks():
+            yield MagicMock(usage=None, choices=[MagicMock(text="Hi")])
+
+        openai_service = OpenAIService(api_key="test-key")
+        client = openai_service.key_pool.keys[0].client
+        client.completions.create = AsyncMock(return_value=chunks())
+        stream = openai_service.stream_completion(
+            "generate", timeout=2.5, model="gpt-3.5-turbo-instruct", prompt="Hi", temperature=1.0, max_tokens=5, top_p=1.0
+        )
+        self.assertEqual([text async for text in stream], ["Hi"])
+        self.assertEqual(client.completions.create.call_args.kwargs["timeout"], 2.5)
+
+    async def test_joined_streams_check_quota_and_bill_each_user(self):
+        import asyncio
+        from unittest.mock import AsyncMock
+        from services.response_cache import ResponseCache
+        from utils.exceptions import QuotaExceededError
+        gate = asyncio.Event()
+
+        async def chunks():
+            yield MagicMock(usage=None, choices=[MagicMock(text="Hi")])
+            await gate.wait()
+            yield MagicMock(usage=MagicMock(prompt_tokens=3, completion_tokens=1), choices=[])
+
+        def check_quota(user):
+            if user == "broke":
+                raise QuotaExceededError()
+
+        tracker = MagicMock()
+        tracker.check_quota.side_effect = check_quota
+        openai_service = OpenAIService(api_key="test-key", usage_tracker=tracker, cache=ResponseCache(None))
+        client = openai_service.key_pool.keys[0].client
+        client.completions.create = AsyncMock(return_value=chunks())
+        params = {"model": "gpt-3.5-turbo-instruct", "prompt": "Hi", "temperature": 0.0, "max_tokens": 5, "top_p": 1.0}
+
+        async def collect(user):
+            return [text async for text in openai_service.stream_completion("generate", user=user, **params)]
+
+        owner = asyncio.create_task(collect("alice"))
+        await asyncio.sleep(0.01)
+        with self.assertRaises(QuotaExceededError):
+            await collect("broke")
+        joiner = asyncio.create_task(collect("bob"))
+        await asyncio.sleep(0.01)
+        gate.set()
+        self.assertEqual(await asyncio.gather(owner, joiner), [["Hi"], ["Hi"]])
+        self.assertEqual(client.completions.create.call_count, 1)
+        billed = sorted((call.args[0], call.args[3], call.args[4]) for call in tracker.record.call_args_list)
+        self.assertEqual(billed, [("alice", 3, 1), ("bob", 3, 1)])
+
+class TestKeyPool(unittest.TestCase):
+
+    def _pool(self, n=3, **kwargs):
+        from services.key_pool import ApiKey, KeyPool
+        return KeyPool([ApiKey(f"sk-test-{i:04d}", rpm=60, tpm=6000) for i in range(n)], **kwargs)
+
+    def _rate_limit_error(self):
+        import httpx
+        from openai import RateLimitError
+        response = httpx.Response(429, request=httpx.Request("POST", "https://api.openai.com/v1/completions"))
+        return RateLimitError("rate limited", response=response, body=None)
+
+    def test_requests_spread_across_keys_by_headroom(self):
+        pool = self._pool()
+        used = [pool.acquire(100) for _ in range(30)]
+        counts = {key.label: used.count(key) for key in pool.keys}
+        self.assertEqual(sorted(counts.values()), [10, 10, 10])
+
+    def test_key_leaves_rotation_after_repeated_rate_limits(self):
+        pool = self._pool(n=2, failure_threshold=2, cooldown=30)
+        bad = pool.keys[0]
+        for _ in range(2):
+            pool.release(bad, 0, error=self._rate_limit_error())
+        self.assertFalse(bad.available(__import__("time").monotonic()))
+        self.assertTrue(all(pool.acquire(10) is pool.keys[1] for _ in range(5)))
+
+    def test_actual_usage_reconciles_token_budget(self):
+        import time
+        pool = self._pool(n=1)
+        key = pool.acquire(1000)
+        pool.release(key, 1000, actual_tokens=100)
+        self.assertAlmostEqual(key.tokens.level(time.monotonic()), 5900, delta=5)
+
+
+class TestBackendRouter(unittest.TestCase):
+
+    def _backend(self, name, models=None, capacity=64, **kwargs):
+        from services.backends import Backend
+        from services.key_pool import ApiKey, KeyPool
+        return Backend(name, KeyPool([ApiKey(f"sk-{name}-0000", base_url="http://localhost:8000/v1")]), models=models, capacity=capacity, **kwargs)
+
+    def _connection_error(self):
+        import httpx
+        from openai import APIConnectionError
+        return APIConnectionError(request=httpx.Request("POST", "http://localhost:8000/v1/completions"))
+
+    def test_only_backends_serving_the_model_are_eligible(self):
+        from services.backends import BackendRouter
+        from utils.exceptions import NotFoundError
+        openai_backend, local = self._backend("openai"), self._backend("local", models=["llama-3-8b"])
+        router = BackendRouter([openai_backend, local])
+        self.assertTrue(all(router.select("gpt-4") is openai_backend for _ in range(20)))
+        with self.assertRaises(NotFoundError):
+            BackendRouter([local]).select("gpt-4")
+
+    def test_local_only_model_never_goes_to_the_catch_all_backend(self):
+        from services.backends import BackendRouter
+        openai_backend, local = self._backend("openai"), self._backend("local", models=["llama-3-8b"])
+        local.ewma_latency, local.in_flight = 5.0, 10
+        router = BackendRouter([openai_backend, local])
+        self.assertTrue(all(router.select("llama-3-8b") is local for _ in range(50)))
+
+    def test_faster_less_loaded_backend_wins(self):
+        from services.backends import BackendRouter
+        fast, slow = self._backend("fast"), self._backend("slow")
+        fast.ewma_latency, slow.ewma_latency = 0.1, 1.0
+        router = BackendRouter([fast, slow])
+        self.assertTrue(all(router.select("m") is fast for _ in range(20)))
+        fast.in_flight = 20
+        self.assertIs(router.select("m"), slow)
+
+    def test_reserved_calls_count_as_load(self):
+        from services.backends import BackendRouter
+        fast, slow = self._backend("fast"), self._backend("slow")
+        fast.ewma_latency, slow.ewma_latency = 0.1, 0.5
+        router = BackendRouter([fast, slow])
+        # Calls selected together, before any starts, must not all land on the idle backend
+        picks = [router.reserve("m") for _ in range(10)]
+        self.assertEqual(picks.count(slow), 1)
+        for backend in picks:
+            backend.unreserve()
+        self.assertEqual((fast.queued, slow.queued), (0, 0))
+
+    def test_unmeasured_backend_is_scored_with_the_prior(self):
+        from services.backends import BackendRouter
+        measured, fresh = self._backend("measured"), self._backend("fresh")
+        measured.ewma_latency = 0.2
+        router = BackendRouter([measured, fresh])
+        self.assertTrue(all(router.select("m", prior_latency=1.0) is measured for _ in range(20)))
+        self.assertTrue(all(router.select("m", prior_latency=0.1) is fresh for _ in range(20)))
+
+    def test_full_backend_is_skipped(self):
+        from services.backends import BackendRouter
+        full, spare = self._backend("full", capacity=2), self._backend("spare")
+        full.in_flight, spare.ewma_latency = 2, 5.0
+        self.assertIs(BackendRouter([full, spare]).select("m"), spare)
+
+    def test_backend_leaves_selection_after_repeated_errors(self):
+        from services.backends import BackendRouter
+        flaky, stable = self._backend("flaky", failure_threshold=2), self._backend("stable")
+        stable.ewma_latency = 1.0
+        router = BackendRouter([flaky, stable])
+        for _ in range(2):
+            key = flaky.acquire(10)
+            flaky.release(key, 10, 0.01, error=self._connection_error())
+        self.assertEqual(flaky.in_flight, 0)
+        self.assertTrue(all(router.select("m") is stable for _ in range(20)))
+
+    def test_successful_calls_update_latency_estimate(self):
+        backend = self._backend("b", alpha=0.5)
+        for latency in (1.0, 3.0):
+            backend.release(backend.acquire(10), 10, latency)
+        self.assertAlmostEqual(backend.ewma_latency, 2.0)
+
+
+class TestModelRegistry(unittest.TestCase):
+
+    def setUp(self):
+        from services.model_registry import ModelRegistry, load_profiles
+        self.registry = ModelRegistry(load_profiles())
+
+    def test_explicit_model_passes_through(self):
+        self.assertEqual(self.registry.resolve("my-local-llama", "text", 10, 100), "my-local-llama")
+
+    def test_auto_picks_cheapest_capable_model(self):
+        self.assertEqual(self.registry.resolve("auto", "text", 10, 100), "babbage-002")
+        self.assertEqual(self.registry.resolve("auto", "code", 10, 100), "gpt-3.5-turbo-instruct")
+
+    def test_auto_never_picks_chat_only_models(self):
+        self.assertEqual(self.registry.resolve("auto", "translation", 10, 100), "gpt-3.5-turbo-instruct")
+
+    def test_auto_respects_context_window(self):
+        self.assertEqual(self.registry.resolve("auto", "code", 4000, 1000), "code-davinci-002")
+        from utils.exceptions import ValidationError
+        with self.assertRaises(ValidationError):
+            self.registry.resolve("auto", "code", 100000, 1000)
+
+    def test_fastest_strategy(self):
+        from services.model_registry import ModelProfile, ModelRegistry
+        registry = ModelRegistry([
+            ModelProfile(name="cheap", context_window=4096, input_price=0.001, typical_latency=2.0, capabilities=["text"]),
+            ModelProfile(name="quick", context_window=4096, input_price=0.01, typical_latency=0.2, capabilities=["text"]),
+        ])
+        self.assertEqual(registry.resolve("auto", "text", 10, 10), "cheap")
+        self.assertEqual(registry.resolve("auto:fastest", "text", 10, 10), "quick")
+
+    def test_overrides_replace_builtin_profiles(self):
+        from services.model_registry import load_profiles
+        profiles = {p.name: p for p in load_profiles(overrides=[{"name": "babbage-002", "context_window": 2048}])}
+        self.assertEqual(profiles["babbage-002"].context_window, 2048)
+        self.assertIn("gpt-3.5-turbo-instruct", profiles)
+
+
+class TestResponseCache(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        import os
+        import tempfile
+        from services.response_cache import DiskCache, ResponseCache
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "responses.db")
+        self.cache = ResponseCache(DiskCache(self.path), memory_size=2)
+
+    async def asyncTearDown(self):
+        await self.cache.close()
+        self.tmp.cleanup()
+
+    async def test_entries_are_shared_through_disk(self):
+        from services.response_cache import DiskCache, ResponseCache
+        from utils.canonical import canonicalize
+        key = canonicalize("question", {"question": "What is the capital of France?"}).digest
+        await self.cache.set(key, "Paris")
+        other_worker = ResponseCache(DiskCache(self.path))
+        try:
+            self.assertEqual(await other_worker.get(key), "Paris")
+        finally:
+            await other_worker.close()
+
+    async def test_expired_entries_are_not_served(self):
+        await self.cache.set("k", "v", ttl=0.01)
+        self.cache._memory.clear()
+        await __import__("asyncio").sleep(0.02)
+        self.assertIsNone(await self.cache.get("k"))
+
+    async def test_size_bound_evicts_least_recently_used(self):
+        from services.response_cache import DiskCache
+        disk = DiskCache(self.path, max_bytes=1)
+        try:
+            for i in range(10):
+                await disk.set(f"k{i}", "x" * 100)
+            await disk.evict()
+            self.assertEqual(len(await disk.recent_entries(100)), 9)
+            self.assertIsNone(await disk.get("k0"))
+        finally:
+            await disk.close()
+
+    async def test_concurrent_misses_share_one_computation(self):
+        import asyncio
+        calls = 0
+
+        async def compute():
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.01)
+            return "answer"
+
+        results = await asyncio.gather(*(self.cache.get_or_compute("k", compute) for _ in range(5)))
+        self.assertEqual(results, ["answer"] * 5)
+        self.assertEqual(calls, 1)
+
+
+class TestCompactMemoryCache(unittest.TestCase):
+
+    def setUp(self):
+        from services.response_cache import PayloadCodec, ResponseCache
+        self.cache = ResponseCache(None, memory_size=1000, codec=PayloadCodec(threshold=64))
+
+    def test_large_payloads_are_compressed_and_round_trip(self):
+        from utils.canonical import canonicalize
+        key = canonicalize("code", {"prompt": "fizzbuzz"}).digest
+        code = "def fizzbuzz(n):\n    return 'fizz' if n % 3 == 0 else str(n)\n" * 20
+        self.cache.put_memory(key, code)
+        self.cache.put_memory("small", "Paris")
+        self.cache.put_memory("json", {"answer": ["a"] * 100})
+        self.assertEqual(self.cache.get_memory(key), code)
+        self.assertEqual(self.cache.get_memory("small"), "Paris")
+        self.assertEqual(self.cache.get_memory("json"), {"answer": ["a"] * 100})
+        self.assertLess(self.cache.memory_bytes, len(code))
+
+    def test_memory_accounting_is_exact(self):
+        import sys
+        for i in range(50):
+            self.cache.put_memory(f"k{i}", f"answer {i} " * i)
+        self.cache.put_memory("k3", "replaced")
+        expected = sys.getsizeof(self.cache._memory) + sum(
+            sys.getsizeof(key) + sys.getsizeof(entry) + sys.getsizeof(entry.expires) + sys.getsizeof(entry.payload)
+            for key, entry in self.cache._memory.items()
+        )
+        self.assertEqual(self.cache.memory_bytes, expected)
+
+    def test_byte_budget_evicts_least_recently_used(self):
+        self.cache.memory_budget = 4000
+        for i in range(100):
+            self.cache.put_memory(f"k{i}", f"value {i}")
+        self.assertLessEqual(self.cache.memory_bytes, 4000)
+        self.assertIsNone(self.cache.get_memory("k0"))
+        self.assertEqual(self.cache.get_memory("k99"), "value 99")
+
+    def test_trained_dictionary_is_used_when_available(self):
+        from services.response_cache import PayloadCodec, zstandard
+        if zstandard is None:
+            self.skipTest("zstandard is not installed")
+        codec = PayloadCodec(threshold=64)
+        samples = [f"def handler_{i}(request):\n    return JSONResponse({{'id': {i}}})\n".encode() * 3 for i in range(200)]
+        self.assertTrue(codec.train(samples))
+        value = samples[7].decode()
+        flags, payload = codec.encode(value)
+        self.assertEqual(codec.decode(flags, payload), value)
+        self.assertLess(len(payload), len(PayloadCodec(threshold=64).encode(value)[1]))
+
+
+class TestCacheWarmer(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        import os
+        import tempfile
+        from services.response_cache import DiskCache, ResponseCache
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cache = ResponseCache(DiskCache(os.path.join(self.tmp.name, "responses.db")))
+        self.traffic = os.path.join(self.tmp.name, "traffic.jsonl")
+        with open(self.traffic, "w") as f:
+            for question, count in (("popular", 5), ("rare", 1), ("common", 3)):
+                f.writelines('{"route": "question", "question": "%s"}\n' % question for _ in range(count))
+            f.write('{"route": "generate", "prompt": "ignored"}\nnot json\n')
+
+    async def asyncTearDown(self):
+        await self.cache.close()
+        self.tmp.cleanup()
+
+    def _service(self, delay=0.0):
+        import asyncio
+        service = MagicMock()
+        service.active = service.peak = 0
+
+        async def answer_question(model, question):
+            service.active += 1
+            service.peak = max(service.peak, service.active)
+            await asyncio.sleep(delay)
+            service.active -= 1
+            await self.cache.set(question, "answer")
+
+        service.answer_question = MagicMock(side_effect=answer_question)
+        return service
+
+    async def test_top_questions_are_precomputed_with_bounded_concurrency(self):
+        from services.cache_warmup import READY, CacheWarmer
+        service = self._service(delay=0.01)
+        warmer = CacheWarmer(self.cache, service, traffic_file=self.traffic, top_n=2, concurrency=1)
+        await warmer.start()
+        self.assertEqual(warmer.status, READY)
+        asked = [call.kwargs["question"] for call in service.answer_question.call_args_list]
+        self.assertEqual(asked, ["popular", "common"])
+        self.assertEqual(service.peak, 1)
+
+    async def test_persistent_entries_are_loaded_into_memory(self):
+        from services.cache_warmup import CacheWarmer
+        await self.cache.set("k", "v")
+        self.cache._memory.clear()
+        warmer = CacheWarmer(self.cache)
+        await warmer.run()
+        self.assertEqual(warmer.loaded, 1)
+        self.assertEqual(self.cache.get_memory("k"), "v")
+
+    async def test_budget_bounds_warm_up(self):
+        from services.cache_warmup import READY, WARMING, CacheWarmer
+        warmer = CacheWarmer(self.cache, self._service(delay=10), traffic_file=self.traffic, budget=0.05)
+        task = warmer.start()
+        self.assertEqual(warmer.status, WARMING)
+        await task
+        self.assertEqual(warmer.status, READY)
+
+    def test_only_unredacted_captures_are_used_and_truncation_is_tolerated(self):
+        import gzip
+        import os
+        from services.cache_warmup import top_questions
+        from utils.capture import CaptureWriter, capture_files, mask_record
+        for name, redact in (("masked", mask_record), ("plain", None)):
+            directory = os.path.join(self.tmp.name, name)
+            writer = CaptureWriter(directory, redact=redact)
+            writer.start()
+            for _ in range(2):
+                writer.write({"route": "question", "body": {"question": "What is DNS?", "model": "auto"}})
+            writer.stop()
+        masked, = capture_files(os.path.join(self.tmp.name, "masked"))
+        self.assertEqual(top_questions(masked, 10), [])
+        plain, = capture_files(os.path.join(self.tmp.name, "plain"))
+        with gzip.open(plain, "rb") as f:
+            data = f.read()
+        # A file still being written: one complete record, then a cut-off gzip stream
+        compressed = gzip.compress(data)
+        with open(plain, "wb") as f:
+            f.write(compressed[: len(compressed) - 12])
+        self.assertEqual(top_questions(plain, 10), [("auto", "What is DNS?")])
+
+
+class TestClusterLimits(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        import os
+        import tempfile
+        from services.shared_store import SQLiteStore
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "shared.db")
+        # Two stores on one file stand in for two worker processes
+        self.stores = [SQLiteStore(self.path), SQLiteStore(self.path)]
+
+    async def asyncTearDown(self):
+        for store in self.stores:
+            await store.close()
+        self.tmp.cleanup()
+
+    async def test_processes_share_one_budget_through_leases(self):
+        from services.cluster_limits import LeasedBudget
+        budgets = [LeasedBudget(store, "openai:rpm", capacity=100, lease=10) for store in self.stores]
+        for store in self.stores:
+            store.take = MagicMock(side_effect=store.take)
+        granted = 0
+        for _ in range(80):
+            for budget in budgets:
+                granted += await budget.try_acquire(1)
+        self.assertEqual(granted, 100)
+        round_trips = sum(store.take.call_count for store in self.stores)
+        self.assertLess(round_trips, 20)
+
+    async def test_falls_back_to_local_share_when_store_is_down(self):
+        from unittest.mock import AsyncMock
+        from services.cluster_limits import LeasedBudget
+        from services.shared_store import SharedStoreError
+        store = self.stores[0]
+        store.take = AsyncMock(side_effect=SharedStoreError("connection refused"))
+        budget = LeasedBudget(store, "openai:tpm", capacity=1000, fallback_share=0.25)
+        results = [await budget.try_acquire(100) for _ in range(4)]
+        self.assertEqual(results, [True, True, False, False])
+        self.assertEqual(store.take.call_count, 1)
+
+    async def test_daily_quota_is_enforced_across_processes(self):
+        from services.usage_service import UsageTracker
+        from utils.exceptions import QuotaExceededError
+        first, second = (UsageTracker(daily_quota=100, shared_store=store) for store in self.stores)
+        first.record("alice", "gpt-3.5-turbo-instruct", "generate", 50, 30)
+        second.record("alice", "gpt-3.5-turbo-instruct", "generate", 20, 10)
+        first.check_quota("alice")
+        second.check_quota("alice")
+        await first.sync_shared()
+        await second.sync_shared()
+        with self.assertRaises(QuotaExceededError):
+            second.check_quota("alice")
+        # A new request for alice on the first process makes it refresh her total
+        first.check_quota("alice")
+        await first.sync_shared()
+        self.assertEqual(first.used_today("alice"), 110)
+
+    async def test_sync_only_contacts_the_store_for_active_users(self):
+        from services.usage_service import UsageTracker
+        tracker = UsageTracker(daily_quota=100, shared_store=self.stores[0])
+        for user in ("alice", "bob", "carol"):
+            tracker.record(user, "gpt-3.5-turbo-instruct", "generate", 5, 5)
+        await tracker.sync_shared()
+        self.stores[0].take = MagicMock(side_effect=self.stores[0].take)
+        await tracker.sync_shared()
+        self.stores[0].take.assert_not_called()
+        tracker.record("bob", "gpt-3.5-turbo-instruct", "generate", 1, 1)
+        await tracker.sync_shared()
+        self.assertEqual([c.args[0].split(":")[1] for c in self.stores[0].take.call_args_list], ["bob"])
+
+
+class TestJobRunner(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        import httpx
+        from services.job_service import JobRunner, JobStore
+        self.deliveries = []
+        self.webhook_status = [200]
+
+        def webhook(request):
+            self.deliveries.append(request)
+            return httpx.Response(self.webhook_status.pop(0) if len(self.webhook_status) > 1 else self.webhook_status[0])
+
+        client = httpx.AsyncClient(transport=httpx.MockTransport(webhook))
+        self.runner = JobRunner(JobStore(maxsize=3), workers=1, queue_size=2, webhook_backoff=0.001,
+                                webhook_secret="s3cret", callback_hosts=["example.com"], http_client=client)
+        self.runner.start()
+
+    async def asyncTearDown(self):
+        await self.runner.stop()
+
+    async def test_long_poll_returns_result(self):
+        import asyncio
+
+        async def call(timeout):
+            await asyncio.sleep(0.01)
+            return {"answer": "Paris"}
+
+        job = await self.runner.submit("question", call, owner="alice")
+        self.assertEqual(job.status, "pending")
+        finished = await self.runner.store.wait(job.id, timeout=1)
+        self.assertEqual(finished.status, "succeeded")
+        self.assertEqual(finished.result, {"answer": "Paris"})
+
+    async def test_failed_call_is_reported(self):
+        from utils.exceptions import QuotaExceededError
+
+        async def call(timeout):
+            raise QuotaExceededError()
+
+        job = await self.runner.submit("question", call)
+        finished = await self.runner.store.wait(job.id, timeout=1)
+        self.assertEqual(finished.status, "failed")
+        self.assertIn("quota", finished.error.lower())
+
+    async def test_bounded_queue_refuses_excess_jobs(self):
+        import asyncio
+        from utils.exceptions import JobQueueFullError
+        release = asyncio.Event()
+
+        async def call(timeout):
+            await release.wait()
+            return {}
+
+        await self.runner.submit("question", call)
+        await asyncio.sleep(0)
+        await self.runner.submit("question", call)
+        await self.runner.submit("question", call)
+        with self.assertRaises(JobQueueFullError):
+            await self.runner.submit("question", call)
+        release.set()
+
+    async def test_webhook_is_retried_and_signed(self):
+        import asyncio
+        import hashlib
+        import hmac
+        self.webhook_status[:] = [503, 200]
+
+        async def call(timeout):
+            return {"translated_text": "Bonjour"}
+
+        job = await self.runner.submit("translate", call, webhook_url="https://example.com/hook")
+        await self.runner.store.wait(job.id, timeout=1)
+        while self.runner._deliveries:
+            await asyncio.sleep(0.001)
+        self.assertEqual(len(self.deliveries), 2)
+        body = self.deliveries[-1].content
+        expected = hmac.new(b"s3cret", body, hashlib.sha256).hexdigest()
+        self.assertEqual(self.deliveries[-1].headers["x-signature"], f"sha256={expected}")
+
+    async def test_finished_jobs_expire_after_retention(self):
+        async def call(timeout):
+            return {}
+
+        self.runner.store.retention = 0.0
+        job = await self.runner.submit("question", call)
+        await self.runner.store.wait(job.id, timeout=1)
+        self.assertIsNone(self.runner.store.get(job.id))
+
+    async def test_webhooks_to_internal_hosts_are_refused(self):
+        import asyncio
+        from services.job_service import callback_target, callback_url
+        from utils.exceptions import ValidationError
+        self.assertIsNone(await callback_target("http://localhost:8080/hook", []))
+        self.assertIsNone(await callback_target("http://169.254.169.254/latest/meta-data", []))
+        self.assertEqual(await callback_target("https://hooks.example.com/x", [".example.com"]), "https://hooks.example.com/x")
+        self.assertIsNone(await callback_target("https://example.com.evil.net/x", [".example.com"]))
+        for url in ("http://127.0.0.1/hook", "http://10.0.0.5/hook", "http://[::1]/hook", "file:///etc/passwd"):
+            with self.assertRaises(ValidationError):
+                callback_url(MagicMock(headers={"x-callback-url": url}))
+
+        self.runner.callback_hosts = []
+
+        async def call(timeout):
+            return {}
+
+        job = await self.runner.submit("question", call, webhook_url="http://localhost/hook")
+        await self.runner.store.wait(job.id, timeout=1)
+        while self.runner._deliveries:
+            await asyncio.sleep(0.001)
+        self.assertEqual(self.deliveries, [])
+
+    async def test_webhook_connects_to_the_checked_address(self):
+        import asyncio
+        import socket
+        self.runner.callback_hosts = []
+        answers = [[(socket.AF_INET, socket.SOCK_STREAM, 6, "", ("93.184.216.34", 8443))],
+                   [(socket.AF_INET, socket.SOCK_STREAM, 6, "", ("127.0.0.1", 8443))]]
+
+        async def getaddrinfo(host, port, **kwargs):
+            # A rebinding resolver: public for the check, loopback afterwards
+            return answers.pop(0) if len(answers) > 1 else answers[0]
+
+        async def call(timeout):
+            return {}
+
+        with patch.object(asyncio.get_running_loop(), "getaddrinfo", side_effect=getaddrinfo):
+            job = await self.runner.submit("question", call, webhook_url="https://hooks.test:8443/hook")
+            await self.runner.store.wait(job.id, timeout=1)
+            while self.runner._deliveries:
+                await asyncio.sleep(0.001)
+        request, = self.deliveries
+        self.assertEqual((request.url.host, request.url.port), ("93.184.216.34", 8443))
+        self.assertEqual(request.headers["host"], "hooks.test:8443")
+        self.assertEqual(request.extensions["sni_hostname"], "hooks.test")
+
+    async def test_unfinished_jobs_fail_on_stop(self):
+        import asyncio
+
+        async def call(timeout):
+            await asyncio.sleep(10)
+            return {}
+
+        running = await self.runner.submit("question", call)
+        await asyncio.sleep(0)
+        queued = await self.runner.submit("question", call)
+        await self.runner.stop()
+        for job in (running, queued):
+            self.assertEqual(self.runner.store.get(job.id).status, "failed")
+        self.assertTrue(self.runner._queue.empty())
+
+    async def test_jobs_are_visible_to_every_worker_sharing_the_store(self):
+        import asyncio
+        import os
+        import tempfile
+        from services.job_service import JobStore
+        from services.response_cache import DiskCache
+        path = os.path.join(tempfile.mkdtemp(), "jobs.db")
+        self.runner.store = JobStore(disk=DiskCache(path))
+        other = JobStore(disk=DiskCache(path))
+        release = asyncio.Event()
+
+        async def call(timeout):
+            await release.wait()
+            return {"answer": "Paris"}
+
+        job = await self.runner.submit("question", call, owner="alice")
+        seen = await other.lookup(job.id)
+        self.assertEqual(seen.owner, "alice")
+        self.assertFalse(seen.done)
+        asyncio.get_running_loop().call_later(0.05, release.set)
+        finished = await other.wait(job.id, timeout=2)
+        self.assertEqual(finished.result, {"answer": "Paris"})
+        await other.disk.close()
+
+
+class TestStreamFanout(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        import asyncio
+        from services.response_cache import ResponseCache
+        from services.stream_fanout import StreamFanout
+        self.cache = ResponseCache(None)
+        self.fanout = StreamFanout(self.cache, buffer_size=2)
+        self.started = 0
+        self.gate = asyncio.Event()
+
+    def upstream(self, tokens):
+        import asyncio
+
+        async def stream():
+            self.started += 1
+            for text in tokens:
+                await self.gate.wait()
+                await asyncio.sleep(0)
+                yield text
+        return stream
+
+    async def collect(self, stream, into):
+        async for text in stream:
+            into.append(text)
+
+    async def test_identical_streams_share_one_upstream_call(self):
+        import asyncio
+        first, second = [], []
+        owner = asyncio.create_task(self.collect(self.fanout.subscribe("k", self.upstream(["a", "b"])), first))
+        await asyncio.sleep(0.01)
+        follower = asyncio.create_task(self.collect(self.fanout.subscribe("k", self.upstream(["x"])), second))
+        self.gate.set()
+        await asyncio.gather(owner, follower)
+        self.assertEqual(self.started, 1)
+        self.assertEqual(first, ["a", "b"])
+        self.assertEqual(second, ["a", "b"])
+        self.assertEqual(await self.cache.get("k"), "ab")
+
+    async def test_late_subscriber_gets_replay(self):
+        import asyncio
+        first, late = [], []
+        self.gate.set()
+        tokens = iter(["a", "b", "c"])
+        release = asyncio.Event()
+
+        async def stream():
+            yield next(tokens)
+            await release.wait()
+            for text in tokens:
+                yield text
+
+        owner = asyncio.create_task(self.collect(self.fanout.subscribe("k", lambda: stream()), first))
+        while first != ["a"]:
+            await asyncio.sleep(0)
+        follower = asyncio.create_task(self.collect(self.fanout.subscribe("k", self.upstream(["x"])), late))
+        release.set()
+        await asyncio.gather(owner, follower)
+        self.assertEqual(late, ["a", "b", "c"])
+
+    async def test_slow_subscriber_is_dropped(self):
+        import asyncio
+        from utils.exceptions import SlowConsumerError
+        fast = []
+        owner = asyncio.create_task(self.collect(self.fanout.subscribe("k", self.upstream(list("abcdef"))), fast))
+        await asyncio.sleep(0.01)
+        slow = self.fanout.subscribe("k", self.upstream(["x"]))
+        first = asyncio.create_task(slow.__anext__())
+        await asyncio.sleep(0.01)
+        self.gate.set()
+        await owner
+        self.assertEqual(await first, "a")
+        self.assertEqual(fast, list("abcdef"))
+        with self.assertRaises(SlowConsumerError):
+            async for _ in slow:
+                pass
+
+    async def test_upstream_stops_when_everyone_leaves(self):
+        import asyncio
+        closed = asyncio.Event()
+
+        async def stream():
+            try:
+                yield "a"
+                await asyncio.sleep(10)
+                yield "b"
+            finally:
+                closed.set()
+
+        subscriber = self.fanout.subscribe("k", lambda: stream())
+        self.assertEqual(await subscriber.__anext__(), "a")
+        await subscriber.aclose()
+        await asyncio.wait_for(closed.wait(), 1)
+        self.assertIsNone(await self.cache.get("k"))
+
+    async def test_starters_private_error_fails_only_the_starter(self):
+        import asyncio
+        from services.stream_fanout import StreamFanout
+        from utils.exceptions import DeadlineExceededError
+        fanout = StreamFanout(buffer_size=8, private_errors=(DeadlineExceededError,))
+        release = asyncio.Event()
+
+        async def starter_stream():
+            yield "ab"
+            await release.wait()
+            raise DeadlineExceededError()
+
+        async def own_stream():
+            for text in ("a", "bc", "d"):
+                yield text
+            yield {"prompt_tokens": 2}
+
+        usage = []
+        starter, follower = [], []
+        owner = asyncio.create_task(self.collect(fanout.subscribe("k", lambda: starter_stream()), starter))
+        while starter != ["ab"]:
+            await asyncio.sleep(0)
+        joined = asyncio.create_task(self.collect(fanout.subscribe("k", lambda: own_stream(), usage.append), follower))
+        await asyncio.sleep(0)
+        release.set()
+        with self.assertRaises(DeadlineExceededError):
+            await owner
+        await joined
+        # The follower continues on its own stream without repeating "ab"; it started that one, so it isn't billed twice
+        self.assertEqual("".join(follower), "abcd")
+        self.assertEqual(follower[0], "ab")
+        self.assertEqual(usage, [])
+
+    async def test_joining_subscribers_get_the_usage(self):
+        import asyncio
+        usage = []
+
+        async def stream():
+            await self.gate.wait()
+            yield "a"
+            yield ("model", 5)
+
+        owner = asyncio.create_task(self.collect(self.fanout.subscribe("k", lambda: stream(), usage.append), []))
+        await asyncio.sleep(0.01)
+        follower = []
+        joined = asyncio.create_task(self.collect(self.fanout.subscribe("k", self.upstream(["x"]), usage.append), follower))
+        await asyncio.sleep(0.01)
+        self.gate.set()
+        await asyncio.gather(owner, joined)
+        self.assertEqual(follower, ["a"])
+        self.assertEqual(usage, [("model", 5)])
+
+
+class TestIdempotencyStore(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        import os
+        import tempfile
+        from services.idempotency import IdempotencyStore
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "idempotency.db")
+        self.store = IdempotencyStore(maxsize=2)
+        self.calls = 0
+
+    async def asyncTearDown(self):
+        self.tmp.cleanup()
+
+    async def call(self):
+        import asyncio
+        self.calls += 1
+        await asyncio.sleep(0.01)
+        return f"result {self.calls}"
+
+    async def test_retries_share_the_first_result(self):
+        import asyncio
+        first, second = await asyncio.gather(self.store.run("k", "d", self.call), self.store.run("k", "d", self.call))
+        self.assertEqual(first, ("result 1", False))
+        self.assertEqual(second, ("result 1", True))
+        self.assertEqual(await self.store.run("k", "d", self.call), ("result 1", True))
+        self.assertEqual(self.calls, 1)
+
+    async def test_different_body_is_refused(self):
+        from utils.exceptions import IdempotencyKeyMismatchError
+        await self.store.run("k", "d", self.call)
+        with self.assertRaises(IdempotencyKeyMismatchError):
+            await self.store.run("k", "other", self.call)
+
+    async def test_failures_are_not_remembered(self):
+        from utils.exceptions import OpenAIError
+
+        async def failing():
+            raise OpenAIError()
+
+        with self.assertRaises(OpenAIError):
+            await self.store.run("k", "d", failing)
+        self.assertEqual(await self.store.run("k", "d", self.call), ("result 1", False))
+
+    async def test_table_is_bounded(self):
+        for key in ("a", "b", "c"):
+            await self.store.run(key, "d", self.call)
+        self.assertEqual(await self.store.run("a", "d", self.call), ("result 4", False))
+
+    async def test_workers_share_keys_through_disk(self):
+        import asyncio
+        from services.idempotency import IdempotencyStore
+        from services.response_cache import DiskCache
+        workers = [IdempotencyStore(disk=DiskCache(self.path)) for _ in range(2)]
+        try:
+            results = await asyncio.gather(*(worker.run("k", "d", self.call) for worker in workers))
+            self.assertEqual(sorted(results), [("result 1", False), ("result 1", True)])
+            self.assertEqual(self.calls, 1)
+        finally:
+            for worker in workers:
+                await worker.close()
+
+    async def test_repeats_wait_no_longer_than_their_deadline(self):
+        import asyncio
+        import time
+        from services.idempotency import IdempotencyStore
+        from services.response_cache import DiskCache
+        from utils.exceptions import DeadlineExceededError
+        release = asyncio.Event()
+
+        async def slow():
+            await release.wait()
+            return "done"
+
+        workers = [IdempotencyStore(disk=DiskCache(self.path)) for _ in range(2)]
+        try:
+            first = asyncio.create_task(workers[0].run("k", "d", slow))
+            await asyncio.sleep(0.05)
+            for store in (workers[0], workers[1]):
+                started = time.monotonic()
+                with self.assertRaises(DeadlineExceededError):
+                    await store.run("k", "d", self.call, timeout=0.1)
+                self.assertLess(time.monotonic() - started, 1)
+            release.set()
+            self.assertEqual(await first, ("done", False))
+            self.assertEqual(await workers[1].run("k", "d", self.call, timeout=1), ("done", True))
+            self.assertEqual(self.calls, 0)
+        finally:
+            for worker in workers:
+                await worker.close()
+
+
+class TestCodePipeline(unittest.IsolatedAsyncioTestCase):
+
+    def test_extracts_the_blocks_for_the_language(self):
+        from utils.code_processing import extract_code
+        text = "Here you go:\n```py\nx = 1\n```\nand a test:\n```bash\npytest\n```\n"
+        self.assertEqual(extract_code(text, "python"), "x = 1")
+        self.assertEqual(extract_code(text, "shell"), "pytest")
+        self.assertEqual(extract_code("```\nfoo()\n```", "go"), "foo()")
+        # Truncated by max_tokens: the fence never closes
+        self.assertEqual(extract_code("```python\ndef f():\n    pass\n", "python"), "def f():\n    pass")
+        self.assertEqual(extract_code("\nplain()\n", "python"), "plain()")
+
+    async def test_python_is_checked_and_formatted_in_a_worker(self):
+        from services.code_pipeline import CodePipeline
+        pipeline = CodePipeline(workers=1, timeout=60)
+        try:
+            text = "```python\ndef f( a,b ):\n  return {'a':a}\n```"
+            self.assertEqual(await pipeline.process(text, "Python"), 'def f(a, b):\n    return {"a": a}\n')
+            # Code that doesn't parse is returned as extracted
+            self.assertEqual(await pipeline.process("```python\ndef f(:\n```", "python"), "def f(:")
+            self.assertEqual(len(pipeline._cache), 2)
+        finally:
+            pipeline.close()
+
+    async def test_other_languages_skip_the_pool_and_results_are_cached(self):
+        from services.code_pipeline import CodePipeline
+        from utils.code_processing import process_code
+        pipeline = CodePipeline(cache_size=1)
+        with patch("services.code_pipeline.process_code", wraps=process_code) as process:
+            self.assertEqual(await pipeline.process("```js\nlet a=1\n```", "javascript"), "let a=1")
+            self.assertEqual(await pipeline.process("```js\nlet a=1\n```", "javascript"), "let a=1")
+            self.assertEqual(process.call_count, 1)
+        self.assertIsNone(pipeline._pool)
+
+
+class TestHealthMonitor(unittest.IsolatedAsyncioTestCase):
+
+    def monitor(self, probe=None, **kwargs):
+        from unittest.mock import AsyncMock
+        from services.health import HealthMonitor
+        from services.scheduler import FairScheduler
+        from utils.admission import AdmissionController
+        admission = AdmissionController({}, {"generation": {"limit": 1, "queue": 10, "timeout": 1.0}})
+        return HealthMonitor(probe or AsyncMock(), admission=admission, scheduler=FairScheduler(4), **kwargs)
+
+    async def test_lag_and_queue_saturation_make_the_worker_unready(self):
+        import asyncio
+        monitor = self.monitor(max_loop_lag=0.1, max_queue_fraction=0.5)
+        ready, checks = monitor.readiness()
+        self.assertTrue(ready)
+        self.assertEqual(checks["saturation"]["upstream"], {"in_flight": 0, "capacity": 4, "queued": 0})
+
+        monitor._lags.append(0.3)
+        ready, checks = monitor.readiness()
+        self.assertFalse(ready)
+        self.assertFalse(checks["event_loop"]["ok"])
+
+        monitor._lags.clear()
+        limiter = monitor.admission.limiters["generation"]
+        waiting = [asyncio.create_task(limiter.acquire()) for _ in range(6)]
+        await asyncio.sleep(0)
+        ready, checks = monitor.readiness()
+        self.assertFalse(ready)
+        self.assertEqual(checks["saturation"]["saturated"], ["generation"])
+        for task in waiting:
+            task.cancel()
+        await asyncio.gather(*waiting, return_exceptions=True)
+
+    async def test_readiness_uses_the_cached_probe_result(self):
+        from unittest.mock import AsyncMock
+        probe = AsyncMock(side_effect=OpenAIError("upstream down"))
+        monitor = self.monitor(probe, probe_failures=2)
+        self.assertFalse(await monitor.probe_once())
+        # One failure is tolerated; checking readiness never probes again
+        for _ in range(3):
+            self.assertTrue(monitor.readiness()[0])
+        self.assertEqual(probe.await_count, 1)
+        await monitor.probe_once()
+        ready, checks = monitor.readiness()
+        self.assertFalse(ready)
+        self.assertEqual(checks["upstream"]["error"], "upstream down")
+        probe.side_effect = None
+        self.assertTrue(await monitor.probe_once())
+        self.assertTrue(monitor.readiness()[0])
+
+    async def test_ticker_measures_a_blocked_loop(self):
+        import asyncio
+        import time
+        monitor = self.monitor(lag_interval=0.01)
+        monitor.start()
+        try:
+            await asyncio.sleep(0.02)
+            time.sleep(0.1)
+            await asyncio.sleep(0.02)
+        finally:
+            await monitor.stop()
+        self.assertGreaterEqual(monitor.loop_lag, 0.05)
+
+
 if __name__ == '__main__':
-    unittest.main()
\ No newline at end of file
+    unittest.main()
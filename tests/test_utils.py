@@ -1,4 +1,5 @@
-from unittest import TestCase
+import logging
+from unittest import IsolatedAsyncioTestCase, TestCase
 from unittest.mock import patch, MagicMock
 
 from utils.config import settings
@@ -237,4 +238,385 @@ class TestUtils(TestCase):
         logger.critical("Test Critical Message", extra={"key": "value"})
         mock_logger.return_value.critical.assert_called_once_with(
             "Test Critical Message", extra={"key": "value"}
-        )
\ No newline at end of file
+        )
+
+class TestLoggingPipeline(TestCase):
+
+    def _record(self, level=logging.INFO, **extra):
+        record = logging.LogRecord("utils.logger", level, __file__, 0, "Test message", None, None)
+        record.__dict__.update(extra)
+        return record
+
+    def test_prompt_redaction_truncates_and_fingerprints(self):
+        from utils.logger import PromptRedactionFilter
+
+        record = self._record(prompt="x" * 1000)
+        self.assertTrue(PromptRedactionFilter(max_chars=10).filter(record))
+        self.assertEqual(record.prompt, "x" * 10 + "...")
+        self.assertEqual(record.prompt_len, 1000)
+        self.assertEqual(len(record.prompt_sha), 16)
+
+    def test_prompt_redaction_runs_once_per_record(self):
+        from utils.logger import PromptRedactionFilter
+
+        record = self._record(prompt="y" * 50)
+        redaction = PromptRedactionFilter(max_chars=10)
+        redaction.filter(record)
+        digest = record.prompt_sha
+        # A second sink sees the already-truncated text but must not re-fingerprint it
+        redaction.filter(record)
+        self.assertEqual((record.prompt_sha, record.prompt_len), (digest, 50))
+
+    def test_sampling_filter_only_drops_low_levels(self):
+        from utils.logger import SamplingFilter
+
+        sampler = SamplingFilter({"generate": 0.0})
+        self.assertFalse(sampler.filter(self._record(route="generate")))
+        self.assertTrue(sampler.filter(self._record(route="code")))
+        self.assertTrue(sampler.filter(self._record(logging.ERROR, route="generate")))
+
+    def test_queue_handler_defers_formatting_and_drops_when_full(self):
+        import queue
+        from utils.logger import NonBlockingQueueHandler
+
+        handler = NonBlockingQueueHandler(queue.Queue(maxsize=1))
+        record = self._record()
+        record.args = ("unformatted",)
+        handler.emit(record)
+        handler.emit(self._record())
+        self.assertIs(handler.queue.get_nowait(), record)
+        self.assertEqual(record.args, ("unformatted",))
+        self.assertEqual(handler.dropped, 1)
+
+    def test_json_formatter_includes_extra_fields(self):
+        import json
+        from utils.logger import JsonFormatter
+
+        line = JsonFormatter().format(self._record(route="question"))
+        payload = json.loads(line)
+        self.assertEqual(payload["message"], "Test message")
+        self.assertEqual(payload["route"], "question")
+
+
+class TestAdmissionControl(IsolatedAsyncioTestCase):
+
+    async def test_waiters_are_admitted_in_order(self):
+        import asyncio
+        from utils.admission import ConcurrencyLimiter
+
+        limiter = ConcurrencyLimiter("test", limit=1, max_queue=5, queue_timeout=1.0)
+        await limiter.acquire()
+        order = []
+
+        async def worker(i):
+            await limiter.acquire()
+            order.append(i)
+            limiter.release()
+
+        tasks = [asyncio.create_task(worker(i)) for i in range(3)]
+        await asyncio.sleep(0)
+        self.assertEqual(limiter.queued, 3)
+        limiter.release()
+        await asyncio.gather(*tasks)
+        self.assertEqual(order, [0, 1, 2])
+        self.assertEqual(limiter.in_flight, 0)
+
+    async def test_sheds_when_queue_is_full_or_deadline_passes(self):
+        from utils.admission import ConcurrencyLimiter, Overloaded
+
+        limiter = ConcurrencyLimiter("test", limit=1, max_queue=0, queue_timeout=0.01)
+        await limiter.acquire()
+        with self.assertRaises(Overloaded) as ctx:
+            await limiter.acquire()
+        self.assertEqual(ctx.exception.reason, "queue_full")
+
+        limiter.max_queue = 1
+        with self.assertRaises(Overloaded) as ctx:
+            await limiter.acquire()
+        self.assertEqual(ctx.exception.reason, "queue_timeout")
+        self.assertEqual(limiter.queued, 0)
+        self.assertGreaterEqual(ctx.exception.retry_after, 1)
+
+    async def test_middleware_rejects_with_retry_after_and_bypasses_health(self):
+        from utils.admission import AdmissionController, AdmissionMiddleware
+
+        calls = []
+
+        async def app(scope, receive, send):
+            calls.append(scope["path"])
+
+        controller = AdmissionController({"/code": "expensive"}, {"expensive": {"limit": 0, "queue": 0, "timeout": 0}})
+        middleware = AdmissionMiddleware(app, controller)
+        sent = []
+
+        async def send(message):
+            sent.append(message)
+
+        await middleware({"type": "http", "path": "/code/"}, None, send)
+        await middleware({"type": "http", "path": "/"}, None, send)
+        self.assertEqual(calls, ["/"])
+        self.assertEqual(sent[0]["status"], 503)
+        self.assertIn((b"retry-after", b"1"), sent[0]["headers"])
+
+
+class TestDeadlines(IsolatedAsyncioTestCase):
+
+    class _Request:
+        def __init__(self, disconnect_after):
+            self.disconnect_after = disconnect_after
+
+        async def receive(self):
+            import asyncio
+            await asyncio.sleep(self.disconnect_after)
+            return {"type": "http.disconnect"}
+
+    async def test_upstream_call_is_cancelled_on_disconnect(self):
+        import asyncio
+        from utils.deadline import CANCELLED_TOKENS, run_cancellable
+        from utils.exceptions import ClientDisconnectedError
+
+        cancelled = asyncio.Event()
+
+        async def slow_call():
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+
+        before = CANCELLED_TOKENS.labels("generate")._value.get()
+        with self.assertRaises(ClientDisconnectedError):
+            await run_cancellable(self._Request(0.01), "generate", 100, slow_call())
+        await asyncio.wait_for(cancelled.wait(), 1)
+        self.assertEqual(CANCELLED_TOKENS.labels("generate")._value.get() - before, 100)
+
+    async def test_result_is_returned_when_call_finishes_first(self):
+        from utils.deadline import run_cancellable
+
+        async def fast_call():
+            return "done"
+
+        self.assertEqual(await run_cancellable(self._Request(10), "generate", 100, fast_call()), "done")
+
+    def test_deadline_remaining_counts_down(self):
+        from utils.deadline import Deadline
+
+        deadline = Deadline(0.0)
+        self.assertTrue(deadline.expired())
+        self.assertLessEqual(Deadline(5).remaining(), 5)
+
+    def test_invalid_timeout_header_falls_back_to_route_default(self):
+        from starlette.requests import Request
+        from utils.config import settings
+        from utils.deadline import get_deadline
+
+        for value in ("-5", "0", "nan", "inf", "soon"):
+            request = Request({"type": "http", "path": "/generate", "headers": [(b"x-request-timeout", value.encode())]})
+            self.assertAlmostEqual(get_deadline(request).remaining(), settings.ROUTE_DEADLINES["generate"], delta=1)
+        request = Request({"type": "http", "path": "/generate", "headers": [(b"x-request-timeout", b"2.5")]})
+        self.assertAlmostEqual(get_deadline(request).remaining(), 2.5, delta=0.5)
+
+
+class TestCanonicalize(TestCase):
+
+    def test_equivalent_bodies_share_a_digest(self):
+        from utils.canonical import canonicalize
+        a = canonicalize("question", {"question": "What is the capital of France? \r\n", "model": "auto"})
+        b = canonicalize("question", {"model": "auto", "question": "What is the capital of France?"})
+        c = canonicalize("question", {"question": "What is the capital of France?"})
+        self.assertEqual(a.digest, b.digest)
+        self.assertEqual(b.digest, c.digest)
+        self.assertEqual(len(a.digest), 32)
+
+    def test_questions_keep_their_line_structure(self):
+        from utils.canonical import canonicalize
+        question = "Why does this fail?\n\n    def f(:\n        pass"
+        self.assertEqual(canonicalize("question", {"question": question + "  \n"}).fields["question"], question)
+
+    def test_unicode_forms_are_unified(self):
+        from utils.canonical import canonicalize
+        composed = canonicalize("translate", {"source_language": "FR", "target_language": "en", "text": "café"})
+        decomposed = canonicalize("translate", {"source_language": "fr", "target_language": "en", "text": "café"})
+        self.assertEqual(composed.digest, decomposed.digest)
+
+    def test_code_keeps_indentation_but_not_trailing_whitespace(self):
+        from utils.canonical import canonicalize
+        result = canonicalize("code", {"language": "python", "prompt": "def f():  \r\n    return 1\t\r\n"})
+        self.assertEqual(result.fields["prompt"], "def f():\n    return 1")
+        self.assertEqual(result.fields["temperature"], 0.5)
+        other = canonicalize("code", {"language": "python", "prompt": "def f():\n  return 1"})
+        self.assertNotEqual(result.digest, other.digest)
+
+    def test_different_requests_differ(self):
+        from utils.canonical import canonicalize
+        base = {"prompt": "Hello", "temperature": 0.0}
+        self.assertNotEqual(canonicalize("generate", base).digest, canonicalize("code", base).digest)
+        self.assertNotEqual(
+            canonicalize("generate", base).digest, canonicalize("generate", {**base, "max_tokens": 5}).digest
+        )
+        self.assertEqual(
+            canonicalize("generate", base).digest, canonicalize("generate", {**base, "temperature": -0.0}).digest
+        )
+
+    def test_request_is_canonicalized_once_and_normalized_in_place(self):
+        from types import SimpleNamespace
+        from models.request import GenerateRequest
+        from utils.canonical import canonicalize_request
+        http_request = SimpleNamespace(state=SimpleNamespace())
+        body = GenerateRequest(prompt="  Hello  \n")
+        first = canonicalize_request(http_request, "generate", body)
+        self.assertEqual(body.prompt, "  Hello")
+        self.assertIs(canonicalize_request(http_request, "generate", body), first)
+        self.assertIs(http_request.state.canonical, first)
+
+
+class TestTrafficCapture(IsolatedAsyncioTestCase):
+
+    def test_mask_keeps_shape_and_commutes_with_normalization(self):
+        from utils.canonical import normalize_text
+        from utils.capture import mask_text
+        text = "What is  the capital\r\nof France?  \n"
+        masked = mask_text(text)
+        self.assertEqual(len(masked), len(text))
+        self.assertEqual([c.isspace() for c in masked], [c.isspace() for c in text])
+        self.assertNotIn("capital", masked)
+        self.assertEqual(mask_text(text), masked)
+        self.assertNotEqual(mask_text("What is the capital of Spain?"), mask_text("What is the capital of Italy?"))
+        self.assertEqual(normalize_text(masked, "lines"), mask_text(normalize_text(text, "lines")))
+
+    def test_writer_rotates_and_reads_back(self):
+        import tempfile
+        from utils.capture import CaptureWriter, capture_files, mask_record, read_capture
+        with tempfile.TemporaryDirectory() as directory:
+            writer = CaptureWriter(directory, max_bytes=1, max_files=2, redact=mask_record)
+            writer.start()
+            for i in range(3):
+                writer.write({"route": "question", "body": {"question": f"secret {i}"}, "seq": i})
+            writer.stop()
+            self.assertEqual(writer.written, 3)
+            # One record per file; the oldest file was pruned
+            self.assertEqual(len(capture_files(directory)), 2)
+            records = list(read_capture([directory]))
+            self.assertEqual([r["seq"] for r in records], [1, 2])
+            self.assertNotIn("secret", records[0]["body"]["question"])
+
+    async def test_middleware_records_request_and_upstream_calls(self):
+        import json
+        from utils.capture import CaptureMiddleware, record_upstream
+
+        async def app(scope, receive, send):
+            message = await receive()
+            record_upstream("completions.create", {"prompt": "hi", "timeout": 5}, 0.25, {"choices": [{"text": "yo"}]})
+            body = json.dumps({"echo": json.loads(message["body"])}).encode()
+            await send({"type": "http.response.start", "status": 200, "headers": []})
+            await send({"type": "http.response.body", "body": body})
+
+        writer = MagicMock()
+        middleware = CaptureMiddleware(app, writer=writer, sample_rates={"generate": 1.0, "code": 0.0})
+        messages = [{"type": "http.request", "body": b'{"prompt": "hi"}', "more_body": False}]
+
+        async def receive():
+            return messages.pop(0)
+
+        async def send(message):
+            pass
+
+        scope = {
+            "type": "http",
+            "method": "POST",
+            "path": "/generate/generate/",
+            "query_string": b"",
+            "headers": [(b"content-type", b"application/json"), (b"authorization", b"Bearer secret")],
+        }
+        await middleware(scope, receive, send)
+        record = writer.write.call_args.args[0]
+        self.assertEqual(record["route"], "generate")
+        self.assertEqual(record["headers"], {"content-type": "application/json"})
+        self.assertEqual(record["body"], {"prompt": "hi"})
+        self.assertEqual(record["status"], 200)
+        self.assertEqual(record["response"], {"echo": {"prompt": "hi"}})
+        self.assertEqual(
+            record["upstream"],
+            [{"operation": "completions.create", "params": {"prompt": "hi"}, "latency": 0.25, "response": {"choices": [{"text": "yo"}]}}],
+        )
+
+        # Unsampled routes and calls outside a captured request are not recorded
+        writer.write.reset_mock()
+        messages.append({"type": "http.request", "body": b"{}", "more_body": False})
+        await middleware({**scope, "path": "/code/code/"}, receive, send)
+        writer.write.assert_not_called()
+        record_upstream("completions.create", {}, 0.1, None)
+
+
+class TestPydanticJSONResponse(TestCase):
+
+    def test_renders_models_with_a_cached_adapter(self):
+        from models.response import QuestionResponse
+        from utils.responses import PydanticJSONResponse, adapter_for
+        response = PydanticJSONResponse(QuestionResponse(answer="café"), headers={"X-Test": "1"})
+        self.assertEqual(response.body, '{"answer":"café"}'.encode("utf-8"))
+        self.assertEqual(response.headers["content-type"], "application/json")
+        self.assertEqual(response.headers["x-test"], "1")
+        self.assertIs(adapter_for(QuestionResponse), adapter_for(QuestionResponse))
+
+
+class TestCompression(IsolatedAsyncioTestCase):
+
+    @staticmethod
+    def _app(chunks, content_type=b"application/json"):
+        async def app(scope, receive, send):
+            await send({"type": "http.response.start", "status": 200, "headers": [(b"content-type", content_type)]})
+            for i, chunk in enumerate(chunks):
+                await send({"type": "http.response.body", "body": chunk, "more_body": i < len(chunks) - 1})
+        return app
+
+    async def _call(self, middleware, accept="gzip"):
+        sent = []
+
+        async def send(message):
+            sent.append(message)
+
+        scope = {"type": "http", "method": "GET", "path": "/", "headers": [(b"accept-encoding", accept.encode())]}
+        await middleware(scope, None, send)
+        return sent[0], sent[1:]
+
+    def test_negotiation_follows_q_values_then_preference(self):
+        from utils.compression import CompressionMiddleware
+        middleware = CompressionMiddleware(None, preference=["zstd", "gzip"])
+        self.assertEqual(middleware.negotiate("gzip, zstd").name, "zstd")
+        self.assertEqual(middleware.negotiate("gzip;q=1.0, zstd;q=0.5").name, "gzip")
+        self.assertEqual(middleware.negotiate("*;q=0.1").name, "zstd")
+        self.assertIsNone(middleware.negotiate("gzip;q=0, identity"))
+        self.assertIsNone(middleware.negotiate(""))
+
+    async def test_large_bodies_are_compressed_small_ones_are_not(self):
+        import gzip
+        from utils.compression import CompressionMiddleware
+        body = b'{"code": "' + b"x = 1\n" * 2000 + b'"}'
+        start, messages = await self._call(CompressionMiddleware(self._app([body]), min_bytes=1024, offload_bytes=4096))
+        headers = dict(start["headers"])
+        self.assertEqual(headers[b"content-encoding"], b"gzip")
+        self.assertEqual(headers[b"vary"], b"Accept-Encoding")
+        self.assertEqual(int(headers[b"content-length"]), len(messages[0]["body"]))
+        self.assertEqual(gzip.decompress(messages[0]["body"]), body)
+
+        start, messages = await self._call(CompressionMiddleware(self._app([b'{"a": 1}']), min_bytes=1024))
+        self.assertNotIn(b"content-encoding", dict(start["headers"]))
+        self.assertEqual(messages[0]["body"], b'{"a": 1}')
+
+        start, _ = await self._call(CompressionMiddleware(self._app([body], content_type=b"image/png"), min_bytes=1))
+        self.assertNotIn(b"content-encoding", dict(start["headers"]))
+
+    async def test_streams_are_flushed_per_chunk(self):
+        import zlib
+        from utils.compression import CompressionMiddleware
+        chunks = [b"data: one\n\n", b"data: two\n\n", b""]
+        start, messages = await self._call(CompressionMiddleware(self._app(chunks, content_type=b"text/event-stream")))
+        self.assertEqual(dict(start["headers"])[b"content-encoding"], b"gzip")
+        decoder = zlib.decompressobj(31)
+        # Every chunk decodes on arrival, without waiting for the rest of the stream
+        self.assertEqual(decoder.decompress(messages[0]["body"]), b"data: one\n\n")
+        self.assertEqual(decoder.decompress(messages[1]["body"]), b"data: two\n\n")
+        decoder.decompress(messages[2]["body"])
+        self.assertTrue(decoder.eof)
+        self.assertFalse(messages[2]["more_body"])
@@ -0,0 +1,214 @@
+import asyncio
+import json
+import math
+import time
+from collections import deque
+from typing import Optional
+
+from prometheus_client import Counter, Gauge
+
+from utils.config import settings
+from utils.logger import logger
+
+# First path segment -> route class. Paths not listed here (e.g. "/", health
+# and metrics endpoints) bypass admission control entirely.
+DEFAULT_ROUTE_CLASSES = {
+    "/models": "cheap",
+    "/generate": "standard",
+    "/translate": "standard",
+    "/question": "expensive",
+    "/code": "expensive",
+}
+
+# Per-class concurrency limit, wait-queue bound and queue deadline (seconds).
+# Each class has its own pool, so expensive generation traffic can never
+# take the slots that cheap routes rely on.
+DEFAULT_CLASS_LIMITS = {
+    "cheap": {"limit": 64, "queue": 256, "timeout": 1.0},
+    "standard": {"limit": 32, "queue": 64, "timeout": 2.0},
+    "expensive": {"limit": 16, "queue": 32, "timeout": 2.0},
+}
+
+ADMISSION_IN_FLIGHT = Gauge("admission_in_flight", "Requests currently admitted", ["route_class"])
+ADMISSION_QUEUED = Gauge("admission_queued", "Requests waiting for admission", ["route_class"])
+ADMISSION_SHED = Counter("admission_shed_total", "Requests rejected with 503", ["route_class", "reason"])
+
+
+class Overloaded(Exception):
+    """Raised when a request cannot be admitted in time."""
+
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class ConcurrencyLimiter:
+    """Concurrency limit with a bounded FIFO wait queue and a queue deadline.
+
+    A released slot is handed directly to the oldest waiter, so waiters are
+    served in arrival order and newcomers cannot jump the queue.
+    """
+
+    def __init__(self, name: str, limit: int, max_queue: int, queue_timeout: float):
+        self.name = name
+        self.limit = limit
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.in_flight = 0
+        self._waiters: deque = deque()
+        self._service_time = 0.0  # EWMA of time between acquire and release
+
+    @property
+    def queued(self) -> int:
+        return len(self._waiters)
+
+    def retry_after(self) -> int:
+        """Rough seconds until the current backlog drains."""
+        backlog = (self.queued + 1) / max(self.limit, 1)
+        return max(1, math.ceil(self._service_time * backlog))
+
+    def _update_gauges(self) -> None:
+        ADMISSION_IN_FLIGHT.labels(self.name).set(self.in_flight)
+        ADMISSION_QUEUED.labels(self.name).set(self.queued)
+
+    async def acquire(self, timeout: Optional[float] = None) -> None:
+        if self.in_flight < self.limit and not self._waiters:
+            self.in_flight += 1
+            self._update_gauges()
+            return
+        if self.queued >= self.max_queue:
+            raise Overloaded("queue_full", self.retry_after())
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        self._update_gauges()
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), timeout if timeout is not None else self.queue_timeout)
+        except asyncio.TimeoutError:
+            if waiter.done():
+                return  # A slot arrived as the deadline fired
+            self._abandon(waiter)
+            raise Overloaded("queue_timeout", self.retry_after())
+        except asyncio.CancelledError:
+            if waiter.done():
+                self.release()
+            else:
+                self._abandon(waiter)
+            raise
+
+    def _abandon(self, waiter: asyncio.Future) -> None:
+        waiter.cancel()
+        try:
+            self._waiters.remove(waiter)
+        except ValueError:
+            pass
+        self._update_gauges()
+
+    def release(self, service_time: Optional[float] = None) -> None:
+        if service_time is not None:
+            self._service_time = 0.8 * self._service_time + 0.2 * service_time
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                self._update_gauges()
+                return
+        self.in_flight -= 1
+        self._update_gauges()
+
+    def snapshot(self) -> dict:
+        return {
+            "in_flight": self.in_flight,
+            "limit": self.limit,
+            "queued": self.queued,
+            "max_queue": self.max_queue,
+        }
+
+
+class AdmissionController:
+    """Maps request paths to route classes and their limiters."""
+
+    def __init__(self, route_classes: dict[str, str], class_limits: dict[str, dict]):
+        self.route_classes = route_classes
+        self.limiters = {
+            name: ConcurrencyLimiter(name, int(cfg["limit"]), int(cfg["queue"]), float(cfg["timeout"]))
+            for name, cfg in class_limits.items()
+        }
+
+    @classmethod
+    def from_settings(cls) -> "AdmissionController":
+        class_limits = {name: dict(cfg) for name, cfg in DEFAULT_CLASS_LIMITS.items()}
+        for name, overrides in settings.ADMISSION_LIMITS.items():
+            class_limits.setdefault(name, {}).update(overrides)
+        route_classes = {**DEFAULT_ROUTE_CLASSES, **settings.ADMISSION_ROUTES}
+        return cls(route_classes, class_limits)
+
+    def limiter_for(self, path: str) -> Optional[ConcurrencyLimiter]:
+        segment = "/" + path.split("/", 2)[1]
+        route_class = self.route_classes.get(segment)
+        return self.limiters.get(route_class) if route_class else None
+
+    def snapshot(self) -> dict:
+        return {name: limiter.snapshot() for name, limiter in self.limiters.items()}
+
+
+class AdmissionMiddleware:
+    """ASGI middleware that admits, queues or sheds requests per route class.
+
+    Shed requests get a 503 with `Retry-After` before any body is read or
+    any handler runs, so overload costs almost nothing per rejected request.
+    """
+
+    def __init__(self, app, controller: Optional[AdmissionController] = None):
+        self.app = app
+        self.controller = controller or get_admission_controller()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        limiter = self.controller.limiter_for(scope["path"])
+        if limiter is None:
+            await self.app(scope, receive, send)
+            return
+        try:
+            await limiter.acquire()
+        except Overloaded as e:
+            ADMISSION_SHED.labels(limiter.name, e.reason).inc()
+            logger.warning(
+                "Shed request", extra={"route_class": limiter.name, "reason": e.reason, "path": scope["path"]}
+            )
+            await self._reject(send, e)
+            return
+        started = time.monotonic()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            limiter.release(time.monotonic() - started)
+
+    @staticmethod
+    async def _reject(send, error: Overloaded) -> None:
+        body = json.dumps({"message": "Service overloaded, retry later.", "details": {"reason": error.reason}}).encode()
+        await send(
+            {
+                "type": "http.response.start",
+                "status": 503,
+                "headers": [
+                    (b"content-type", b"application/json"),
+                    (b"content-length", str(len(body)).encode()),
+                    (b"retry-after", str(error.retry_after).encode()),
+                ],
+            }
+        )
+        await send({"type": "http.response.body", "body": body})
+
+
+_admission_controller: Optional[AdmissionController] = None
+
+
+def get_admission_controller() -> AdmissionController:
+    """Returns the process-wide AdmissionController."""
+    global _admission_controller
+    if _admission_controller is None:
+        _admission_controller = AdmissionController.from_settings()
+    return _admission_controller
@@ -1,60 +1,200 @@
-from fastapi import Depends, HTTPException, status
-from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
-from jose import JWTError, jwt
-from pydantic import BaseModel
+import hashlib
+import hmac
+import os
+import threading
+import time
+from collections import OrderedDict
 from typing import Optional
 
+import jwt
+from jwt.algorithms import get_default_algorithms
+
 from utils.config import settings
-from utils.logger import logger
-from .auth import create_access_token, verify_password
 
-oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
+# Algorithms that sign with a private key and verify with a public one; any
+# node holding only the public key can verify tokens.
+ASYMMETRIC_ALGORITHMS = {"ES256", "ES384", "ES512", "EdDSA", "RS256", "RS384", "RS512", "PS256"}
 
-class TokenData(BaseModel):
-    username: str = None
+PASSWORD_HASH_SCHEME = "pbkdf2_sha256"
+PASSWORD_HASH_ITERATIONS = 390000
 
-async def get_current_user(token: str = Depends(oauth2_scheme), auth_service: AuthService = Depends(get_auth_service)):
-    credentials_exception = HTTPException(
-        status_code=status.HTTP_401_UNAUTHORIZED,
-        detail="Could not validate credentials",
-        headers={"WWW-Authenticate": "Bearer"},
-    )
+
+class SigningKeys:
+    """Holds the JWT signing and verification keys parsed once at startup.
+
+    PEM parsing for EC/EdDSA keys costs far more than the signature check
+    itself, so keys are prepared up front and reused for every token.
+    """
+
+    def __init__(
+        self,
+        algorithm: str,
+        secret: Optional[str] = None,
+        private_key: Optional[str] = None,
+        public_key: Optional[str] = None,
+    ):
+        algorithms = get_default_algorithms()
+        if algorithm not in algorithms:
+            raise ValueError(f"Unsupported JWT algorithm: {algorithm}")
+        alg = algorithms[algorithm]
+        self.algorithm = algorithm
+        if algorithm in ASYMMETRIC_ALGORITHMS:
+            self.signing_key = alg.prepare_key(_read_key(private_key)) if private_key else None
+            if public_key:
+                self.verifying_key = alg.prepare_key(_read_key(public_key))
+            elif self.signing_key is not None:
+                self.verifying_key = self.signing_key.public_key()
+            else:
+                raise ValueError(f"{algorithm} requires JWT_PUBLIC_KEY or JWT_PRIVATE_KEY")
+        else:
+            if not secret:
+                raise ValueError(f"{algorithm} requires JWT_SECRET")
+            self.signing_key = self.verifying_key = alg.prepare_key(secret)
+
+
+def _read_key(value: str) -> str:
+    """Accepts either an inline PEM or a path to a PEM file."""
+    if "-----BEGIN" in value:
+        return value
+    with open(value, "r", encoding="utf-8") as f:
+        return f.read()
+
+
+class TokenCache:
+    """Bounded LRU of verified token -> claims.
+
+    Entries expire at the token's own `exp`, so a cached token is never
+    accepted past its lifetime. Revoked tokens (by raw token or `jti`) are
+    remembered until their own `exp`, when they would have expired anyway.
+    """
+
+    def __init__(self, maxsize: int = 10000, max_ttl: float = 3600.0):
+        self.maxsize = maxsize
+        self.max_ttl = max_ttl
+        self._entries: "OrderedDict[str, tuple[dict, float]]" = OrderedDict()
+        self._revoked: dict[str, float] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, token: str) -> Optional[dict]:
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is None:
+                self.misses += 1
+                return None
+            claims, expires_at = entry
+            if expires_at <= now:
+                del self._entries[token]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(token)
+            self.hits += 1
+            return claims
+
+    def put(self, token: str, claims: dict) -> None:
+        now = time.time()
+        expires_at = now + self.max_ttl
+        if "exp" in claims:
+            expires_at = min(expires_at, float(claims["exp"]))
+        if expires_at <= now:
+            return
+        with self._lock:
+            self._entries[token] = (claims, expires_at)
+            self._entries.move_to_end(token)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    @staticmethod
+    def _token_expiry(token: str) -> Optional[float]:
+        """The token's own `exp`, read without verifying it (inf if it has none, None if unreadable)."""
+        try:
+            claims = jwt.decode(token, options={"verify_signature": False, "verify_exp": False})
+        except jwt.PyJWTError:
+            return None
+        return float(claims["exp"]) if "exp" in claims else float("inf")
+
+    def revoke(self, token: Optional[str] = None, jti: Optional[str] = None, expires_at: Optional[float] = None) -> float:
+        """Drops a token from the cache and rejects it until it would have expired.
+
+        The expiry is `expires_at` when given, else the token's own `exp`, else
+        the `exp` of a cached token carrying `jti`. Returns that expiry.
+
+        Raises:
+            ValueError: If only a `jti` is given and the expiry can't be determined.
+        """
+        now = time.time()
+        until = expires_at
+        if until is None and token is not None:
+            until = self._token_expiry(token)
+        with self._lock:
+            if until is None and jti is not None:
+                expiries = [
+                    float(claims.get("exp", float("inf")))
+                    for claims, _ in self._entries.values()
+                    if claims.get("jti") == jti
+                ]
+                until = max(expiries, default=None)
+            if until is None:
+                if token is None:
+                    raise ValueError("expires_at is required to revoke a jti with no known token")
+                until = now + self.max_ttl  # Not a JWT we could have accepted; nothing outlives this
+            if token is not None:
+                entry = self._entries.pop(token, None)
+                if entry is not None:
+                    jti = jti or entry[0].get("jti")
+                self._revoked[token] = until
+            if jti is not None:
+                self._revoked[f"jti:{jti}"] = until
+                for key in [k for k, (c, _) in self._entries.items() if c.get("jti") == jti]:
+                    del self._entries[key]
+            self._revoked = {k: v for k, v in self._revoked.items() if v > now}
+        return until
+
+    def is_revoked(self, token: str, claims: Optional[dict] = None) -> bool:
+        now = time.time()
+        jti = claims.get("jti") if claims else None
+        with self._lock:
+            if not self._revoked:
+                return False
+            if self._revoked.get(token, 0) > now:
+                return True
+            return jti is not None and self._revoked.get(f"jti:{jti}", 0) > now
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+def create_access_token(data: dict, key, algorithm: str, expires_in: Optional[int] = None) -> str:
+    """Signs `data` as a JWT that expires after `expires_in` seconds."""
+    payload = dict(data)
+    if "exp" not in payload:
+        payload["exp"] = int(time.time()) + (expires_in or settings.AUTH_EXPIRY)
+    return jwt.encode(payload, key, algorithm=algorithm)
+
+
+def decode_access_token(token: str, keys: SigningKeys) -> dict:
+    """Verifies a JWT against pre-parsed keys and returns its claims."""
+    return jwt.decode(token, keys.verifying_key, algorithms=[keys.algorithm])
+
+
+def hash_password(password: str, iterations: int = PASSWORD_HASH_ITERATIONS) -> str:
+    salt = os.urandom(16)
+    digest = hashlib.pbkdf2_hmac("sha256", password.encode("utf-8"), salt, iterations)
+    return f"{PASSWORD_HASH_SCHEME}${iterations}${salt.hex()}${digest.hex()}"
+
+
+def verify_password(plain_password: str, hashed_password: str) -> bool:
+    """Checks a password against a `pbkdf2_sha256$iterations$salt$hash` string."""
     try:
-        payload = jwt.decode(token, settings.JWT_SECRET, algorithms=[settings.ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
-            raise credentials_exception
-        token_data = TokenData(username=username)
-    except JWTError:
-        raise credentials_exception
-    user = await auth_service.get_user(username=token_data.username)
-    if user is None:
-        raise credentials_exception
-    return user
-
-async def get_auth_service():
-    return AuthService(settings.JWT_SECRET)
-
-class AuthService:
-    def __init__(self, secret_key: str):
-        self.secret_key = secret_key
-
-    async def authenticate_user(self, username: str, password: str):
-        user = await self.get_user(username)
-        if user is None:
-            return False
-        if not verify_password(password, user.hashed_password):
-            return False
-        return True
-
-    async def get_user(self, username: str):
-        # Replace with your actual user retrieval logic
-        # Example: Query a database
-        return {"username": username}
-
-    async def create_access_token(self, data: dict):
-        return create_access_token(data, settings.JWT_SECRET, settings.ALGORITHM)
-
-    async def create_refresh_token(self, data: dict):
-        # Replace with your actual refresh token generation logic
-        return "refresh_token"
\ No newline at end of file
+        scheme, iterations, salt, expected = hashed_password.split("$")
+    except (AttributeError, ValueError):
+        return False
+    if scheme != PASSWORD_HASH_SCHEME:
+        return False
+    digest = hashlib.pbkdf2_hmac(
+        "sha256", plain_password.encode("utf-8"), bytes.fromhex(salt), int(iterations)
+    )
+    return hmac.compare_digest(digest.hex(), expected)
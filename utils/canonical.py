@@ -0,0 +1,141 @@
+import hashlib
+import json
+import unicodedata
+from typing import Any, Mapping
+
+from fastapi import Request
+from pydantic import BaseModel
+
+from models.request import CodeRequest, GenerateRequest, QuestionRequest, TranslateRequest
+
+# The body model per route; its field defaults fill in whatever a request left out
+ROUTE_MODELS: dict[str, type[BaseModel]] = {
+    "generate": GenerateRequest,
+    "translate": TranslateRequest,
+    "question": QuestionRequest,
+    "code": CodeRequest,
+}
+
+# Whitespace policy for each route's free-text fields. "lines" keeps line
+# structure and indentation, unifies line endings and drops trailing spaces
+# and tabs and surrounding blank lines; "collapse" turns every run of
+# whitespace into one space. The normalized text is what goes upstream, so
+# anything a user may format (prompts, questions with code in them, text to
+# translate) must use "lines".
+TEXT_POLICIES: dict[str, dict[str, str]] = {
+    "generate": {"prompt": "lines"},
+    "translate": {"text": "lines"},
+    "question": {"question": "lines"},
+    "code": {"prompt": "lines"},
+}
+
+# Short identifier fields compared case-insensitively
+_CASELESS_FIELDS = frozenset({"language", "source_language", "target_language"})
+
+_LINE_SPACE = " \t"
+# Whitespace that "collapse" rewrites; text without any of these (and ASCII) is already collapsed
+_COLLAPSIBLE = ("  ", "\t", "\n", "\r", "\f", "\v")
+
+_defaults_cache: dict[str, dict[str, Any]] = {}
+
+
+def _defaults(route: str) -> dict[str, Any]:
+    defaults = _defaults_cache.get(route)
+    if defaults is None:
+        model = ROUTE_MODELS.get(route)
+        fields = model.model_fields.items() if model is not None else ()
+        defaults = {name: field.default for name, field in fields if not field.is_required()}
+        _defaults_cache[route] = defaults
+    return defaults
+
+
+def _nfc(text: str) -> str:
+    # Most text is already NFC; checking is much cheaper than normalizing
+    return text if unicodedata.is_normalized("NFC", text) else unicodedata.normalize("NFC", text)
+
+
+def normalize_text(text: str, policy: str) -> str:
+    # Each step first checks whether it has anything to do (substring tests
+    # are far cheaper than rewriting), so clean text is barely touched.
+    text = _nfc(text)
+    if policy == "collapse":
+        if text.isascii() and text[:1] != " " and text[-1:] != " " and not any(s in text for s in _COLLAPSIBLE):
+            return text
+        return " ".join(text.split())
+    if "\r" in text:
+        text = text.replace("\r\n", "\n").replace("\r", "\n")
+    if " \n" in text or "\t\n" in text:
+        text = "\n".join(line.rstrip(_LINE_SPACE) for line in text.split("\n"))
+    return text.rstrip(_LINE_SPACE + "\n").lstrip("\n")
+
+
+def _normalize_value(name: str, value: Any, policies: Mapping[str, str]) -> Any:
+    if isinstance(value, str):
+        policy = policies.get(name)
+        if policy is not None:
+            return normalize_text(value, policy)
+        value = _nfc(value).strip()
+        return value.lower() if name in _CASELESS_FIELDS else value
+    if isinstance(value, float):
+        # -0.0 and 0.0 mean the same thing but serialize differently
+        return value + 0.0
+    if isinstance(value, (list, tuple)):
+        return [_normalize_value(name, item, policies) for item in value]
+    return value
+
+
+class CanonicalRequest:
+    """A request reduced to the form every cache, coalescing and idempotency layer keys on.
+
+    Attributes:
+        route (str): The route the request was made to.
+        fields (dict): The normalized body fields, with defaults filled in.
+        digest (str): 128-bit BLAKE2b of the route and the sorted fields, as 32 hex characters.
+    """
+
+    __slots__ = ("route", "fields", "digest")
+
+    def __init__(self, route: str, fields: dict[str, Any], digest: str):
+        self.route = route
+        self.fields = fields
+        self.digest = digest
+
+
+def canonicalize(route: str, fields: Mapping[str, Any]) -> CanonicalRequest:
+    """Normalizes a request body for `route`.
+
+    Text is NFC-normalized and then passed through the route's whitespace policy,
+    missing fields take the body model's defaults, and the digest is computed
+    over the fields in sorted order, so requests that differ only in those
+    respects share a digest.
+    """
+    policies = TEXT_POLICIES.get(route, {})
+    canonical = dict(_defaults(route))
+    for name, value in fields.items():
+        canonical[name] = _normalize_value(name, value, policies)
+    # Free text goes into the hash as length-prefixed raw bytes rather than
+    # through JSON, whose escaping would dominate the cost for long prompts
+    texts = sorted(name for name in policies if isinstance(canonical.get(name), str))
+    header = {name: value for name, value in canonical.items() if name not in texts}
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(json.dumps([route, header, texts], sort_keys=True, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+    for name in texts:
+        data = canonical[name].encode("utf-8")
+        digest.update(b"\0%d\0" % len(data))
+        digest.update(data)
+    return CanonicalRequest(route, canonical, digest.hexdigest())
+
+
+def canonicalize_request(request: Request, route: str, body: BaseModel) -> CanonicalRequest:
+    """Canonicalizes the parsed body once per request, keeping the result on `request.state.canonical`.
+
+    The body's fields are replaced with their normalized values, so what goes
+    upstream is what the digest describes.
+    """
+    canonical = getattr(request.state, "canonical", None)
+    if canonical is None:
+        canonical = canonicalize(route, body.model_dump())
+        for name in body.model_fields:
+            setattr(body, name, canonical.fields[name])
+        request.state.canonical = canonical
+    return canonical
@@ -0,0 +1,355 @@
+import atexit
+import gzip
+import hashlib
+import importlib
+import json
+import os
+import queue
+import random
+import string
+import threading
+import time
+from contextvars import ContextVar
+from typing import Any, Callable, Iterable, Iterator, Optional
+
+from prometheus_client import Counter
+
+from utils.config import settings
+from utils.logger import PROMPT_FIELDS, logger
+
+# First path segment -> route name for the endpoints worth capturing
+CAPTURED_ROUTES = {
+    "/models": "models",
+    "/generate": "generate",
+    "/translate": "translate",
+    "/question": "question",
+    "/code": "code",
+}
+
+# Request headers that change how a request is served; credentials are never recorded
+CAPTURED_HEADERS = ("content-type", "prefer", "idempotency-key", "x-request-timeout")
+
+# Fields whose text "mask" replaces: prompts in request bodies and upstream
+# parameters, and generated text in upstream and service responses
+MASKED_FIELDS = frozenset(PROMPT_FIELDS) | {"answer", "code", "translated_text"}
+
+CAPTURE_RECORDS = Counter("capture_records_total", "Captured requests, by outcome", ["outcome"])
+
+_FILE_PREFIX = "capture-"
+_FILE_SUFFIX = ".jsonl.gz"
+
+# Upstream calls made while serving the current request, when it is being captured
+_upstream_calls: ContextVar[Optional[list]] = ContextVar("capture_upstream_calls", default=None)
+
+Redactor = Callable[[dict], Optional[dict]]
+
+
+def _jsonable(value: Any) -> Any:
+    if hasattr(value, "model_dump"):
+        return value.model_dump(mode="json")
+    if value is None or isinstance(value, (str, int, float, bool, list, dict)):
+        return value
+    return str(value)
+
+
+def record_upstream(operation: str, params: dict, latency: float, response: Any) -> None:
+    """Adds an upstream call to the capture of the request being served, if any.
+
+    `operation` names the SDK method (e.g. "completions.create"); `latency`
+    is the time the call itself took, without any queueing in front of it.
+    """
+    calls = _upstream_calls.get()
+    if calls is None:
+        return
+    calls.append(
+        {
+            "operation": operation,
+            "params": {name: value for name, value in params.items() if name != "timeout"},
+            "latency": round(latency, 6),
+            "response": _jsonable(response),
+        }
+    )
+
+
+def mask_text(text: str) -> str:
+    """A stand-in for `text` of the same length and whitespace layout.
+
+    Letters are drawn from a generator seeded with the digest of the text's
+    words, so equal texts get equal stand-ins (cache hits replay as cache
+    hits), and texts differing only in whitespace get stand-ins differing
+    only in whitespace (the service's normalization of a masked prompt gives
+    the masked form of the normalized prompt).
+    """
+    words = text.split()
+    seed = hashlib.blake2b(" ".join(words).encode("utf-8", "surrogatepass"), digest_size=8).digest()
+    letters = iter(random.Random(seed).choices(string.ascii_lowercase, k=sum(map(len, words))))
+    return "".join(c if c.isspace() else next(letters) for c in text)
+
+
+def _mask_fields(value: Any) -> Any:
+    if isinstance(value, dict):
+        return {
+            name: mask_text(item) if name in MASKED_FIELDS and isinstance(item, str) else _mask_fields(item)
+            for name, item in value.items()
+        }
+    if isinstance(value, list):
+        return [_mask_fields(item) for item in value]
+    return value
+
+
+def mask_record(record: dict) -> dict:
+    """The built-in redaction hook: masks prompts and generated text throughout a record."""
+    return _mask_fields(record)
+
+
+def load_redactor(spec: str) -> Optional[Redactor]:
+    """Resolves CAPTURE_REDACT: "mask", "none", or a "module:function" hook."""
+    if spec == "mask":
+        return mask_record
+    if spec in ("", "none"):
+        return None
+    module, _, name = spec.partition(":")
+    return getattr(importlib.import_module(module), name)
+
+
+class CaptureWriter:
+    """Appends capture records to rotating, gzip-compressed JSON-lines files.
+
+    Records are queued and written by a background thread, which also runs
+    the redaction hook, so capturing adds little to the request path; when
+    the queue is full the record is dropped and counted. A file is closed
+    once it holds `max_bytes` of compressed data, and only the newest
+    `max_files` files are kept.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        max_bytes: int = 64 * 1024 * 1024,
+        max_files: int = 20,
+        queue_size: int = 10000,
+        redact: Optional[Redactor] = None,
+    ):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_files = max_files
+        self.redact = redact
+        self.queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self.dropped = 0
+        self.written = 0
+        self._raw = None
+        self._file: Optional[gzip.GzipFile] = None
+        self._sequence = 0
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        if self._thread is None:
+            os.makedirs(self.directory, exist_ok=True)
+            self._thread = threading.Thread(target=self._run, name="capture-writer", daemon=True)
+            self._thread.start()
+
+    def write(self, record: dict) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+            CAPTURE_RECORDS.labels("dropped").inc()
+
+    def _open(self) -> None:
+        self._sequence += 1
+        name = f"{_FILE_PREFIX}{time.strftime('%Y%m%dT%H%M%S')}-{os.getpid()}-{self._sequence:05d}{_FILE_SUFFIX}"
+        self._raw = open(os.path.join(self.directory, name), "wb")
+        self._file = gzip.GzipFile(fileobj=self._raw, mode="wb")
+        self._prune()
+
+    def _close_file(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._raw.close()
+            self._file = self._raw = None
+
+    def _prune(self) -> None:
+        files = sorted(capture_files(self.directory), key=os.path.getmtime)
+        for path in files[: max(len(files) - self.max_files, 0)]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def _append(self, record: dict) -> None:
+        if self.redact is not None:
+            record = self.redact(record)
+            if record is None:
+                CAPTURE_RECORDS.labels("redacted").inc()
+                return
+        # Lets readers that need the real prompts (cache warm-up) tell stand-ins apart
+        record["redacted"] = self.redact is not None
+        if self._file is None:
+            self._open()
+        self._file.write(json.dumps(record, separators=(",", ":"), ensure_ascii=False, default=str).encode("utf-8"))
+        self._file.write(b"\n")
+        self.written += 1
+        CAPTURE_RECORDS.labels("written").inc()
+        if self._raw.tell() >= self.max_bytes:
+            self._close_file()
+
+    def _run(self) -> None:
+        while True:
+            record = self.queue.get()
+            if record is None:
+                break
+            try:
+                self._append(record)
+            except Exception as e:
+                logger.warning("Could not write a capture record: %s", e)
+        self._close_file()
+
+    def stop(self) -> None:
+        """Writes out queued records and closes the current file."""
+        if self._thread is not None:
+            self.queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+
+class CaptureMiddleware:
+    """ASGI middleware that records a sample of requests for later replay.
+
+    Each sampled request becomes one record: its arrival time, method, path,
+    selected headers, body, status, response body, time to the response
+    start and total duration, and every upstream call made to serve it (see
+    `record_upstream`). Requests to other paths and WebSocket sessions pass
+    straight through.
+    """
+
+    def __init__(self, app, writer: Optional[CaptureWriter] = None, sample_rates: Optional[dict[str, float]] = None):
+        self.app = app
+        self.writer = writer or get_capture_writer()
+        self.sample_rates = settings.CAPTURE_SAMPLE_RATES if sample_rates is None else sample_rates
+
+    def _sampled(self, route: str) -> bool:
+        rate = self.sample_rates.get(route, settings.CAPTURE_SAMPLE_RATE)
+        return rate >= 1.0 or random.random() < rate
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        route = CAPTURED_ROUTES.get("/" + scope["path"].split("/", 2)[1])
+        if route is None or not self._sampled(route):
+            await self.app(scope, receive, send)
+            return
+
+        headers = {}
+        for name, value in scope["headers"]:
+            name = name.decode("latin-1")
+            if name in CAPTURED_HEADERS:
+                headers[name] = value.decode("latin-1")
+        request_body = bytearray()
+        response_body = bytearray()
+        response = {"status": None, "ttfb": None}
+        arrived = time.time()
+        started = time.monotonic()
+
+        async def capture_receive():
+            message = await receive()
+            if message["type"] == "http.request":
+                request_body.extend(message.get("body", b""))
+            return message
+
+        async def capture_send(message):
+            if message["type"] == "http.response.start":
+                response["status"] = message["status"]
+                response["ttfb"] = time.monotonic() - started
+            elif message["type"] == "http.response.body":
+                response_body.extend(message.get("body", b""))
+            await send(message)
+
+        calls: list = []
+        token = _upstream_calls.set(calls)
+        try:
+            await self.app(scope, capture_receive, capture_send)
+        finally:
+            _upstream_calls.reset(token)
+            self.writer.write(
+                {
+                    "ts": round(arrived, 6),
+                    "route": route,
+                    "method": scope["method"],
+                    "path": scope["path"],
+                    "query": scope.get("query_string", b"").decode("latin-1"),
+                    "headers": headers,
+                    "body": _decode_body(request_body),
+                    "status": response["status"],
+                    "ttfb": None if response["ttfb"] is None else round(response["ttfb"], 6),
+                    "duration": round(time.monotonic() - started, 6),
+                    "response": _decode_body(response_body),
+                    "upstream": calls,
+                }
+            )
+
+
+def _decode_body(body: bytes) -> Any:
+    if not body:
+        return None
+    try:
+        return json.loads(body)
+    except ValueError:
+        return body.decode("utf-8", "replace")
+
+
+def capture_files(directory: str) -> list[str]:
+    """The capture files in `directory`, oldest name first."""
+    return sorted(
+        os.path.join(directory, name)
+        for name in os.listdir(directory)
+        if name.startswith(_FILE_PREFIX) and name.endswith(_FILE_SUFFIX)
+    )
+
+
+def read_capture(paths: Iterable[str]) -> Iterator[dict]:
+    """Yields the records in capture files (or directories of them).
+
+    A file still being written ends in a truncated gzip member; reading
+    stops at its last complete line.
+    """
+    for path in paths:
+        if os.path.isdir(path):
+            yield from read_capture(capture_files(path))
+            continue
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            try:
+                for line in f:
+                    if line.endswith("\n"):
+                        yield json.loads(line)
+            except (EOFError, gzip.BadGzipFile):
+                logger.warning("Capture file %s is truncated; read up to its last complete record", path)
+
+
+_capture_writer: Optional[CaptureWriter] = None
+
+
+def get_capture_writer() -> CaptureWriter:
+    """Returns the process-wide CaptureWriter, started on first use."""
+    global _capture_writer
+    if _capture_writer is None:
+        _capture_writer = CaptureWriter(
+            settings.CAPTURE_DIR,
+            max_bytes=settings.CAPTURE_MAX_FILE_BYTES,
+            max_files=settings.CAPTURE_MAX_FILES,
+            queue_size=settings.CAPTURE_QUEUE_SIZE,
+            redact=load_redactor(settings.CAPTURE_REDACT),
+        )
+        _capture_writer.start()
+    return _capture_writer
+
+
+def stop_capture() -> None:
+    """Flushes queued capture records and stops the background writer."""
+    global _capture_writer
+    if _capture_writer is not None:
+        _capture_writer.stop()
+        _capture_writer = None
+
+
+atexit.register(stop_capture)
@@ -0,0 +1,90 @@
+import ast
+import re
+import time
+from typing import Optional
+
+# Runs in the code pipeline's worker processes: keep this module free of app
+# imports (settings, logging) so workers start quickly and without side effects
+
+# A fenced block: the info string's first word is the language tag. A
+# completion cut off by max_tokens may never close its fence.
+_FENCE = re.compile(r"^```[ \t]*([\w+#.-]*)[^\n]*\n(.*?)(?:^```[ \t]*$|\Z)", re.MULTILINE | re.DOTALL)
+
+# Fence tags that mean the same language
+_ALIASES = {
+    "python": ("python", "py", "python3"),
+    "javascript": ("javascript", "js", "node"),
+    "typescript": ("typescript", "ts"),
+    "shell": ("shell", "sh", "bash", "zsh"),
+    "c++": ("c++", "cpp", "cxx"),
+    "c#": ("c#", "csharp", "cs"),
+}
+
+# Languages with a syntax check and formatter; only these need a worker process
+PROCESSED_LANGUAGES = frozenset({"python"})
+
+
+def extract_code(text: str, language: str) -> str:
+    """The code in a completion: its fenced blocks for `language` (else untagged, else all), or the whole text."""
+    blocks = [(tag.lower(), body) for tag, body in _FENCE.findall(text)]
+    if not blocks:
+        return text.strip("\n")
+    aliases = _ALIASES.get(language, (language,))
+    chosen = (
+        [body for tag, body in blocks if tag in aliases]
+        or [body for tag, body in blocks if not tag]
+        or [body for _, body in blocks]
+    )
+    return "\n\n".join(body.rstrip() for body in chosen)
+
+
+def check_syntax(code: str, language: str) -> Optional[bool]:
+    """Whether `code` parses; None for languages without a checker."""
+    if language != "python":
+        return None
+    try:
+        ast.parse(code)
+    except (SyntaxError, ValueError):
+        return False
+    return True
+
+
+def format_code(code: str, language: str) -> str:
+    """`code` reformatted (black for Python); unchanged if there is no formatter or it fails."""
+    if language != "python":
+        return code
+    import black
+
+    try:
+        return black.format_str(code, mode=black.Mode())
+    except Exception:
+        return code
+
+
+def warm_up() -> None:
+    """Pool initializer: imports the formatter before the first job needs it."""
+    import black  # noqa: F401
+
+
+def process_code(text: str, language: str) -> tuple[str, Optional[bool], dict[str, float]]:
+    """Extracts, checks and (when valid) formats the code in `text`.
+
+    Returns the code, whether it parsed (None if unchecked) and the seconds
+    each stage took, which the caller records since metrics live in the
+    parent process.
+    """
+    timings = {}
+    started = time.perf_counter()
+    code = extract_code(text, language)
+    timings["extract"] = time.perf_counter() - started
+    if language not in PROCESSED_LANGUAGES:
+        return code, None, timings
+
+    started = time.perf_counter()
+    valid = check_syntax(code, language)
+    timings["check"] = time.perf_counter() - started
+    if valid:
+        started = time.perf_counter()
+        code = format_code(code, language)
+        timings["format"] = time.perf_counter() - started
+    return code, valid, timings
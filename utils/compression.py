@@ -0,0 +1,219 @@
+import asyncio
+import gzip
+import zlib
+from typing import Callable, Optional
+
+from prometheus_client import Counter
+from starlette.datastructures import Headers, MutableHeaders
+
+from utils.config import settings
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - "br" is not offered
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - "zstd" is not offered
+    zstandard = None
+
+DEFAULT_LEVELS = {"zstd": 3, "br": 4, "gzip": 6}
+
+_COMPRESSIBLE_TYPES = ("text/", "application/json", "application/x-ndjson", "application/javascript")
+
+COMPRESSED_RESPONSES = Counter("compressed_responses_total", "Responses sent compressed", ["encoding", "mode"])
+COMPRESSION_BYTES = Counter("compression_bytes_total", "Response bytes before and after compression", ["encoding", "stage"])
+
+
+class _GzipStream:
+    def __init__(self, level: int):
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def chunk(self, data: bytes) -> bytes:
+        return self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self, data: bytes) -> bytes:
+        return self._compressor.compress(data) + self._compressor.flush()
+
+
+class _BrotliStream:
+    def __init__(self, level: int):
+        self._compressor = brotli.Compressor(quality=level)
+
+    def chunk(self, data: bytes) -> bytes:
+        return self._compressor.process(data) + self._compressor.flush()
+
+    def finish(self, data: bytes) -> bytes:
+        return self._compressor.process(data) + self._compressor.finish()
+
+
+class _ZstdStream:
+    def __init__(self, level: int):
+        self._compressor = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def chunk(self, data: bytes) -> bytes:
+        return self._compressor.compress(data) + self._compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def finish(self, data: bytes) -> bytes:
+        return self._compressor.compress(data) + self._compressor.flush()
+
+
+class Encoder:
+    """One content coding: a one-shot compressor for whole bodies and a streaming one that flushes every chunk."""
+
+    def __init__(self, name: str, compress: Callable[[bytes], bytes], stream: Callable[[], object]):
+        self.name = name
+        self.compress = compress
+        self.stream = stream
+
+
+def available_encoders(levels: Optional[dict[str, int]] = None) -> dict[str, Encoder]:
+    """The encoders whose libraries are installed, at `levels` (falling back to DEFAULT_LEVELS)."""
+    levels = {**DEFAULT_LEVELS, **(levels or {})}
+    encoders = {
+        "gzip": Encoder(
+            "gzip",
+            lambda data: gzip.compress(data, compresslevel=levels["gzip"], mtime=0),
+            lambda: _GzipStream(levels["gzip"]),
+        )
+    }
+    if brotli is not None:
+        encoders["br"] = Encoder(
+            "br", lambda data: brotli.compress(data, quality=levels["br"]), lambda: _BrotliStream(levels["br"])
+        )
+    if zstandard is not None:
+        # ZstdCompressor objects must not be shared between threads; one per call is cheap
+        encoders["zstd"] = Encoder(
+            "zstd",
+            lambda data: zstandard.ZstdCompressor(level=levels["zstd"]).compress(data),
+            lambda: _ZstdStream(levels["zstd"]),
+        )
+    return encoders
+
+
+def parse_accept_encoding(header: str) -> dict[str, float]:
+    """Maps each coding in an Accept-Encoding header to its q-value."""
+    accepted = {}
+    for item in header.split(","):
+        coding, _, params = item.strip().partition(";")
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        q = 1.0
+        for param in params.split(";"):
+            name, _, value = param.strip().partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        accepted[coding] = q
+    return accepted
+
+
+def _compressible(headers: Headers) -> bool:
+    if "content-encoding" in headers:
+        return False
+    content_type = headers.get("content-type", "").lower()
+    return content_type.startswith(_COMPRESSIBLE_TYPES) or content_type.split(";")[0].endswith("+json")
+
+
+class CompressionMiddleware:
+    """ASGI middleware that compresses responses with the best coding the client accepts.
+
+    Codings are preferred in `preference` order among those the client
+    accepts with the highest q-value. A body sent in one piece is compressed
+    when it is of a compressible type and at least `min_bytes` long; from
+    `offload_bytes` on, compression runs on a worker thread so it doesn't
+    hold up the event loop. A streamed body is compressed chunk by chunk,
+    each chunk flushed to the client as soon as it is produced, so
+    compression adds no delay to the stream.
+    """
+
+    def __init__(
+        self,
+        app,
+        preference: Optional[list[str]] = None,
+        min_bytes: Optional[int] = None,
+        offload_bytes: Optional[int] = None,
+        levels: Optional[dict[str, int]] = None,
+    ):
+        self.app = app
+        self.encoders = available_encoders(settings.COMPRESSION_LEVELS if levels is None else levels)
+        preference = settings.COMPRESSION_ENCODINGS if preference is None else preference
+        self.preference = [name for name in preference if name in self.encoders]
+        self.min_bytes = settings.COMPRESSION_MIN_BYTES if min_bytes is None else min_bytes
+        self.offload_bytes = settings.COMPRESSION_OFFLOAD_BYTES if offload_bytes is None else offload_bytes
+
+    def negotiate(self, accept_encoding: str) -> Optional[Encoder]:
+        accepted = parse_accept_encoding(accept_encoding)
+        wildcard = accepted.get("*", 0.0)
+        best, best_q = None, 0.0
+        for name in self.preference:
+            q = accepted.get(name, wildcard)
+            if q > best_q:
+                best, best_q = name, q
+        return self.encoders[best] if best is not None else None
+
+    async def _compress(self, encoder: Encoder, body: bytes) -> bytes:
+        if len(body) >= self.offload_bytes:
+            return await asyncio.to_thread(encoder.compress, body)
+        return encoder.compress(body)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoder = self.negotiate(Headers(scope=scope).get("accept-encoding", ""))
+        if encoder is None:
+            await self.app(scope, receive, send)
+            return
+
+        start = None
+        stream = None
+
+        async def compress_send(message):
+            nonlocal start, stream
+            if message["type"] == "http.response.start":
+                # Held back until the first body message shows whether the body is streamed
+                start = message
+                return
+            if message["type"] != "http.response.body":
+                await send(message)
+                return
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            if start is not None:
+                headers = MutableHeaders(raw=list(start["headers"]))
+                eligible = start["status"] >= 200 and start["status"] not in (204, 304) and _compressible(headers)
+                if not more_body:
+                    if eligible and len(body) >= self.min_bytes:
+                        compressed = await self._compress(encoder, body)
+                        COMPRESSED_RESPONSES.labels(encoder.name, "whole").inc()
+                        COMPRESSION_BYTES.labels(encoder.name, "in").inc(len(body))
+                        COMPRESSION_BYTES.labels(encoder.name, "out").inc(len(compressed))
+                        body = compressed
+                        headers["content-encoding"] = encoder.name
+                        headers["content-length"] = str(len(body))
+                        headers.add_vary_header("Accept-Encoding")
+                    await send({**start, "headers": headers.raw})
+                    start = None
+                    await send({"type": "http.response.body", "body": body})
+                    return
+                if eligible:
+                    stream = encoder.stream()
+                    COMPRESSED_RESPONSES.labels(encoder.name, "stream").inc()
+                    headers["content-encoding"] = encoder.name
+                    if "content-length" in headers:
+                        del headers["content-length"]
+                    headers.add_vary_header("Accept-Encoding")
+                await send({**start, "headers": headers.raw})
+                start = None
+            if stream is not None:
+                COMPRESSION_BYTES.labels(encoder.name, "in").inc(len(body))
+                body = stream.chunk(body) if more_body else stream.finish(body)
+                COMPRESSION_BYTES.labels(encoder.name, "out").inc(len(body))
+            await send({"type": "http.response.body", "body": body, "more_body": more_body})
+
+        await self.app(scope, receive, compress_send)
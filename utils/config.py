@@ -1,22 +1,198 @@
-from typing import Optional
-from pydantic import BaseSettings, Field
-
-from utils.logger import logger
+from typing import Any, Dict, List, Optional
+from pydantic import Field
+from pydantic_settings import BaseSettings, SettingsConfigDict
 
 
 class Settings(BaseSettings):
     """Application configuration settings."""
 
-    OPENAI_API_KEY: str = Field(..., env="OPENAI_API_KEY")
-    JWT_SECRET: str = Field(..., env="JWT_SECRET")
-    HOST: str = Field("0.0.0.0", env="HOST")
-    PORT: int = Field(8000, env="PORT")
-    DEBUG: bool = Field(False, env="DEBUG")
+    OPENAI_API_KEY: str
+    JWT_SECRET: str
+    HOST: str = "0.0.0.0"
+    PORT: int = 8000
+    DEBUG: bool = False
+
+    # Authentication
+    ALGORITHM: str = "HS256"
+    JWT_PRIVATE_KEY: Optional[str] = None
+    JWT_PUBLIC_KEY: Optional[str] = None
+    AUTH_EXPIRY: int = 3600
+    JWT_CACHE_SIZE: int = 10000
+    JWT_STATELESS_USERS: bool = False
+    JWT_USER_CLAIMS: List[str] = ["scope"]
+    # Revocations reach other workers through the shared store (SHARED_STORE_URL/REDIS_URL),
+    # checked at most this often per token; without a shared store they apply to one worker only
+    JWT_REVOCATION_CHECK_INTERVAL: float = 1.0
+    PASSWORD_HASH_WORKERS: int = 4
+
+    # User store
+    DATABASE_URL: Optional[str] = None
+    DB_POOL_SIZE: int = 10
+    DB_MAX_OVERFLOW: int = 20
+    DB_POOL_TIMEOUT: float = 5.0
+    DB_POOL_RECYCLE: int = 1800
+    USER_CACHE_TTL: float = 60.0
+    USER_CACHE_NEGATIVE_TTL: float = 10.0
+    USER_CACHE_SIZE: int = 10000
+
+    # Token usage accounting. Without USAGE_DATABASE_URL usage goes to usage.db in DATA_DIR;
+    # set it to an empty string to keep usage in memory only
+    DATA_DIR: str = "data"
+    USAGE_DATABASE_URL: Optional[str] = None
+    USAGE_FLUSH_INTERVAL: float = 10.0
+    USAGE_DAILY_TOKEN_QUOTA: int = 0
+    USAGE_QUOTA_OVERRIDES: Dict[str, int] = Field(default_factory=dict)
+
+    # Admission control
+    ADMISSION_LIMITS: Dict[str, Dict[str, float]] = Field(default_factory=dict)
+    ADMISSION_ROUTES: Dict[str, str] = Field(default_factory=dict)
+
+    # API key pool; entries are {"api_key", "organization", "project", "rpm", "tpm"}
+    OPENAI_API_KEYS: List[Dict[str, Any]] = Field(default_factory=list)
+    OPENAI_KEY_RPM: float = 3500
+    OPENAI_KEY_TPM: float = 90000
+    OPENAI_KEY_FAILURE_THRESHOLD: int = 3
+    OPENAI_KEY_COOLDOWN: float = 30.0
+    OPENAI_MAX_CONNECTIONS: int = 100
+
+    # Additional OpenAI-compatible backends; entries are
+    # {"name", "base_url", "api_key", "models", "capacity", "rpm", "tpm"}
+    BACKENDS: List[Dict[str, Any]] = Field(default_factory=list)
+    OPENAI_BACKEND_CAPACITY: int = 256
+    BACKEND_FAILURE_THRESHOLD: int = 3
+    BACKEND_COOLDOWN: float = 15.0
+
+    # Model profiles; MODEL_PROFILES entries override the built-in table by name
+    MODEL_PROFILES_FILE: Optional[str] = None
+    MODEL_PROFILES: List[Dict[str, Any]] = Field(default_factory=list)
+    MODEL_SELECTION_STRATEGY: str = "cheapest"
+
+    # Response cache; the disk layer is shared by all workers on the host (unset the path to disable)
+    RESPONSE_CACHE_PATH: Optional[str] = "cache/responses.db"
+    RESPONSE_CACHE_MAX_BYTES: int = 256 * 1024 * 1024
+    RESPONSE_CACHE_TTL: float = 86400.0
+    RESPONSE_CACHE_MEMORY_SIZE: int = 65536
+    RESPONSE_CACHE_MEMORY_BYTES: int = 64 * 1024 * 1024
+    RESPONSE_CACHE_COMPRESS_THRESHOLD: int = 512
+    RESPONSE_CACHE_MAX_TEMPERATURE: float = 0.0
+
+    # Cache warm-up at startup; the traffic file is JSON lines with "route", "model" and "question",
+    # or a traffic capture file (CAPTURE_ENABLED) written with CAPTURE_REDACT=none
+    CACHE_WARMUP_ENABLED: bool = True
+    CACHE_WARMUP_TRAFFIC_FILE: Optional[str] = None
+    CACHE_WARMUP_TOP_N: int = 200
+    CACHE_WARMUP_CONCURRENCY: int = 4
+    CACHE_WARMUP_BUDGET: float = 30.0
+
+    # Cluster-wide coordination through a shared store: redis://host:port or sqlite:///path
+    # (defaults to REDIS_URL). CLUSTER_RPM/TPM are the organization's limits; 0 disables them.
+    REDIS_URL: Optional[str] = None
+    SHARED_STORE_URL: Optional[str] = None
+    CLUSTER_RPM: float = 0
+    CLUSTER_TPM: float = 0
+    CLUSTER_LEASE_FRACTION: float = 0.02
+    CLUSTER_FALLBACK_SHARE: float = 0.25
+    CLUSTER_SYNC_INTERVAL: float = 1.0
+
+    # Asynchronous jobs (`Prefer: respond-async`). Set JOBS_STORE_PATH (a SQLite file every
+    # worker on the host opens) when running more than one worker, or GET /jobs/{id} only finds
+    # jobs accepted by the worker that answers. Webhooks go only to JOBS_CALLBACK_HOSTS when set
+    # (".example.com" also allows subdomains), otherwise to hosts with public addresses only
+    JOBS_WORKERS: int = 8
+    JOBS_QUEUE_SIZE: int = 1000
+    JOBS_MAX_STORED: int = 10000
+    JOBS_RETENTION: float = 3600.0
+    JOBS_TIMEOUT: float = 300.0
+    JOBS_MAX_WAIT: float = 30.0
+    JOBS_WEBHOOK_RETRIES: int = 3
+    JOBS_WEBHOOK_SECRET: Optional[str] = None
+    JOBS_STORE_PATH: Optional[str] = None
+    JOBS_CALLBACK_HOSTS: List[str] = Field(default_factory=list)
+
+    # WebSocket sessions; each request also takes a slot in its HTTP route's admission class
+    WS_MAX_SESSIONS: int = 1000
+    WS_MAX_CONCURRENT: int = 8
+    WS_CONTEXT_MAX_CHARS: int = 8000
+
+    # Idempotency-Key support; set the path to share keys between the workers of a host
+    IDEMPOTENCY_TTL: float = 86400.0
+    IDEMPOTENCY_MAX_KEYS: int = 10000
+    IDEMPOTENCY_STORE_PATH: Optional[str] = None
+    IDEMPOTENCY_CLAIM_TTL: float = 300.0
+
+    # Traffic capture for replay benchmarks: rotating gzip JSON-lines files under CAPTURE_DIR.
+    # CAPTURE_REDACT is "mask" (same-length stand-ins for prompts and outputs), "none",
+    # or "module:function" for a custom hook that takes a record and returns it or None.
+    CAPTURE_ENABLED: bool = False
+    CAPTURE_DIR: str = "captures"
+    CAPTURE_SAMPLE_RATE: float = 1.0
+    CAPTURE_SAMPLE_RATES: Dict[str, float] = Field(default_factory=dict)
+    CAPTURE_REDACT: str = "mask"
+    CAPTURE_MAX_FILE_BYTES: int = 64 * 1024 * 1024
+    CAPTURE_MAX_FILES: int = 20
+    CAPTURE_QUEUE_SIZE: int = 10000
+
+    # Response compression: the first of COMPRESSION_ENCODINGS that the client accepts is used
+    # (br and zstd need brotli and zstandard). Bodies of at least COMPRESSION_OFFLOAD_BYTES are
+    # compressed on a worker thread.
+    COMPRESSION_ENABLED: bool = True
+    COMPRESSION_ENCODINGS: List[str] = ["zstd", "br", "gzip"]
+    COMPRESSION_MIN_BYTES: int = 1024
+    COMPRESSION_OFFLOAD_BYTES: int = 64 * 1024
+    COMPRESSION_LEVELS: Dict[str, int] = Field(default_factory=dict)
+
+    # Server-side post-processing of /code results: fenced-block extraction, then for Python an
+    # ast syntax check and black formatting in a pool of CODE_PIPELINE_WORKERS processes
+    CODE_PIPELINE_ENABLED: bool = False
+    CODE_PIPELINE_WORKERS: int = 2
+    CODE_PIPELINE_CACHE_SIZE: int = 1024
+    CODE_PIPELINE_TIMEOUT: float = 5.0
+
+    # Health checks: /readyz fails while the worst event-loop lag of the last HEALTH_LAG_WINDOW
+    # samples exceeds HEALTH_MAX_LOOP_LAG seconds, while any admission queue is at least
+    # HEALTH_MAX_QUEUE_FRACTION full, or (with HEALTH_REQUIRE_UPSTREAM) after HEALTH_PROBE_FAILURES
+    # failed upstream probes in a row. Probes run every HEALTH_PROBE_INTERVAL seconds, not per check
+    HEALTH_LAG_INTERVAL: float = 0.5
+    HEALTH_LAG_WINDOW: int = 10
+    HEALTH_MAX_LOOP_LAG: float = 0.25
+    HEALTH_MAX_QUEUE_FRACTION: float = 0.8
+    HEALTH_PROBE_INTERVAL: float = 30.0
+    HEALTH_PROBE_TIMEOUT: float = 5.0
+    HEALTH_PROBE_FAILURES: int = 2
+    HEALTH_REQUIRE_UPSTREAM: bool = True
+
+    # Identical deterministic streams share one upstream call; buffer is per subscriber, in tokens
+    STREAM_FANOUT_BUFFER: int = 256
+
+    # Upstream fair queuing
+    UPSTREAM_MAX_CONCURRENCY: int = 32
+    TENANT_WEIGHTS: Dict[str, float] = Field(default_factory=dict)
+    TENANT_DEFAULT_WEIGHT: float = 1.0
+    TENANT_BURST_TOKENS: float = 2000.0
+    # Tenants with their own metric series (default: those in TENANT_WEIGHTS); the rest share "other"
+    TENANT_METRIC_LABELS: List[str] = Field(default_factory=list)
+
+    # Adaptive per-model concurrency
+    ADAPTIVE_LIMIT_INITIAL: float = 20
+    ADAPTIVE_LIMIT_MIN: float = 1
+    ADAPTIVE_LIMIT_MAX: float = 200
+
+    # Request deadlines (seconds)
+    DEFAULT_DEADLINE: float = 60.0
+    MAX_DEADLINE: float = 300.0
+    ROUTE_DEADLINES: Dict[str, float] = Field(
+        default_factory=lambda: {"generate": 30.0, "translate": 30.0, "question": 60.0, "code": 60.0}
+    )
+
+    # Logging
+    LOG_LEVEL: str = "INFO"
+    LOG_FILE: str = "logs/app.log"
+    LOG_JSON: bool = True
+    LOG_QUEUE_SIZE: int = 10000
+    LOG_PROMPT_MAX_CHARS: int = 200
+    LOG_SAMPLE_RATES: Dict[str, float] = Field(default_factory=dict)
 
-    class Config:
-        env_file = ".env"
-        env_file_encoding = "utf-8"
+    model_config = SettingsConfigDict(env_file=".env", env_file_encoding="utf-8", extra="ignore")
 
 
 settings = Settings()
-logger.info(f"Loaded settings: {settings.json()}")
\ No newline at end of file
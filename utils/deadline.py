@@ -0,0 +1,113 @@
+import asyncio
+import math
+import time
+from typing import Any, Awaitable, Optional, TypeVar
+
+from fastapi import Request
+from prometheus_client import Counter
+
+from utils.config import settings
+from utils.exceptions import ClientDisconnectedError
+from utils.logger import logger
+
+T = TypeVar("T")
+
+DEADLINE_HEADER = "x-request-timeout"
+
+CANCELLED_REQUESTS = Counter(
+    "upstream_cancelled_requests_total", "Upstream calls cancelled because the client left", ["route"]
+)
+CANCELLED_TOKENS = Counter(
+    "upstream_cancelled_tokens_total", "Completion tokens not paid for thanks to cancellation (upper bound)", ["route"]
+)
+CANCELLED_SECONDS = Counter(
+    "upstream_cancelled_seconds_total", "Worker seconds freed by cancelling abandoned upstream calls", ["route"]
+)
+
+# Typical upstream latency per route, used to estimate seconds saved on cancel
+_route_latency: dict[str, float] = {}
+
+
+class Deadline:
+    """An absolute point in time by which a request must be answered."""
+
+    __slots__ = ("expires_at",)
+
+    def __init__(self, timeout: float):
+        self.expires_at = time.monotonic() + timeout
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self) -> bool:
+        return self.remaining() <= 0.0
+
+
+def parse_timeout(value: Any) -> Optional[float]:
+    """Parses a client-supplied timeout, capped at MAX_DEADLINE.
+
+    Returns None unless `value` is a finite, positive number of seconds.
+    """
+    try:
+        timeout = float(value)
+    except (TypeError, ValueError):
+        return None
+    if not math.isfinite(timeout) or timeout <= 0:
+        return None
+    return min(timeout, settings.MAX_DEADLINE)
+
+
+def get_deadline(request: Request) -> Deadline:
+    """Builds the request deadline from the `X-Request-Timeout` header or the route default."""
+    route = request.url.path.strip("/").split("/", 1)[0]
+    timeout = settings.ROUTE_DEADLINES.get(route, settings.DEFAULT_DEADLINE)
+    header = request.headers.get(DEADLINE_HEADER)
+    if header:
+        parsed = parse_timeout(header)
+        if parsed is None:
+            logger.warning("Ignoring invalid %s header: %s", DEADLINE_HEADER, header)
+        else:
+            timeout = parsed
+    return Deadline(timeout)
+
+
+async def _wait_for_disconnect(request: Request) -> None:
+    while True:
+        message = await request.receive()
+        if message["type"] == "http.disconnect":
+            return
+
+
+async def run_cancellable(request: Request, route: str, max_tokens: int, call: Awaitable[T]) -> T:
+    """Awaits `call`, cancelling it as soon as the client disconnects.
+
+    The request body must already have been read (FastAPI does this when it
+    parses the body model), so the only message left to receive is the
+    disconnect.
+
+    Raises:
+        ClientDisconnectedError: If the client went away before `call` finished.
+    """
+    started = time.monotonic()
+    call_task = asyncio.ensure_future(call)
+    watcher = asyncio.ensure_future(_wait_for_disconnect(request))
+    try:
+        await asyncio.wait({call_task, watcher}, return_when=asyncio.FIRST_COMPLETED)
+    except asyncio.CancelledError:
+        call_task.cancel()
+        raise
+    finally:
+        watcher.cancel()
+    if call_task.done():
+        elapsed = time.monotonic() - started
+        previous = _route_latency.get(route, elapsed)
+        _route_latency[route] = 0.9 * previous + 0.1 * elapsed
+        return call_task.result()
+
+    call_task.cancel()
+    elapsed = time.monotonic() - started
+    CANCELLED_REQUESTS.labels(route).inc()
+    CANCELLED_TOKENS.labels(route).inc(max_tokens)
+    CANCELLED_SECONDS.labels(route).inc(max(0.0, _route_latency.get(route, elapsed) - elapsed))
+    logger.info("Client disconnected; cancelled upstream call", extra={"route": route, "elapsed": elapsed})
+    raise ClientDisconnectedError()
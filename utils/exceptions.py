@@ -27,4 +27,35 @@ class DatabaseError(APIError):
 class NotFoundError(APIError):
     def __init__(self, message: str = "Resource not found.", details: dict = None):
         super().__init__(message, status_code=status.HTTP_404_NOT_FOUND)
-        self.details = details
\ No newline at end of file
+        self.details = details
+
+class QuotaExceededError(APIError):
+    def __init__(self, message: str = "Token quota exceeded.", details: dict = None):
+        super().__init__(message, status_code=status.HTTP_429_TOO_MANY_REQUESTS)
+        self.details = details
+
+class DeadlineExceededError(APIError):
+    def __init__(self, message: str = "Request deadline exceeded.", details: dict = None):
+        super().__init__(message, status_code=status.HTTP_504_GATEWAY_TIMEOUT)
+        self.details = details
+
+class ClientDisconnectedError(APIError):
+    def __init__(self, message: str = "Client disconnected.", details: dict = None):
+        # 499 is the de-facto "client closed request" code; nobody reads the response
+        super().__init__(message, status_code=499)
+        self.details = details
+
+class JobQueueFullError(APIError):
+    def __init__(self, message: str = "Too many queued jobs, try again later.", details: dict = None):
+        super().__init__(message, status_code=status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.details = details
+
+class SlowConsumerError(APIError):
+    def __init__(self, message: str = "Client fell too far behind the shared stream.", details: dict = None):
+        super().__init__(message, status_code=status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.details = details
+
+class IdempotencyKeyMismatchError(APIError):
+    def __init__(self, message: str = "Idempotency-Key was already used with a different request body.", details: dict = None):
+        super().__init__(message, status_code=status.HTTP_422_UNPROCESSABLE_ENTITY)
+        self.details = details
@@ -1,16 +1,120 @@
+import atexit
+import hashlib
+import json
 import logging
-from logging.handlers import RotatingFileHandler
+import os
+import queue
+import random
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 from typing import Optional
 
 from utils.config import settings
 
+# Fields that may carry user prompts; they are truncated and fingerprinted
+# before they reach any sink.
+PROMPT_FIELDS = ("prompt", "question", "text")
+
+# Attributes every LogRecord carries; anything else was passed via `extra`.
+_RESERVED_ATTRS = frozenset(
+    vars(logging.LogRecord("", 0, "", 0, "", None, None)).keys()
+) | {"message", "asctime"}
+
+
+class JsonFormatter(logging.Formatter):
+    """Renders a record and its `extra` fields as a single JSON line."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        payload = {
+            "ts": self.formatTime(record, "%Y-%m-%dT%H:%M:%S"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RESERVED_ATTRS and not key.startswith("_"):
+                payload[key] = value
+        if record.exc_info:
+            payload["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(payload, default=str, ensure_ascii=False)
+
+
+class PromptRedactionFilter(logging.Filter):
+    """Truncates prompt fields and attaches a short digest of the full value.
+
+    Attached to the sink handlers, so the work runs on the listener thread
+    rather than on the request path. The record is shared by every sink, so
+    it is redacted once and marked; later sinks see the same digests.
+    """
+
+    def __init__(self, max_chars: int):
+        super().__init__()
+        self.max_chars = max_chars
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if getattr(record, "_prompt_redacted", False):
+            return True
+        record._prompt_redacted = True
+        for field in PROMPT_FIELDS:
+            value = record.__dict__.get(field)
+            if not isinstance(value, str):
+                continue
+            digest = hashlib.blake2b(value.encode("utf-8", "surrogatepass"), digest_size=8)
+            setattr(record, f"{field}_sha", digest.hexdigest())
+            setattr(record, f"{field}_len", len(value))
+            if len(value) > self.max_chars:
+                setattr(record, field, value[: self.max_chars] + "...")
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """Keeps only a fraction of INFO-and-below records per route.
+
+    Records are matched on their `route` extra field; warnings and errors are
+    never sampled out.
+    """
+
+    def __init__(self, rates: dict[str, float]):
+        super().__init__()
+        self.rates = rates
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > logging.INFO:
+            return True
+        rate = self.rates.get(getattr(record, "route", None), 1.0)
+        return rate >= 1.0 or random.random() < rate
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """Hands records to the listener thread without formatting or blocking.
+
+    The stock `QueueHandler.prepare` formats the message eagerly so records
+    can be pickled; the queue here is in-process, so formatting is deferred
+    to the listener. When the queue is full the record is dropped and counted.
+    """
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
 # Create a custom logger
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.INFO)
+logger.setLevel(logging.DEBUG if settings.DEBUG else settings.LOG_LEVEL)
+logger.propagate = False
 
 # Create a rotating file handler
+os.makedirs(os.path.dirname(settings.LOG_FILE) or ".", exist_ok=True)
 file_handler = RotatingFileHandler(
-    "logs/app.log",
+    settings.LOG_FILE,
     maxBytes=1024 * 1024 * 10,  # 10MB
     backupCount=5,  # Keep 5 backup files
 )
@@ -21,15 +125,36 @@ console_handler = logging.StreamHandler()
 console_handler.setLevel(logging.DEBUG if settings.DEBUG else logging.INFO)
 
 # Format the logs
-formatter = logging.Formatter(
-    "%(asctime)s - %(name)s - %(levelname)s - %(message)s", "%Y-%m-%d %H:%M:%S"
-)
-file_handler.setFormatter(formatter)
-console_handler.setFormatter(formatter)
+if settings.LOG_JSON:
+    formatter = JsonFormatter()
+else:
+    formatter = logging.Formatter(
+        "%(asctime)s - %(name)s - %(levelname)s - %(message)s", "%Y-%m-%d %H:%M:%S"
+    )
+redaction_filter = PromptRedactionFilter(settings.LOG_PROMPT_MAX_CHARS)
+for handler in (file_handler, console_handler):
+    handler.setFormatter(formatter)
+    handler.addFilter(redaction_filter)
+
+# Route records through a bounded queue; a background thread owns the sinks
+log_queue: queue.Queue = queue.Queue(maxsize=settings.LOG_QUEUE_SIZE)
+queue_handler = NonBlockingQueueHandler(log_queue)
+queue_handler.addFilter(SamplingFilter(settings.LOG_SAMPLE_RATES))
+logger.addHandler(queue_handler)
+
+listener = QueueListener(log_queue, file_handler, console_handler, respect_handler_level=True)
+listener.start()
+
+
+def stop_logging() -> None:
+    """Flushes queued records and stops the background writer."""
+    global listener
+    if listener is not None:
+        listener.stop()
+        listener = None
+
 
-# Add handlers to the logger
-logger.addHandler(file_handler)
-logger.addHandler(console_handler)
+atexit.register(stop_logging)
 
 # Define custom logger methods for different log levels
 def info(message: str, extra: Optional[dict] = None):
@@ -45,4 +170,4 @@ def error(message: str, extra: Optional[dict] = None):
     logger.error(message, extra=extra)
 
 def critical(message: str, extra: Optional[dict] = None):
-    logger.critical(message, extra=extra)
\ No newline at end of file
+    logger.critical(message, extra=extra)
@@ -0,0 +1,31 @@
+from typing import Any
+
+from fastapi import Response
+from pydantic import TypeAdapter
+
+# One adapter per body type, built on first use; building one compiles its
+# serializer, which is far more expensive than using it
+_adapters: dict[type, TypeAdapter] = {}
+
+
+def adapter_for(body_type: type) -> TypeAdapter:
+    """The cached TypeAdapter for `body_type`."""
+    adapter = _adapters.get(body_type)
+    if adapter is None:
+        adapter = _adapters[body_type] = TypeAdapter(body_type)
+    return adapter
+
+
+class PydanticJSONResponse(Response):
+    """A response body serialized straight to JSON bytes by pydantic-core.
+
+    Returning the model wrapped in this response skips FastAPI's
+    `response_model` handling, which validates the returned model again,
+    converts it with `jsonable_encoder` and then runs `json.dumps`. The
+    routes keep `response_model` for the OpenAPI schema.
+    """
+
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return adapter_for(type(content)).dump_json(content)